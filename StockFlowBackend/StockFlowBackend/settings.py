@@ -43,6 +43,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     'products_app',
     'authentication_app',
@@ -80,6 +81,7 @@ CORS_ALLOW_HEADERS = [
     'user-agent',
     "X-CSRFToken",
     "x-requested-with",
+    "idempotency-key",
 ]
 
 MIDDLEWARE = [
@@ -95,14 +97,41 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'StockFlowBackend.urls'
 
-# REST_FRAMEWORK = {
-#     'DEFAULT_AUTHENTICATION_CLASSES': [
-#         'rest_framework.authentication.SessionAuthentication',
-#     ],
-#     'DEFAULT_PERMISSION_CLASSES': [
-#         'rest_framework.permissions.IsAuthenticated',
-#     ]
-# }
+REST_FRAMEWORK = {
+    # 'DEFAULT_AUTHENTICATION_CLASSES': [
+    #     'rest_framework.authentication.SessionAuthentication',
+    # ],
+    # 'DEFAULT_PERMISSION_CLASSES': [
+    #     'rest_framework.permissions.IsAuthenticated',
+    # ]
+    'DEFAULT_PAGINATION_CLASS': 'products_app.pagination.StandardResultsSetPagination',
+    'PAGE_SIZE': 50,
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # With several worker processes, point the taxonomy cache at a shared backend so
+    # an edit in one worker invalidates the others, e.g.
+    # 'taxonomy': {
+    #     'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+    #     'LOCATION': BASE_DIR / 'cache' / 'taxonomy',
+    # },
+}
+
+# Cache alias and entry lifetime (seconds) for the category/subcategory/variant/option taxonomy
+TAXONOMY_CACHE_ALIAS = 'default'
+TAXONOMY_CACHE_TIMEOUT = 300
+
+# Seconds the dashboard's live low-stock count is cached; the alert worker also drops it after each batch
+LOW_STOCK_COUNT_TIMEOUT = 60
+
+# Seconds an Idempotency-Key on a stock write is honoured; prune_idempotency_keys deletes older ones
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+
+# Seconds a stock reservation holds its units unless the request asks otherwise
+STOCK_RESERVATION_TTL = 15 * 60
 
 TEMPLATES = [
     {
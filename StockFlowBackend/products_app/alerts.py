@@ -0,0 +1,149 @@
+"""
+Low-stock alert evaluation and notification.
+
+Stock writes only queue the variants they touched (LowStockCheck, filled
+after commit); the process_low_stock_alerts worker drains the queue in
+batches, compares the queued variants against their effective thresholds
+(ProductVariantItem.objects.low_stock) in a few set-based queries and hands
+the variants that need attention to every configured notification backend.
+Backends get ProductVariantItem objects carrying low_stock_threshold, with
+their product loaded.
+
+A variant notifies once when it falls to or below its threshold, then stays
+quiet until the stock recovers (which clears last_notified) or, if
+LOW_STOCK_RENOTIFY_AFTER is set, until that many seconds have passed.
+Variants alerting on a subcategory or category default get a LowStockAlert
+that inherits the threshold, to hold last_notified.
+
+The dashboard's low-stock figure (low_stock_count) is counted live and cached
+until the worker next processes a batch.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.mail import send_mail
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import LowStockAlert, LowStockCheck, ProductVariantItem
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_NOTIFICATION_BACKENDS = ["products_app.alerts.LoggingNotificationBackend"]
+
+LOW_STOCK_COUNT_KEY = "alerts:low_stock_count"
+
+
+class LoggingNotificationBackend:
+    """
+    Log one warning per variant to the products_app.alerts logger
+    """
+
+    def send(self, variants):
+        for variant in variants:
+            logger.warning(
+                "Low stock: %s has %s left (threshold %s)",
+                variant.product_code, variant.quantity, variant.low_stock_threshold
+            )
+
+
+class EmailNotificationBackend:
+    """
+    Email each batch of low-stock variants to LOW_STOCK_ALERT_RECIPIENTS
+    """
+
+    def send(self, variants):
+        recipients = getattr(settings, "LOW_STOCK_ALERT_RECIPIENTS", [])
+        if not recipients:
+            return
+        lines = [
+            f"{variant.product.name} ({variant.product_code}): "
+            f"{variant.quantity} left, threshold {variant.low_stock_threshold}"
+            for variant in variants
+        ]
+        send_mail(f"Low stock on {len(variants)} variants", "\n".join(lines), None, recipients)
+
+
+def notification_backends():
+    return [
+        import_string(path)()
+        for path in getattr(settings, "LOW_STOCK_NOTIFICATION_BACKENDS", DEFAULT_NOTIFICATION_BACKENDS)
+    ]
+
+
+def evaluate_low_stock(variant_ids, now=None):
+    """
+    Compare the given variants against their effective thresholds: clear
+    last_notified where stock has recovered, stamp it on the variants that are
+    due and return those variants
+    """
+    now = now or timezone.now()
+    low = ProductVariantItem.objects.low_stock().filter(pk__in=variant_ids)
+
+    LowStockAlert.objects.filter(product_variant__in=variant_ids, last_notified__isnull=False).exclude(
+        product_variant__in=low.values("pk")
+    ).update(last_notified=None, updated_at=now)
+
+    due = Q(lowstockalert__isnull=True) | Q(lowstockalert__last_notified__isnull=True)
+    renotify_after = getattr(settings, "LOW_STOCK_RENOTIFY_AFTER", None)
+    if renotify_after:
+        due |= Q(lowstockalert__last_notified__lte=now - timedelta(seconds=renotify_after))
+    variants = list(low.filter(due).select_related("product", "lowstockalert"))
+
+    LowStockAlert.objects.filter(product_variant__in=[variant.pk for variant in variants]).update(
+        last_notified=now, updated_at=now
+    )
+    LowStockAlert.objects.bulk_create(
+        [
+            LowStockAlert(product_variant=variant, threshold=None, last_notified=now)
+            for variant in variants if not hasattr(variant, "lowstockalert")
+        ],
+        ignore_conflicts=True
+    )
+    return variants
+
+
+def low_stock_count():
+    """
+    Return the number of variants at or below their threshold and when it was
+    counted. Unlike the other dashboard figures this is not a running counter,
+    as a change to a subcategory or category default moves many variants at
+    once: it is counted live and cached for LOW_STOCK_COUNT_TIMEOUT seconds
+    (60 by default), or until the worker processes its next batch.
+    """
+    counted = cache.get(LOW_STOCK_COUNT_KEY)
+    if counted is None:
+        counted = (ProductVariantItem.objects.low_stock().count(), timezone.now())
+        cache.set(LOW_STOCK_COUNT_KEY, counted, timeout=getattr(settings, "LOW_STOCK_COUNT_TIMEOUT", 60))
+    return counted
+
+
+def process_low_stock_checks(batch_size=500, backends=None):
+    """
+    Claim up to batch_size queued variants, evaluate them and send the due
+    alerts, returning the number of variants processed. Claimed rows are
+    locked with SKIP LOCKED, so several workers can run side by side, and
+    everything happens in one transaction: if a backend fails, the claim and
+    the last_notified stamps roll back and the batch is retried.
+    """
+    backends = notification_backends() if backends is None else backends
+    with transaction.atomic():
+        variant_ids = list(
+            LowStockCheck.objects.select_for_update(skip_locked=True).order_by("queued_at")
+            .values_list("product_variant_id", flat=True)[:batch_size]
+        )
+        if not variant_ids:
+            return 0
+        LowStockCheck.objects.filter(pk__in=variant_ids).delete()
+
+        variants = evaluate_low_stock(variant_ids)
+        if variants:
+            for backend in backends:
+                backend.send(variants)
+    # The batch may have moved variants across their thresholds
+    cache.delete(LOW_STOCK_COUNT_KEY)
+    return len(variant_ids)
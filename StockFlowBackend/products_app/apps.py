@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class ProductsAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'products_app'
+
+    def ready(self):
+        # Register the taxonomy cache invalidation signals
+        from . import taxonomy  # noqa: F401
@@ -0,0 +1,509 @@
+"""
+Endpoint benchmarks for products_app.
+
+Seeds a synthetic catalogue, requests every route registered on the
+products_app router and records query counts, latency percentiles and
+response sizes, so they can be compared against the checked-in budgets in
+benchmark_budgets.json. Used by the benchmark_endpoints management command
+and by the query budget tests; benchmark_valuation times the valuation engine
+over the same seeded ledger.
+"""
+import datetime
+import json
+import random
+import time
+from decimal import Decimal
+from itertools import islice, product as combinations
+from pathlib import Path
+from urllib.parse import urlencode
+
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .alerts import LOW_STOCK_COUNT_KEY
+from .models import *
+from .taxonomy import taxonomy_cache
+from .urls import router
+from .valuation import build_checkpoints, value_inventory
+
+BUDGETS_PATH = Path(__file__).resolve().parent / "benchmark_budgets.json"
+
+SCALES = {
+    # Small enough for the test suite; query counts must not depend on scale
+    "small": {"products": 20, "variants_per_product": 5, "transactions": 500},
+    "full": {"products": 2000, "variants_per_product": 10, "transactions": 1000000},
+}
+
+CATEGORIES = 10
+SUBCATEGORIES_PER_CATEGORY = 5
+OPTIONS_PER_VARIANT = 20
+BATCH_SIZE = 5000
+
+
+def batched(iterable, size=BATCH_SIZE):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def seed_catalogue(user, products, variants_per_product, transactions, seed=0):
+    """
+    Bulk-load a synthetic catalogue: categories, subcategories with Size and
+    Colour variants, products with configured variant items, low stock alerts,
+    a stock ledger and a second location. Returns the fixtures the route
+    requests refer to.
+    """
+    rng = random.Random(seed)
+
+    categories = Category.objects.bulk_create([Category(name=f"Category {c}") for c in range(CATEGORIES)])
+    subcategories = SubCategory.objects.bulk_create([
+        SubCategory(category=category, name=f"Subcategory {s}")
+        for category in categories for s in range(SUBCATEGORIES_PER_CATEGORY)
+    ])
+    variants = Variant.objects.bulk_create([
+        Variant(subcategory=subcategory, name=name)
+        for subcategory in subcategories for name in ("Size", "Colour")
+    ])
+    options = VariantOption.objects.bulk_create([
+        VariantOption(variant=variant, option=f"{variant.name} {o}")
+        for variant in variants for o in range(OPTIONS_PER_VARIANT)
+    ])
+    options_by_variant = {}
+    for option in options:
+        options_by_variant.setdefault(option.variant_id, []).append(option)
+    # Every (size, colour) pair of a subcategory is a distinct configuration
+    pairs_by_subcategory = {
+        subcategory.id: list(combinations(options_by_variant[size.id], options_by_variant[colour.id]))
+        for subcategory, size, colour in zip(subcategories, variants[0::2], variants[1::2])
+    }
+
+    product_rows = []
+    for number in range(products):
+        subcategory = subcategories[number % len(subcategories)]
+        product_rows.append(Product(
+            name=f"Product {number}",
+            subcategory=subcategory,
+            created_by=user,
+            hsn_code=f"{6100 + number % 100}",
+        ))
+    for batch in batched(product_rows):
+        Product.objects.bulk_create(batch)
+
+    items = []
+    configurations = []
+    for product in product_rows:
+        for pair in pairs_by_subcategory[product.subcategory_id][:variants_per_product]:
+            quantity = rng.randint(1, 200)
+            item = ProductVariantItem(
+                product=product,
+                product_code=f"{product.product_id}-{pair[0].option[-2:]}-{pair[1].option[-2:]}".replace(" ", ""),
+                quantity=quantity,
+                price=Decimal(rng.randint(100, 10000)) / 100,
+                hsn_code=product.hsn_code,
+                configuration_signature=ProductVariantItem.build_configuration_signature([o.id for o in pair]),
+            )
+            product.total_stock += quantity
+            items.append(item)
+            configurations.extend(ProductConfiguration(product_item=item, variant_option=o) for o in pair)
+    for batch in batched(items):
+        ProductVariantItem.objects.bulk_create(batch)
+    for batch in batched(configurations):
+        ProductConfiguration.objects.bulk_create(batch)
+    LocationStock.stock_opening(items)
+    Product.objects.bulk_update(product_rows, ["total_stock"], batch_size=BATCH_SIZE)
+
+    LowStockAlert.objects.bulk_create(
+        [LowStockAlert(product_variant=item, threshold=rng.randint(5, 50)) for item in items[1::2]],
+        batch_size=BATCH_SIZE,
+    )
+
+    def ledger():
+        for _ in range(transactions):
+            item = items[rng.randrange(len(items))]
+            transaction_type = rng.choice(("add", "remove"))
+            yield StockTransaction(
+                product_variant=item,
+                quantity=rng.randint(1, 20),
+                transaction_type=transaction_type,
+                user=user,
+                reference_number=f"GRN-{rng.randint(1, 5000)}",
+                unit_cost=(item.price * rng.randint(50, 90) / 100).quantize(Decimal("0.0001"))
+                if transaction_type == "add" else None,
+            )
+    # bulk_create bypasses StockTransaction.save(), so seeding does not move stock
+    for batch in batched(ledger()):
+        StockTransaction.objects.bulk_create(batch)
+
+    # bulk_create does not send the signals that invalidate the taxonomy cache
+    # or rebuild search documents and variant listings
+    taxonomy_cache.invalidate()
+    cache.delete(LOW_STOCK_COUNT_KEY)
+    Product.refresh_search_documents(product.id for product in product_rows)
+    VariantListing.refresh(item.id for item in items)
+    CategoryStockSummary.rebuild()
+    # One open hold, for the reservation routes to commit and release
+    reservations, errors = StockReservation.reserve(
+        [(items[0].pk, 1)], expires_at=timezone.now() + datetime.timedelta(days=1), user=user, reference_number="SO-1"
+    )
+
+    stock_transaction = StockTransaction.objects.filter(product_variant=items[0]).first() or StockTransaction.objects.first()
+    # A second location holding one unit moved out of the default one, and an empty one
+    store = Location.objects.create(name="Benchmark store", code="STORE")
+    StockTransaction.objects.create(
+        product_variant=items[0], quantity=1, transaction_type="transfer", user=user,
+        source_location_id=Location.default_id(), destination_location=store,
+    )
+    spare_location = Location.objects.create(name="Benchmark spare", code="SPARE")
+
+    fixture_product = product_rows[0]
+    used_pairs = pairs_by_subcategory[fixture_product.subcategory_id][:variants_per_product]
+    free_pairs = pairs_by_subcategory[fixture_product.subcategory_id][variants_per_product:]
+    item = items[0]
+    return {
+        "user": user,
+        "category": categories[0],
+        "subcategory": fixture_product.subcategory,
+        "variant": variants[0],
+        "option": options[0],
+        "product": fixture_product,
+        "item": item,
+        "alerted_item": items[1],
+        "spare_option": used_pairs[1][1],
+        "configuration": ProductConfiguration.objects.filter(product_item=item).first(),
+        "stock_transaction": stock_transaction,
+        "alert": LowStockAlert.objects.get(product_variant=items[1]),
+        "reservation": reservations[0],
+        # Lines of a 50-line order, none of them already held
+        "order_items": items[1:51],
+        "free_pairs": free_pairs,
+        "location": store,
+        "spare_location": spare_location,
+    }
+
+
+def spread_ledger(days):
+    """
+    Backdate the seeded ledger evenly over the days before today, oldest rows first
+    """
+    ids = list(StockTransaction.objects.order_by("timestamp", "id").values_list("id", flat=True))
+    today = timezone.localdate()
+    per_day = -(-len(ids) // days)
+    for day in range(days):
+        moment = day_start(today - datetime.timedelta(days=days - day)) + datetime.timedelta(hours=12)
+        for batch in batched(ids[day * per_day:(day + 1) * per_day]):
+            StockTransaction.objects.filter(pk__in=batch).update(timestamp=moment)
+
+
+def time_valuation(days):
+    """
+    Spread the ledger over days, then time valuing every variant by replaying the
+    whole ledger, building cost checkpoints through yesterday and valuing from
+    them. Returns the timings in seconds and the FIFO and weighted-average totals
+    of both valuations, which must agree.
+    """
+    spread_ledger(days)
+    timings = {"transactions": StockTransaction.objects.count()}
+
+    def totals(states):
+        return (
+            sum(state.fifo_value for state in states.values()),
+            sum(state.average_value for state in states.values()),
+        )
+
+    started = time.perf_counter()
+    replayed = totals(value_inventory())
+    timings["full_replay_s"] = round(time.perf_counter() - started, 2)
+
+    started = time.perf_counter()
+    timings["checkpoints"] = build_checkpoints()
+    timings["build_checkpoints_s"] = round(time.perf_counter() - started, 2)
+
+    started = time.perf_counter()
+    checkpointed = totals(value_inventory())
+    timings["from_checkpoints_s"] = round(time.perf_counter() - started, 2)
+    return timings, replayed, checkpointed
+
+
+def router_routes():
+    """
+    Return (method, route name) for every route registered on the products_app router
+    """
+    routes = []
+    for prefix, viewset, basename in router.registry:
+        for route in router.get_routes(viewset):
+            for method in router.get_method_map(viewset, route.mapping):
+                routes.append((method.upper(), route.name.format(basename=basename)))
+    return routes
+
+
+def route_requests(f):
+    """
+    Map (method, route name) to the (path, payload) used to benchmark it
+    """
+    def url(name, *args):
+        return reverse(name, args=args)
+
+    def variant_payload(pair, **extra):
+        return {"quantity": 5, "price": "19.99", "variant_options": [str(o.id) for o in pair], **extra}
+
+    item, product = f["item"], f["product"]
+    created = product.created_at.isoformat()
+    item_options = [str(c.variant_option_id) for c in item.configurations.all()]
+    new_items = [
+        variant_payload(pair, product_code=f"{product.product_id}-BULK-{number}")
+        for number, pair in enumerate(f["free_pairs"][1:21])
+    ]
+    requests = {
+        ("GET", "category-list"): (url("category-list"), None),
+        ("POST", "category-list"): (url("category-list"), {"name": "Benchmark category"}),
+        ("GET", "category-detail"): (url("category-detail", f["category"].pk), None),
+        ("PUT", "category-detail"): (url("category-detail", f["category"].pk), {"name": "Renamed"}),
+        ("PATCH", "category-detail"): (url("category-detail", f["category"].pk), {"name": "Renamed"}),
+        ("DELETE", "category-detail"): (url("category-detail", f["category"].pk), None),
+
+        ("GET", "sub_category-list"): (url("sub_category-list") + f"?category={f['category'].pk}", None),
+        ("POST", "sub_category-list"): (url("sub_category-list"), {"category": str(f["category"].pk), "name": "Benchmark"}),
+        ("GET", "sub_category-detail"): (url("sub_category-detail", f["subcategory"].pk), None),
+        ("PUT", "sub_category-detail"): (
+            url("sub_category-detail", f["subcategory"].pk),
+            {"category": str(f["subcategory"].category_id), "name": "Renamed"},
+        ),
+        ("PATCH", "sub_category-detail"): (url("sub_category-detail", f["subcategory"].pk), {"name": "Renamed"}),
+        ("DELETE", "sub_category-detail"): (url("sub_category-detail", f["subcategory"].pk), None),
+
+        ("GET", "variant-list"): (url("variant-list") + f"?subcategory={f['subcategory'].pk}", None),
+        ("POST", "variant-list"): (url("variant-list"), {"subcategory": str(f["subcategory"].pk), "name": "Fit"}),
+        ("GET", "variant-detail"): (url("variant-detail", f["variant"].pk), None),
+        ("PUT", "variant-detail"): (
+            url("variant-detail", f["variant"].pk),
+            {"subcategory": str(f["variant"].subcategory_id), "name": "Renamed"},
+        ),
+        ("PATCH", "variant-detail"): (url("variant-detail", f["variant"].pk), {"name": "Renamed"}),
+        ("DELETE", "variant-detail"): (url("variant-detail", f["variant"].pk), None),
+
+        ("GET", "variant-options-list"): (url("variant-options-list") + f"?variant={f['variant'].pk}", None),
+        ("POST", "variant-options-list"): (url("variant-options-list"), {"variant": str(f["variant"].pk), "option": "XXL"}),
+        ("GET", "variant-options-detail"): (url("variant-options-detail", f["option"].pk), None),
+        ("PUT", "variant-options-detail"): (
+            url("variant-options-detail", f["option"].pk),
+            {"variant": str(f["option"].variant_id), "option": "Renamed"},
+        ),
+        ("PATCH", "variant-options-detail"): (url("variant-options-detail", f["option"].pk), {"option": "Renamed"}),
+        ("DELETE", "variant-options-detail"): (url("variant-options-detail", f["option"].pk), None),
+
+        ("GET", "product-list"): (url("product-list"), None),
+        ("POST", "product-list"): (
+            url("product-list"), {"name": "Benchmark product", "subcategory": str(f["subcategory"].pk), "hsn_code": "6105"}
+        ),
+        ("GET", "product-search"): (url("product-search") + f"?q={product.product_id}", None),
+        ("GET", "product-export"): (
+            url("product-export") + f"?output=csv&{urlencode({'start_date': created, 'end_date': created})}", None
+        ),
+        ("GET", "product-detail"): (url("product-detail", product.pk), None),
+        ("PUT", "product-detail"): (
+            url("product-detail", product.pk), {"name": "Renamed", "subcategory": str(product.subcategory_id)}
+        ),
+        ("PATCH", "product-detail"): (url("product-detail", product.pk), {"is_favourite": True}),
+        ("DELETE", "product-detail"): (url("product-detail", product.pk), None),
+
+        ("GET", "productvariantitem-list"): (url("productvariantitem-list"), None),
+        ("GET", "productvariantitem-export"): (
+            url("productvariantitem-export") + f"?output=csv&product={product.pk}", None
+        ),
+        ("POST", "productvariantitem-list"): (
+            url("productvariantitem-list"), variant_payload(f["free_pairs"][0], product=str(product.pk))
+        ),
+        ("GET", "productvariantitem-detail"): (url("productvariantitem-detail", item.pk), None),
+        ("PUT", "productvariantitem-detail"): (
+            url("productvariantitem-detail", item.pk),
+            {"product": str(product.pk), "quantity": item.quantity + 1, "price": "21.00", "variant_options": item_options},
+        ),
+        ("PATCH", "productvariantitem-detail"): (url("productvariantitem-detail", item.pk), {"price": "21.00"}),
+        ("DELETE", "productvariantitem-detail"): (url("productvariantitem-detail", item.pk), None),
+        ("POST", "productvariantitem-bulk-create"): (
+            url("productvariantitem-bulk-create"), {"items": [dict(i, product=str(product.pk)) for i in new_items]}
+        ),
+        ("POST", "productvariantitem-add-to-product"): (
+            url("productvariantitem-add-to-product", product.pk), {"items": new_items}
+        ),
+        ("GET", "productvariantitem-by-product"): (url("productvariantitem-by-product", product.pk), None),
+        ("GET", "productvariantitem-locations"): (url("productvariantitem-locations", item.pk), None),
+        ("PUT", "productvariantitem-adjust-stock"): (
+            url("productvariantitem-adjust-stock", item.pk), {"quantity_change": 1}
+        ),
+
+        ("GET", "productconfiguration-list"): (url("productconfiguration-list"), None),
+        ("POST", "productconfiguration-list"): (
+            url("productconfiguration-list"), {"product_item": str(item.pk), "variant_option": str(f["spare_option"].pk)}
+        ),
+        ("GET", "productconfiguration-detail"): (url("productconfiguration-detail", f["configuration"].pk), None),
+        ("PUT", "productconfiguration-detail"): (
+            url("productconfiguration-detail", f["configuration"].pk),
+            {"product_item": str(item.pk), "variant_option": str(f["configuration"].variant_option_id)},
+        ),
+        ("PATCH", "productconfiguration-detail"): (
+            url("productconfiguration-detail", f["configuration"].pk),
+            {"variant_option": str(f["configuration"].variant_option_id)},
+        ),
+        ("DELETE", "productconfiguration-detail"): (url("productconfiguration-detail", f["configuration"].pk), None),
+        ("GET", "productconfiguration-by-variant-item"): (url("productconfiguration-by-variant-item", item.pk), None),
+
+        ("GET", "stocktransaction-list"): (url("stocktransaction-list"), None),
+        ("GET", "stocktransaction-export"): (
+            url("stocktransaction-export") + f"?output=ndjson&product_variant={item.pk}", None
+        ),
+        ("POST", "stocktransaction-list"): (
+            url("stocktransaction-list"), {"product_variant": str(item.pk), "quantity": 1, "transaction_type": "add"}
+        ),
+        ("GET", "stocktransaction-detail"): (url("stocktransaction-detail", f["stock_transaction"].pk), None),
+        ("PUT", "stocktransaction-detail"): (
+            url("stocktransaction-detail", f["stock_transaction"].pk),
+            {
+                "product_variant": str(f["stock_transaction"].product_variant_id),
+                "quantity": f["stock_transaction"].quantity,
+                "transaction_type": f["stock_transaction"].transaction_type,
+                "notes": "Recounted",
+            },
+        ),
+        ("PATCH", "stocktransaction-detail"): (
+            url("stocktransaction-detail", f["stock_transaction"].pk), {"notes": "Recounted"}
+        ),
+        ("DELETE", "stocktransaction-detail"): (url("stocktransaction-detail", f["stock_transaction"].pk), None),
+        ("POST", "stocktransaction-add-stock"): (
+            url("stocktransaction-add-stock"), {"product_variant_id": str(item.pk), "quantity": 1}
+        ),
+        ("POST", "stocktransaction-remove-stock"): (
+            url("stocktransaction-remove-stock"), {"product_variant_id": str(f["alerted_item"].pk), "quantity": 1}
+        ),
+        ("POST", "stocktransaction-bulk-movements"): (
+            url("stocktransaction-bulk-movements"),
+            {"lines": [{"product_variant_id": str(item.pk), "quantity": 1, "transaction_type": "add"}] * 20},
+        ),
+        ("POST", "stocktransaction-transfer-stock"): (
+            url("stocktransaction-transfer-stock"),
+            {
+                "product_variant_id": str(item.pk),
+                "quantity": 1,
+                "source_location_id": str(f["location"].pk),
+                "destination_location_id": str(Location.default_id()),
+            },
+        ),
+        ("GET", "stocktransaction-valuation"): (url("stocktransaction-valuation"), None),
+        ("GET", "stocktransaction-stock-history"): (url("stocktransaction-stock-history", item.pk), None),
+
+        ("GET", "low-stock-alert-list"): (url("low-stock-alert-list"), None),
+        ("POST", "low-stock-alert-list"): (url("low-stock-alert-list"), {"product_variant": str(item.pk), "threshold": 10}),
+        ("GET", "low-stock-alert-detail"): (url("low-stock-alert-detail", f["alert"].pk), None),
+        ("PUT", "low-stock-alert-detail"): (
+            url("low-stock-alert-detail", f["alert"].pk), {"product_variant": str(f["alerted_item"].pk), "threshold": 15}
+        ),
+        ("PATCH", "low-stock-alert-detail"): (url("low-stock-alert-detail", f["alert"].pk), {"threshold": 15}),
+        ("DELETE", "low-stock-alert-detail"): (url("low-stock-alert-detail", f["alert"].pk), None),
+        ("GET", "low-stock-alert-current-low-stock-alerts"): (url("low-stock-alert-current-low-stock-alerts"), None),
+        ("GET", "dashboard-summary"): (url("dashboard-summary"), None),
+
+        ("GET", "location-list"): (url("location-list"), None),
+        ("POST", "location-list"): (url("location-list"), {"name": "Benchmark depot", "code": "DEPOT"}),
+        ("GET", "location-detail"): (url("location-detail", f["spare_location"].pk), None),
+        ("PUT", "location-detail"): (
+            url("location-detail", f["spare_location"].pk), {"name": "Renamed", "code": "RENAMED"}
+        ),
+        ("PATCH", "location-detail"): (url("location-detail", f["spare_location"].pk), {"address": "Dock 2"}),
+        ("DELETE", "location-detail"): (url("location-detail", f["spare_location"].pk), None),
+        ("GET", "location-stock"): (url("location-stock", Location.default_id()) + "?in_stock=true", None),
+
+        ("GET", "stock-reservation-list"): (url("stock-reservation-list") + "?status=active", None),
+        ("GET", "stock-reservation-detail"): (url("stock-reservation-detail", f["reservation"].pk), None),
+        ("POST", "stock-reservation-reserve"): (
+            url("stock-reservation-reserve"),
+            {"lines": [{"product_variant_id": str(i.pk), "quantity": 1} for i in f["order_items"]], "reference_number": "SO-2"},
+        ),
+        ("POST", "stock-reservation-commit"): (
+            url("stock-reservation-commit"), {"reservation_ids": [str(f["reservation"].pk)]}
+        ),
+        ("POST", "stock-reservation-release"): (
+            url("stock-reservation-release"), {"reservation_ids": [str(f["reservation"].pk)]}
+        ),
+    }
+    return {key: requests[key] for key in router_routes() if key in requests}
+
+
+def budget_key(method, name):
+    return f"{method} {name}"
+
+
+def measure(client, method, path, payload, repeat):
+    """
+    Issue one request repeat times; writes are rolled back after each run so
+    every repetition sees the same data. Query counts are the worst run, so
+    a cold cache is what gets budgeted.
+    """
+    timings = []
+    queries = 0
+    for _ in range(repeat):
+        with transaction.atomic():
+            with CaptureQueriesContext(connection) as context:
+                start = time.perf_counter()
+                if method == "GET":
+                    response = client.get(path)
+                else:
+                    response = getattr(client, method.lower())(path, payload, format="json")
+                if response.streaming:
+                    body = b"".join(response.streaming_content)
+                else:
+                    body = response.content
+                timings.append((time.perf_counter() - start) * 1000)
+            queries = max(queries, len(context.captured_queries))
+            transaction.set_rollback(True)
+
+    timings.sort()
+    return {
+        "status": response.status_code,
+        "queries": queries,
+        "p50_ms": round(timings[len(timings) // 2], 2),
+        "p99_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.99))], 2),
+        "bytes": len(body),
+    }
+
+
+def run_benchmarks(client, fixtures, repeat=1):
+    """
+    Benchmark every router route; returns results keyed by "METHOD route-name"
+    """
+    # Prime per-process state that any long-running worker already holds
+    if connection.vendor == "postgresql":
+        has_trigram_support(connection.alias)
+    return {
+        budget_key(method, name): measure(client, method, path, payload, repeat)
+        for (method, name), (path, payload) in route_requests(fixtures).items()
+    }
+
+
+def load_budgets(path=BUDGETS_PATH):
+    with open(path) as budget_file:
+        return json.load(budget_file)
+
+
+def check_budgets(results, budgets, metrics=("queries", "p99_ms", "max_bytes")):
+    """
+    Return a message for every route that is missing, failed, or exceeds its budget
+    """
+    violations = [
+        f"{key}: no benchmark request defined"
+        for key in sorted({budget_key(*route) for route in router_routes()} - set(results))
+    ]
+    for key, result in sorted(results.items()):
+        budget = budgets.get(key)
+        if budget is None:
+            violations.append(f"{key}: no budget defined")
+            continue
+        if result["status"] >= 400:
+            violations.append(f"{key}: responded {result['status']}")
+        measured = {"queries": result["queries"], "p99_ms": result["p99_ms"], "max_bytes": result["bytes"]}
+        for metric in metrics:
+            if metric in budget and measured[metric] > budget[metric]:
+                violations.append(f"{key}: {metric} {measured[metric]} exceeds budget {budget[metric]}")
+    return violations
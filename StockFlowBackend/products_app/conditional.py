@@ -0,0 +1,103 @@
+from functools import partial
+
+from django.core.exceptions import ValidationError
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+
+def weak_etag(*parts):
+    return f'W/"{"-".join(str(part) for part in parts)}"'
+
+
+def collection_validators(*querysets, fields=("updated_at",)):
+    """
+    (weak ETag, Last-Modified) for one or more sets of rows, from the row count
+    and the latest value of each timestamp field: any write stamps a field, and
+    a delete changes the count
+    """
+    parts = []
+    latest = []
+    for queryset in querysets:
+        stats = queryset.order_by().aggregate(
+            count=Count("pk", distinct=len(fields) > 1),
+            **{f"latest_{index}": Max(field) for index, field in enumerate(fields)}
+        )
+        parts.append(stats["count"])
+        for index in range(len(fields)):
+            moment = stats[f"latest_{index}"]
+            parts.append(moment.timestamp() if moment else 0)
+            latest.append(moment)
+    last_modified = max((moment for moment in latest if moment), default=None)
+    return weak_etag(*parts), last_modified
+
+
+def table_validators(counts, *querysets, field="updated_at"):
+    """
+    (weak ETag, Last-Modified) for whole tables without scanning them: the
+    latest value of an indexed timestamp field, which any insert or update
+    stamps and which is read off the end of its index, and row counts the
+    caller already maintains, which a delete changes
+    """
+    latest = [queryset.order_by().aggregate(latest=Max(field))["latest"] for queryset in querysets]
+    parts = [*counts, *(moment.timestamp() if moment else 0 for moment in latest)]
+    return weak_etag(*parts), max((moment for moment in latest if moment), default=None)
+
+
+def conditional_response(request, etag, last_modified, render):
+    """
+    Return 304 Not Modified when the client's copy matches etag/last_modified,
+    otherwise render() the response; either way carry the validators, and ask
+    clients to revalidate rather than reuse their copy blindly
+    """
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+    response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+    if response is None:
+        response = render()
+    if response.status_code in (200, 304):
+        response.headers["ETag"] = etag
+        if timestamp is not None:
+            response.headers["Last-Modified"] = http_date(timestamp)
+        patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+class ConditionalGetMixin:
+    """
+    Answer list and retrieve (and any other conditional_actions that call
+    conditional()) with a weak ETag and Last-Modified, and with 304 before
+    anything is serialized when the client's copy is current. Views return the
+    validators from get_validators(), typically collection_validators() over the
+    rows the action renders.
+    """
+    conditional_actions = ('list', 'retrieve')
+    validator_fields = ("updated_at",)
+
+    def get_validators(self):
+        """
+        (etag, last_modified) for the current action, or None to answer unconditionally;
+        by default from validator_fields over the rows list or retrieve renders
+        """
+        queryset = self.filter_queryset(self.get_queryset())
+        if self.action == 'retrieve':
+            lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+            queryset = queryset.filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        return collection_validators(queryset, fields=self.validator_fields)
+
+    def conditional(self, render):
+        if self.request.method not in ('GET', 'HEAD') or self.action not in self.conditional_actions:
+            return render()
+        try:
+            validators = self.get_validators()
+        except (TypeError, ValueError, ValidationError):
+            # A malformed lookup; let the handler answer it
+            validators = None
+        if validators is None:
+            return render()
+        return conditional_response(self.request, *validators, render)
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional(partial(super().list, request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional(partial(super().retrieve, request, *args, **kwargs))
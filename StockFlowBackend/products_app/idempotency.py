@@ -0,0 +1,102 @@
+"""
+Idempotency-Key support for stock-mutating actions.
+
+A client that may retry a write sends the same Idempotency-Key header with
+every attempt. The first attempt claims the key by inserting an
+IdempotencyKey row (unique per user and key) in the same database
+transaction as the write, and stores the response it produced. Retries find
+the row with one indexed lookup and get the stored response back, marked
+with an Idempotent-Replayed header, without running the write again. A
+retry racing the first attempt blocks on the unique index until that
+attempt commits, then replays it.
+
+Reusing a key for a different request is rejected with 422. Responses of 500
+and above are not stored: the write rolled back, so the key is released for
+the next attempt. Keys expire after IDEMPOTENCY_KEY_TTL seconds (default one
+day); prune_idempotency_keys deletes them in created_at order.
+"""
+import hashlib
+import json
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from .models import IdempotencyKey
+
+HEADER = "Idempotency-Key"
+
+
+def key_ttl():
+    return timedelta(seconds=getattr(settings, "IDEMPOTENCY_KEY_TTL", 24 * 60 * 60))
+
+
+def request_fingerprint(request):
+    """
+    Hash of what a request asks for, to tell a retry from a reused key
+    """
+    body = json.dumps(request.data, sort_keys=True, cls=JSONEncoder)
+    return hashlib.sha256(f"{request.method} {request.path}\n{body}".encode()).hexdigest()
+
+
+def replay(record, fingerprint):
+    if record.request_fingerprint != fingerprint:
+        return Response(
+            {"error": f"{HEADER} was already used for a different request"},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY
+        )
+    return Response(record.response_body, status=record.response_status, headers={"Idempotent-Replayed": "true"})
+
+
+def idempotent(action):
+    """
+    Honour an Idempotency-Key header on a view action. The action may set
+    self.stock_transactions to the transactions it created, which are recorded
+    with the key.
+    """
+    @wraps(action)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return action(self, request, *args, **kwargs)
+        if len(key) > 255:
+            return Response(
+                {"error": f"{HEADER} must be at most 255 characters"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        fingerprint = request_fingerprint(request)
+        record = IdempotencyKey.objects.filter(user=request.user, key=key).first()
+        if record is not None:
+            if record.created_at > timezone.now() - key_ttl():
+                return replay(record, fingerprint)
+            record.delete()
+
+        with transaction.atomic():
+            try:
+                with transaction.atomic():
+                    record = IdempotencyKey.objects.create(
+                        user=request.user, key=key, request_fingerprint=fingerprint
+                    )
+            except IntegrityError:
+                # A concurrent attempt with this key committed first
+                return replay(IdempotencyKey.objects.get(user=request.user, key=key), fingerprint)
+
+            self.stock_transactions = []
+            response = action(self, request, *args, **kwargs)
+            if response.status_code >= 500:
+                transaction.set_rollback(True)
+                return response
+
+            record.response_status = response.status_code
+            record.response_body = json.loads(json.dumps(response.data, cls=JSONEncoder))
+            record.transaction_ids = [str(stock_transaction.pk) for stock_transaction in self.stock_transactions]
+            record.save(update_fields=["response_status", "response_body", "transaction_ids"])
+        return response
+
+    return wrapper
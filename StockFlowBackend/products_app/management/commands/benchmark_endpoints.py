@@ -0,0 +1,72 @@
+import json
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import setup_databases, setup_test_environment, teardown_databases, teardown_test_environment
+from rest_framework.test import APIClient
+
+from products_app import benchmarks
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a synthetic catalogue in a throwaway test database, request every products_app "
+        "route and fail when query counts, p99 latency or response size exceed the budget file"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', choices=sorted(benchmarks.SCALES), default='small')
+        parser.add_argument('--products', type=int, help="Override the number of products for the scale")
+        parser.add_argument('--variants-per-product', type=int, help="Override the variants per product")
+        parser.add_argument('--transactions', type=int, help="Override the number of stock transactions")
+        parser.add_argument('--repeat', type=int, default=20, help="Requests per route for the latency percentiles")
+        parser.add_argument('--budgets', default=str(benchmarks.BUDGETS_PATH), help="Path to the budget file")
+        parser.add_argument('--update-budgets', action='store_true', help="Write the measured values as the new budgets")
+        parser.add_argument('--keepdb', action='store_true', help="Keep the benchmark database between runs")
+
+    def handle(self, *args, **options):
+        scale = dict(benchmarks.SCALES[options['scale']])
+        for setting in ('products', 'variants_per_product', 'transactions'):
+            if options[setting] is not None:
+                scale[setting] = options[setting]
+
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False, keepdb=options['keepdb'])
+        try:
+            user = User.objects.create_user(username="benchmark")
+            self.stdout.write(f"Seeding {scale}...")
+            fixtures = benchmarks.seed_catalogue(user, **scale)
+            client = APIClient()
+            client.force_authenticate(user)
+            results = benchmarks.run_benchmarks(client, fixtures, repeat=options['repeat'])
+        finally:
+            teardown_databases(old_config, verbosity=0, keepdb=options['keepdb'])
+            teardown_test_environment()
+
+        self.stdout.write(f"{'route':<60} {'status':>6} {'queries':>7} {'p50 ms':>8} {'p99 ms':>8} {'bytes':>10}")
+        for key, result in sorted(results.items()):
+            self.stdout.write(
+                f"{key:<60} {result['status']:>6} {result['queries']:>7} "
+                f"{result['p50_ms']:>8} {result['p99_ms']:>8} {result['bytes']:>10}"
+            )
+
+        if options['update_budgets']:
+            budgets = {
+                key: {
+                    'queries': result['queries'],
+                    # Latency and size vary by machine and scale, so leave headroom
+                    'p99_ms': round(max(result['p99_ms'] * 5, 250)),
+                    'max_bytes': max(result['bytes'] * 2, 1024),
+                }
+                for key, result in sorted(results.items())
+            }
+            with open(options['budgets'], 'w') as budget_file:
+                json.dump(budgets, budget_file, indent=2)
+                budget_file.write("\n")
+            self.stdout.write(self.style.SUCCESS(f"Wrote budgets for {len(budgets)} routes to {options['budgets']}"))
+            return
+
+        violations = benchmarks.check_budgets(results, benchmarks.load_budgets(options['budgets']))
+        if violations:
+            raise CommandError("Budget exceeded:\n" + "\n".join(violations))
+        self.stdout.write(self.style.SUCCESS(f"All {len(results)} routes are within budget"))
@@ -0,0 +1,46 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import setup_databases, setup_test_environment, teardown_databases, teardown_test_environment
+
+from products_app import benchmarks
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a synthetic catalogue and stock ledger in a throwaway test database, then time "
+        "FIFO and weighted-average valuation of every variant by full ledger replay and from cost checkpoints"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=2000)
+        parser.add_argument('--variants-per-product', type=int, default=10)
+        parser.add_argument('--transactions', type=int, default=1000000)
+        parser.add_argument('--days', type=int, default=365, help="Days the ledger is spread over")
+        parser.add_argument('--keepdb', action='store_true', help="Keep the benchmark database between runs")
+
+    def handle(self, *args, **options):
+        scale = {
+            'products': options['products'],
+            'variants_per_product': options['variants_per_product'],
+            'transactions': options['transactions'],
+        }
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False, keepdb=options['keepdb'])
+        try:
+            user = User.objects.create_user(username="benchmark")
+            self.stdout.write(f"Seeding {scale}...")
+            benchmarks.seed_catalogue(user, **scale)
+            timings, replayed, checkpointed = benchmarks.time_valuation(max(options['days'], 1))
+        finally:
+            teardown_databases(old_config, verbosity=0, keepdb=options['keepdb'])
+            teardown_test_environment()
+
+        self.stdout.write(
+            f"Valued {timings['transactions']} transactions by full replay in {timings['full_replay_s']}s\n"
+            f"Built {timings['checkpoints']} cost checkpoints in {timings['build_checkpoints_s']}s\n"
+            f"Valued from checkpoints in {timings['from_checkpoints_s']}s\n"
+            f"FIFO value {replayed[0]}, weighted-average value {replayed[1]}"
+        )
+        if checkpointed != replayed:
+            raise CommandError(f"Valuation from checkpoints {checkpointed} differs from full replay {replayed}")
+        self.stdout.write(self.style.SUCCESS("Checkpointed and replayed valuations agree"))
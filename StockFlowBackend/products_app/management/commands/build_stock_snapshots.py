@@ -0,0 +1,38 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from products_app.models import StockSnapshot
+
+
+class Command(BaseCommand):
+    help = (
+        "Write daily closing stock snapshots for every day since the last build. "
+        "Run it daily, after midnight; as_of stock lookups replay the ledger from the latest snapshot."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--through', help="Last day to close, YYYY-MM-DD (default: yesterday)")
+        parser.add_argument('--rebuild', action='store_true', help="Delete every snapshot and rebuild from the ledger")
+
+    def handle(self, *args, **options):
+        yesterday = timezone.localdate() - timedelta(days=1)
+        through = yesterday
+        if options['through']:
+            try:
+                through = parse_date(options['through'])
+            except ValueError:
+                through = None
+            if through is None:
+                raise CommandError(f"Invalid date: {options['through']}")
+            if through > yesterday:
+                raise CommandError("Only days that have ended can be snapshotted")
+
+        if options['rebuild']:
+            deleted, _ = StockSnapshot.objects.all().delete()
+            self.stdout.write(f"Deleted {deleted} snapshots")
+
+        written = StockSnapshot.build(through=through)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} snapshots through {through}"))
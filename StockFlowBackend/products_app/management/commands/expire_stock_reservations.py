@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from products_app.models import StockReservation
+
+
+class Command(BaseCommand):
+    help = "Release active stock reservations past their expiry, soonest expiry first, in small batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Reservations expired per transaction")
+        parser.add_argument('--dry-run', action='store_true', help="Count expired reservations without releasing them")
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        expired = StockReservation.objects.expired(now).order_by('expires_at')
+        if options['dry_run']:
+            self.stdout.write(f"{expired.count()} reservations would be expired")
+            return
+
+        released = 0
+        while True:
+            with transaction.atomic():
+                # Skip holds a concurrent commit or release has locked; they are no longer ours to expire
+                batch = list(
+                    expired.select_for_update(skip_locked=True).values_list('pk', flat=True)[:options['batch_size']]
+                )
+                if not batch:
+                    break
+                reservations, errors = StockReservation.close(batch, 'expired')
+            if errors:
+                break
+            released += len(reservations)
+        self.stdout.write(self.style.SUCCESS(f"Expired {released} reservations"))
@@ -0,0 +1,297 @@
+import csv
+import json
+import os
+import time
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from products_app.models import (
+    Category, LocationStock, Product, ProductConfiguration, ProductVariantItem, SubCategory, Variant, VariantOption,
+    add_deltas, listing_refresh, product_ids, search_refresh, stock_summary,
+)
+from products_app.serializers import build_product_code
+from products_app.taxonomy import taxonomy_cache
+
+OPTION_PREFIX = "option:"
+# ProductVariantItem.price is a DecimalField(max_digits=10, decimal_places=2)
+MAX_PRICE = Decimal("100000000")
+
+
+def read_csv(path):
+    with open(path, newline="", encoding="utf-8-sig") as catalogue:
+        for row in csv.DictReader(catalogue):
+            yield row
+
+
+def read_xlsx(path):
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise CommandError("Importing .xlsx files needs openpyxl (pip install openpyxl)")
+
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        headers = [str(header).strip() if header is not None else "" for header in next(rows, [])]
+        for values in rows:
+            yield {
+                header: "" if value is None else str(value)
+                for header, value in zip(headers, values)
+            }
+    finally:
+        workbook.close()
+
+
+class Command(BaseCommand):
+    help = (
+        "Import products and variants from a CSV or XLSX catalogue, one variant per row. "
+        "Columns: category, subcategory, product_name, price, and optionally hsn_code, quantity, "
+        "product_code, variant_hsn_code and one 'option:<Variant>' column per variant, e.g. "
+        "'option:Size'. Missing categories, subcategories, variants and options are created."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV or XLSX file to import")
+        parser.add_argument('--user', required=True, help="Username recorded as the creator of new products")
+        parser.add_argument('--chunk-size', type=int, default=1000, help="Rows written per transaction")
+        parser.add_argument(
+            '--checkpoint', help="Progress file, rewritten after every chunk (default: <path>.checkpoint)"
+        )
+        parser.add_argument('--resume', action='store_true', help="Skip the rows recorded in the checkpoint")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.exists(path):
+            raise CommandError(f"{path} does not exist")
+        try:
+            self.user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f"User {options['user']} does not exist")
+
+        checkpoint_path = options['checkpoint'] or f"{path}.checkpoint"
+        source = {'path': os.path.abspath(path), 'size': os.path.getsize(path)}
+        done = self.load_checkpoint(checkpoint_path, source) if options['resume'] else 0
+        if done:
+            self.stdout.write(f"Resuming after row {done}")
+
+        self.load_taxonomy()
+        self.products = {}
+        self.errors = []
+        self.created = {'products': 0, 'variants': 0}
+
+        reader = read_xlsx(path) if path.lower().endswith('.xlsx') else read_csv(path)
+        rows = enumerate(islice(reader, done, None), start=done + 1)
+        started = time.perf_counter()
+        imported = 0
+        while chunk := list(islice(rows, options['chunk_size'])):
+            self.import_chunk(chunk)
+            imported += len(chunk)
+            done = chunk[-1][0]
+            self.save_checkpoint(checkpoint_path, source, done)
+            rate = imported / (time.perf_counter() - started)
+            self.stdout.write(f"Imported {done} rows ({rate:.0f} rows/sec)")
+
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+
+        for row_number, message in self.errors[:50]:
+            self.stderr.write(f"Row {row_number}: {message}")
+        if len(self.errors) > 50:
+            self.stderr.write(f"... and {len(self.errors) - 50} more")
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Read {imported} rows in {elapsed:.1f}s ({imported / elapsed if elapsed else 0:.0f} rows/sec): "
+            f"created {self.created['products']} products and {self.created['variants']} variants, "
+            f"skipped {len(self.errors)} rows"
+        ))
+
+    def load_checkpoint(self, checkpoint_path, source):
+        if not os.path.exists(checkpoint_path):
+            return 0
+        with open(checkpoint_path) as checkpoint_file:
+            checkpoint = json.load(checkpoint_file)
+        if checkpoint.get('source') != source:
+            raise CommandError(f"{checkpoint_path} was written for a different file; delete it to start over")
+        return checkpoint['rows']
+
+    def save_checkpoint(self, checkpoint_path, source, rows):
+        # Write then rename, so an interrupted run never leaves a half-written checkpoint
+        with open(f"{checkpoint_path}.tmp", 'w') as checkpoint_file:
+            json.dump({'source': source, 'rows': rows}, checkpoint_file)
+        os.replace(f"{checkpoint_path}.tmp", checkpoint_path)
+
+    def load_taxonomy(self):
+        """
+        Hold the whole taxonomy in memory; rows only ever add to it
+        """
+        self.categories = {category.name: category for category in Category.objects.all()}
+        self.subcategories = {(s.category_id, s.name): s for s in SubCategory.objects.all()}
+        self.variants = {(v.subcategory_id, v.name): v for v in Variant.objects.all()}
+        self.options = {(o.variant_id, o.option): o for o in VariantOption.objects.all()}
+
+    def resolve(self, cache, key, new_rows, factory):
+        if key not in cache:
+            cache[key] = factory()
+            new_rows.append(cache[key])
+        return cache[key]
+
+    def parse_row(self, row):
+        """
+        Validate and normalise one row; returns (values, error)
+        """
+        values = {key: (row.get(key) or "").strip() for key in (
+            'category', 'subcategory', 'product_name', 'hsn_code', 'product_code', 'variant_hsn_code',
+            'quantity', 'price',
+        )}
+        missing = [key for key in ('category', 'subcategory', 'product_name', 'price') if not values[key]]
+        if missing:
+            return None, f"missing {', '.join(missing)}"
+        try:
+            values['quantity'] = int(values['quantity'] or 0)
+            values['price'] = Decimal(values['price'])
+        except (ValueError, InvalidOperation):
+            return None, "quantity must be an integer and price a number"
+        if values['quantity'] < 0 or values['price'] < 0:
+            return None, "quantity and price cannot be negative"
+        if values['price'] >= MAX_PRICE or values['price'] != values['price'].quantize(Decimal("0.01")):
+            return None, "price must be below 100000000 with at most 2 decimal places"
+        values['options'] = {
+            key[len(OPTION_PREFIX):].strip(): value.strip()
+            for key, value in row.items()
+            if isinstance(key, str) and key.startswith(OPTION_PREFIX) and isinstance(value, str) and value.strip()
+        }
+        return values, None
+
+    def import_chunk(self, chunk):
+        new_taxonomy = {'categories': [], 'subcategories': [], 'variants': [], 'options': []}
+        parsed = []
+        for row_number, row in chunk:
+            values, error = self.parse_row(row)
+            if error:
+                self.errors.append((row_number, error))
+                continue
+            category = self.resolve(
+                self.categories, values['category'], new_taxonomy['categories'],
+                lambda: Category(name=values['category'])
+            )
+            subcategory = self.resolve(
+                self.subcategories, (category.id, values['subcategory']), new_taxonomy['subcategories'],
+                lambda: SubCategory(category=category, name=values['subcategory'])
+            )
+            options = []
+            for variant_name, option_value in values['options'].items():
+                variant = self.resolve(
+                    self.variants, (subcategory.id, variant_name), new_taxonomy['variants'],
+                    lambda: Variant(subcategory=subcategory, name=variant_name)
+                )
+                options.append(self.resolve(
+                    self.options, (variant.id, option_value), new_taxonomy['options'],
+                    lambda: VariantOption(variant=variant, option=option_value)
+                ))
+            parsed.append((row_number, values, subcategory, options))
+
+        products = self.resolve_products(parsed)
+        product_list = list(products.values())
+        existing_signatures = set(ProductVariantItem.objects.filter(
+            product__in=[product for product in product_list if not product._state.adding]
+        ).values_list('product_id', 'configuration_signature'))
+
+        candidates = []
+        for row_number, values, subcategory, options in parsed:
+            product = products[(subcategory.id, values['product_name'])]
+            code = values['product_code'] or build_product_code(product, options)
+            candidates.append((row_number, values, product, options, code))
+        taken = set(ProductVariantItem.objects.filter(
+            product_code__in={candidate[-1] for candidate in candidates}
+        ).values_list('product_code', flat=True))
+
+        items = []
+        configurations = []
+        for row_number, values, product, options, code in candidates:
+            signature = ProductVariantItem.build_configuration_signature([option.id for option in options])
+            if (product.id, signature) in existing_signatures:
+                self.errors.append((row_number, f"{values['product_name']} already has this configuration"))
+                continue
+            if code in taken:
+                self.errors.append((row_number, f"product code {code} already exists"))
+                continue
+            existing_signatures.add((product.id, signature))
+            taken.add(code)
+            item = ProductVariantItem(
+                product=product,
+                product_code=code,
+                quantity=values['quantity'],
+                price=values['price'],
+                hsn_code=values['variant_hsn_code'] or product.hsn_code,
+                configuration_signature=signature,
+            )
+            items.append(item)
+            configurations.extend(ProductConfiguration(product_item=item, variant_option=o) for o in options)
+
+        stock = {}
+        for item in items:
+            stock[item.product_id] = stock.get(item.product_id, 0) + item.quantity
+        new_products = [product for product in product_list if product._state.adding and product.id in stock]
+        for product in new_products:
+            product.total_stock = stock[product.id]
+        restocked = [product.id for product in product_list if not product._state.adding and product.id in stock]
+
+        with transaction.atomic():
+            Category.objects.bulk_create(new_taxonomy['categories'])
+            SubCategory.objects.bulk_create(new_taxonomy['subcategories'])
+            Variant.objects.bulk_create(new_taxonomy['variants'])
+            VariantOption.objects.bulk_create(new_taxonomy['options'])
+            Product.objects.bulk_create(new_products)
+            ProductVariantItem.objects.bulk_create(items)
+            ProductConfiguration.objects.bulk_create(configurations)
+            LocationStock.stock_opening(items)
+            for product_id in restocked:
+                Product.apply_stock_delta(product_id, stock[product_id])
+            search_refresh.add("product", stock)
+            listing_refresh.add("item", [item.pk for item in items])
+            counts = {}
+            for product in new_products:
+                add_deltas(counts, {product.subcategory.category_id: (1, 0, 0, 0)})
+            stock_summary.add("category", counts)
+
+        for product in new_products:
+            self.products[(product.subcategory_id, product.name)] = product
+        self.created['products'] += len(new_products)
+        self.created['variants'] += len(items)
+        if any(new_taxonomy.values()):
+            # bulk_create sends no signals
+            taxonomy_cache.invalidate()
+
+    def resolve_products(self, parsed):
+        """
+        Map (subcategory id, product name) to a product, matching existing products by
+        name within their subcategory and preparing unsaved ones for the rest
+        """
+        keys = {(subcategory.id, values['product_name']): (values, subcategory) for _, values, subcategory, _ in parsed}
+        unknown = [key for key in keys if key not in self.products]
+        if unknown:
+            for product in Product.objects.filter(
+                subcategory_id__in={subcategory_id for subcategory_id, _ in unknown},
+                name__in={name for _, name in unknown},
+            ).order_by('created_at'):
+                self.products.setdefault((product.subcategory_id, product.name), product)
+
+        products = {key: self.products[key] for key in keys if key in self.products}
+        missing = [key for key in keys if key not in products]
+        # Allocate ids now so generated product codes can be checked before anything is written
+        for key, product_id in zip(missing, product_ids.allocate(len(missing))):
+            values, subcategory = keys[key]
+            # Pass the subcategory itself, so reading its category_id later does not query
+            products[key] = Product(
+                product_id=product_id,
+                name=values['product_name'],
+                subcategory=subcategory,
+                created_by=self.user,
+                hsn_code=values['hsn_code'] or None,
+            )
+        return products
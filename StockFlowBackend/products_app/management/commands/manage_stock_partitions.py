@@ -0,0 +1,118 @@
+import os
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from products_app import partitions
+from products_app.models import CostLayerCheckpoint, StockSnapshot
+
+
+def parse_month(value):
+    try:
+        return datetime.strptime(value, "%Y-%m").date()
+    except ValueError:
+        raise CommandError(f"Invalid month: {value} (expected YYYY-MM)")
+
+
+class Command(BaseCommand):
+    help = (
+        "Manage the monthly partitions of stock_transactions (PostgreSQL). "
+        "'create' adds partitions for the coming months and splits rows out of the default partition; "
+        "run it monthly. 'archive' moves months older than the retention period to gzipped CSV files; "
+        "'restore' attaches archived months again; 'list' shows what is attached."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['create', 'list', 'archive', 'restore'])
+        parser.add_argument('months', nargs='*', help="Months to restore, as YYYY-MM")
+        parser.add_argument('--ahead', type=int, default=3, help="Months to create after the current one")
+        parser.add_argument(
+            '--keep-months', type=int, default=getattr(settings, 'STOCK_TRANSACTION_RETENTION_MONTHS', 24),
+            help="Months of history, including the current one, that archive leaves attached"
+        )
+        parser.add_argument(
+            '--archive-dir',
+            default=getattr(settings, 'STOCK_ARCHIVE_DIR', os.path.join(settings.BASE_DIR, 'archive')),
+            help="Directory holding the archived months"
+        )
+        parser.add_argument('--dry-run', action='store_true', help="Report what archive would do")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("stock_transactions is only partitioned on PostgreSQL")
+        with connection.cursor() as cursor:
+            if not partitions.is_partitioned(cursor):
+                raise CommandError("stock_transactions is not partitioned; run migrate first")
+            getattr(self, f"handle_{options['action']}")(cursor, options)
+
+    def handle_create(self, cursor, options):
+        month = partitions.month_start(timezone.now().date())
+        with transaction.atomic():
+            months = set(partitions.default_partition_months(cursor))
+        for _ in range(options['ahead'] + 1):
+            months.add(month)
+            month = partitions.next_month(month)
+
+        created = 0
+        for month in sorted(months):
+            # One transaction per month keeps the lock on the default partition short
+            with transaction.atomic():
+                if partitions.create_partition(cursor, month):
+                    created += 1
+                    self.stdout.write(f"Created {partitions.partition_name(month)}")
+        self.stdout.write(self.style.SUCCESS(f"Created {created} partitions"))
+
+    def handle_list(self, cursor, options):
+        for name, rows in partitions.list_partitions(cursor):
+            self.stdout.write(f"{name}: ~{max(rows, 0)} rows")
+        directory = options['archive_dir']
+        if os.path.isdir(directory):
+            for filename in sorted(os.listdir(directory)):
+                if filename.endswith('.csv.gz'):
+                    self.stdout.write(f"{filename}: archived")
+
+    def handle_archive(self, cursor, options):
+        cutoff = partitions.month_start(timezone.now().date())
+        for _ in range(max(options['keep_months'], 1) - 1):
+            cutoff = (cutoff - timedelta(days=1)).replace(day=1)
+        months = [
+            month for month in (partitions.partition_month(name) for name, _ in partitions.list_partitions(cursor))
+            if month is not None and month < cutoff
+        ]
+        if not months:
+            self.stdout.write(f"Nothing older than {cutoff:%Y-%m} to archive")
+            return
+
+        # as_of lookups and valuations stop replaying the ledger at the latest snapshot
+        # and cost checkpoint, so archived months must already be covered by both
+        last_day = partitions.next_month(months[-1]) - timedelta(days=1)
+        for model, command in ((StockSnapshot, 'build_stock_snapshots'), (CostLayerCheckpoint, 'build_cost_checkpoints')):
+            built_through = model.objects.order_by('-date').values_list('date', flat=True).first()
+            if built_through is None or built_through < last_day:
+                raise CommandError(f"Run {command} through {last_day} before archiving")
+
+        for month in months:
+            if options['dry_run']:
+                self.stdout.write(f"Would archive {partitions.partition_name(month)}")
+                continue
+            with transaction.atomic():
+                path = partitions.archive_partition(cursor, month, options['archive_dir'])
+            self.stdout.write(f"Archived {partitions.partition_name(month)} to {path}")
+        self.stdout.write(self.style.SUCCESS(f"Archived {len(months)} months older than {cutoff:%Y-%m}"))
+
+    def handle_restore(self, cursor, options):
+        if not options['months']:
+            raise CommandError("Name the months to restore, e.g. restore 2024-01 2024-02")
+        attached = {name for name, _ in partitions.list_partitions(cursor)}
+        for month in map(parse_month, options['months']):
+            path = partitions.archive_path(options['archive_dir'], month)
+            if partitions.partition_name(month) in attached:
+                raise CommandError(f"{month:%Y-%m} is already attached")
+            if not os.path.exists(path):
+                raise CommandError(f"{path} does not exist")
+            with transaction.atomic():
+                partitions.restore_partition(cursor, month, options['archive_dir'])
+            self.stdout.write(f"Restored {partitions.partition_name(month)} from {path}")
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from products_app.alerts import notification_backends, process_low_stock_checks
+
+
+class Command(BaseCommand):
+    help = (
+        "Evaluate low-stock alerts for the variants queued by stock movements and send notifications "
+        "through LOW_STOCK_NOTIFICATION_BACKENDS. Runs until stopped unless --once is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Variants evaluated per transaction")
+        parser.add_argument('--interval', type=float, default=5, help="Seconds to wait when the queue is empty")
+        parser.add_argument('--once', action='store_true', help="Drain the queue and exit")
+
+    def handle(self, *args, **options):
+        backends = notification_backends()
+        processed = 0
+        while True:
+            batch = process_low_stock_checks(options['batch_size'], backends)
+            processed += batch
+            if batch:
+                continue
+            if options['once']:
+                break
+            time.sleep(options['interval'])
+
+        self.stdout.write(self.style.SUCCESS(f"Checked {processed} variants"))
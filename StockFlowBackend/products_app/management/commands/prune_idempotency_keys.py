@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from products_app.idempotency import key_ttl
+from products_app.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    help = "Delete Idempotency-Keys older than IDEMPOTENCY_KEY_TTL, oldest first, in small batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Keys deleted per statement")
+        parser.add_argument('--dry-run', action='store_true', help="Count expired keys without deleting them")
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - key_ttl()
+        expired = IdempotencyKey.objects.filter(created_at__lt=cutoff).order_by('created_at')
+        if options['dry_run']:
+            self.stdout.write(f"{expired.count()} idempotency keys created before {cutoff:%Y-%m-%d %H:%M} would be deleted")
+            return
+
+        deleted = 0
+        while True:
+            # Each batch is a short range scan of idempotency_key_created_idx
+            batch = list(expired.values_list('pk', flat=True)[:options['batch_size']])
+            if not batch:
+                break
+            deleted += IdempotencyKey.objects.filter(pk__in=batch).delete()[0]
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} idempotency keys created before {cutoff:%Y-%m-%d %H:%M}"))
@@ -0,0 +1,78 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from products_app.models import Category, CategoryStockSummary, DailyStockMovement
+
+SUMMARY_FIELDS = ['products', 'variants', 'units', 'stock_value']
+MOVEMENT_FIELDS = ['movements', 'units_in', 'units_out']
+
+
+class Command(BaseCommand):
+    help = (
+        "Detect and repair drift between the dashboard counters (category stock summaries and daily "
+        "stock movements) and the products, variant listings and stock ledger they summarise"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help="Categories checked per transaction")
+        parser.add_argument('--days', type=int, default=1, help="Days of stock movements, up to today, to recount")
+        parser.add_argument('--dry-run', action='store_true', help="Report drift without repairing it")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        dry_run = options['dry_run']
+        checked = drifted = 0
+        category_ids = list(Category.objects.order_by('id').values_list('id', flat=True))
+
+        for start in range(0, len(category_ids), batch_size):
+            batch = category_ids[start:start + batch_size]
+            with transaction.atomic():
+                # Lock the counters before counting, so deltas committed meanwhile
+                # queue behind the repair instead of being overwritten by it
+                current = CategoryStockSummary.objects.select_for_update().filter(category__in=batch).in_bulk()
+                repairs = []
+                for category_id, actual in CategoryStockSummary.totals(batch).items():
+                    stored = current.get(category_id, CategoryStockSummary(category_id=category_id))
+                    if any(getattr(stored, field) != getattr(actual, field) for field in SUMMARY_FIELDS):
+                        self.stdout.write(
+                            f"Category {category_id}: "
+                            + ", ".join(f"{field}={getattr(stored, field)}" for field in SUMMARY_FIELDS)
+                            + ", actual " + ", ".join(str(getattr(actual, field)) for field in SUMMARY_FIELDS)
+                        )
+                        repairs.append(actual)
+
+                if repairs and not dry_run:
+                    CategoryStockSummary.objects.bulk_create(
+                        repairs, update_conflicts=True, unique_fields=['category'], update_fields=SUMMARY_FIELDS
+                    )
+            checked += len(batch)
+            drifted += len(repairs)
+
+        today = timezone.localdate()
+        first = today - datetime.timedelta(days=max(options['days'], 1) - 1)
+        repaired_days = 0
+        with transaction.atomic():
+            current = DailyStockMovement.objects.select_for_update().filter(date__gte=first, date__lte=today).in_bulk()
+            repairs = []
+            for date, actual in DailyStockMovement.totals(first, today).items():
+                stored = current.get(date, DailyStockMovement(date=date))
+                if any(getattr(stored, field) != getattr(actual, field) for field in MOVEMENT_FIELDS):
+                    self.stdout.write(
+                        f"{date}: {stored.movements} movements ({stored.units_in} in, {stored.units_out} out), "
+                        f"actual {actual.movements} ({actual.units_in} in, {actual.units_out} out)"
+                    )
+                    repairs.append(actual)
+            if repairs and not dry_run:
+                DailyStockMovement.objects.bulk_create(
+                    repairs, update_conflicts=True, unique_fields=['date'], update_fields=MOVEMENT_FIELDS
+                )
+            repaired_days = len(repairs)
+
+        action = "found" if dry_run else "repaired"
+        self.stdout.write(self.style.SUCCESS(
+            f"Checked {checked} categories, {action} {drifted} with drift; "
+            f"checked {(today - first).days + 1} days of movements, {action} {repaired_days} with drift"
+        ))
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from products_app.models import Product
+
+
+class Command(BaseCommand):
+    help = "Detect and repair drift between Product.total_stock and the sum of its variant quantities"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Products checked per transaction")
+        parser.add_argument('--dry-run', action='store_true', help="Report drift without repairing it")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        dry_run = options['dry_run']
+        checked = drifted = 0
+        last_id = None
+
+        while True:
+            with transaction.atomic():
+                products = Product.objects.order_by('id')
+                if last_id is not None:
+                    products = products.filter(id__gt=last_id)
+                # Lock the batch before summing, so stock deltas committed meanwhile
+                # queue behind the repair instead of being overwritten by it
+                batch_ids = list(products.select_for_update().values_list('id', flat=True)[:batch_size])
+                if not batch_ids:
+                    break
+
+                repairs = []
+                now = timezone.now()
+                totals = Product.objects.filter(id__in=batch_ids).annotate(
+                    actual=Coalesce(Sum('items__quantity'), 0)
+                ).values_list('id', 'total_stock', 'actual')
+                for product_id, total_stock, actual in totals:
+                    if total_stock != actual:
+                        self.stdout.write(f"Product {product_id}: total_stock={total_stock}, variants sum to {actual}")
+                        repairs.append(Product(id=product_id, total_stock=actual, updated_at=now))
+
+                if repairs and not dry_run:
+                    # Stamp updated_at too, so cached product ETags stop matching the drifted total
+                    Product.objects.bulk_update(repairs, ['total_stock', 'updated_at'])
+
+            checked += len(batch_ids)
+            drifted += len(repairs)
+            last_id = batch_ids[-1]
+
+        action = "found" if dry_run else "repaired"
+        self.stdout.write(self.style.SUCCESS(f"Checked {checked} products, {action} {drifted} with drift"))
@@ -0,0 +1,40 @@
+# Generated by Django 5.1.7 on 2026-10-18 02:01
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def backfill_configuration_signatures(apps, schema_editor):
+    ProductVariantItem = apps.get_model('products_app', 'ProductVariantItem')
+    ProductConfiguration = apps.get_model('products_app', 'ProductConfiguration')
+
+    option_ids_by_item = {}
+    for item_id, option_id in ProductConfiguration.objects.values_list('product_item_id', 'variant_option_id').iterator():
+        option_ids_by_item.setdefault(item_id, []).append(str(option_id))
+
+    items = list(ProductVariantItem.objects.only('id'))
+    for item in items:
+        canonical = ",".join(sorted(set(option_ids_by_item.get(item.id, []))))
+        item.configuration_signature = hashlib.sha256(canonical.encode()).hexdigest()
+    ProductVariantItem.objects.bulk_update(items, ['configuration_signature'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products_app', '0006_lowstockalert_stocktransaction'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productvariantitem',
+            name='configuration_signature',
+            field=models.CharField(blank=True, default='', editable=False, max_length=64),
+        ),
+        migrations.AddIndex(
+            model_name='productvariantitem',
+            index=models.Index(fields=['product', 'configuration_signature'], name='variant_item_signature_idx'),
+        ),
+        migrations.RunPython(backfill_configuration_signatures, migrations.RunPython.noop),
+    ]
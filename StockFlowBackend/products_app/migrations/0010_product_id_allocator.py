@@ -0,0 +1,48 @@
+# Generated by Django 5.1.7 on 2026-10-18 02:32
+
+from django.db import migrations, models
+
+PRODUCT_ID_START = 10000000
+PRODUCT_ID_BLOCK_SIZE = 100
+
+
+def start_product_id_allocator(apps, schema_editor):
+    Product = apps.get_model('products_app', 'Product')
+    ProductIdCounter = apps.get_model('products_app', 'ProductIdCounter')
+
+    # Existing ids were drawn at random from the 8-digit range; continue above all of them
+    latest = Product.objects.aggregate(latest=models.Max('product_id'))['latest']
+    start = max(PRODUCT_ID_START, (latest or 0) + 1)
+
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            f"CREATE SEQUENCE IF NOT EXISTS product_id_seq START WITH {start} INCREMENT BY {PRODUCT_ID_BLOCK_SIZE}"
+        )
+    else:
+        ProductIdCounter.objects.create(name='product', next_value=start)
+
+
+def drop_product_id_sequence(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute("DROP SEQUENCE IF EXISTS product_id_seq")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products_app', '0009_access_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductIdCounter',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('next_value', models.BigIntegerField()),
+            ],
+            options={
+                'db_table': 'product_id_counters',
+            },
+        ),
+        migrations.RunPython(start_product_id_allocator, drop_product_id_sequence),
+    ]
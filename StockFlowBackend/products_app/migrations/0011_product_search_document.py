@@ -0,0 +1,67 @@
+# Generated by Django 5.1.7 on 2026-10-18 02:38
+
+from django.db import migrations, models
+
+
+def backfill_search_documents(apps, schema_editor):
+    Product = apps.get_model('products_app', 'Product')
+    ProductVariantItem = apps.get_model('products_app', 'ProductVariantItem')
+    ProductConfiguration = apps.get_model('products_app', 'ProductConfiguration')
+
+    terms = {}
+    for product_id, code in ProductVariantItem.objects.values_list('product_id', 'product_code').iterator():
+        terms.setdefault(product_id, {})[code] = None
+    for product_id, option in ProductConfiguration.objects.values_list(
+        'product_item__product_id', 'variant_option__option'
+    ).iterator():
+        terms.setdefault(product_id, {})[option] = None
+
+    products = list(Product.objects.only('id', 'name', 'hsn_code'))
+    for product in products:
+        words = [product.name, product.hsn_code or '', *terms.get(product.id, {})]
+        product.search_document = ' '.join(word for word in words if word)
+    Product.objects.bulk_update(products, ['search_document'], batch_size=1000)
+
+
+def create_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    # Must match the SearchVector("search_document", config="simple") used by ProductQuerySet.search
+    schema_editor.execute(
+        "CREATE INDEX IF NOT EXISTS products_search_document_fts_idx ON products "
+        "USING gin (to_tsvector('simple'::regconfig, COALESCE(search_document, '')))"
+    )
+    # Trigram matching is optional: pg_trgm ships with contrib, which not every server has
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        if cursor.fetchone() is None:
+            return
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    schema_editor.execute(
+        "CREATE INDEX IF NOT EXISTS products_search_document_trgm_idx ON products "
+        "USING gin (search_document gin_trgm_ops)"
+    )
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute("DROP INDEX IF EXISTS products_search_document_trgm_idx")
+    schema_editor.execute("DROP INDEX IF EXISTS products_search_document_fts_idx")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products_app', '0010_product_id_allocator'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='search_document',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.RunPython(backfill_search_documents, migrations.RunPython.noop),
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
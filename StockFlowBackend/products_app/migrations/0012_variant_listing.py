@@ -0,0 +1,67 @@
+# Generated by Django 5.1.7 on 2026-10-18 02:43
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_variant_listings(apps, schema_editor):
+    ProductVariantItem = apps.get_model('products_app', 'ProductVariantItem')
+    ProductConfiguration = apps.get_model('products_app', 'ProductConfiguration')
+    VariantListing = apps.get_model('products_app', 'VariantListing')
+
+    configurations = {}
+    for configuration in ProductConfiguration.objects.select_related('variant_option__variant').iterator():
+        configurations.setdefault(configuration.product_item_id, []).append({
+            'id': str(configuration.id),
+            'product_item': str(configuration.product_item_id),
+            'variant_option': str(configuration.variant_option_id),
+            'variant_name': configuration.variant_option.variant.name,
+            'option_value': configuration.variant_option.option,
+        })
+
+    listings = []
+    for item in ProductVariantItem.objects.select_related('product__subcategory__category').iterator():
+        subcategory = item.product.subcategory
+        listings.append(VariantListing(
+            variant_id=item.id,
+            product_id=item.product_id,
+            product_name=item.product.name,
+            product_code=item.product_code,
+            image=item.image.name or None,
+            quantity=item.quantity,
+            price=item.price,
+            hsn_code=item.hsn_code,
+            subcategory=f"{subcategory.category.name} - {subcategory.name}",
+            configurations=configurations.get(item.id, []),
+        ))
+    VariantListing.objects.bulk_create(listings, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products_app', '0011_product_search_document'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VariantListing',
+            fields=[
+                ('variant', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='listing', serialize=False, to='products_app.productvariantitem')),
+                ('product_name', models.CharField(max_length=255)),
+                ('product_code', models.CharField(db_index=True, max_length=255)),
+                ('image', models.CharField(blank=True, max_length=100, null=True)),
+                ('quantity', models.PositiveIntegerField(default=0)),
+                ('price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('hsn_code', models.CharField(blank=True, max_length=255, null=True)),
+                ('subcategory', models.CharField(max_length=511)),
+                ('configurations', models.JSONField(default=list)),
+                ('product', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='products_app.product')),
+            ],
+            options={
+                'db_table': 'variant_listings',
+                'indexes': [models.Index(fields=['product', 'product_code'], name='variant_listing_product_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_variant_listings, migrations.RunPython.noop),
+    ]
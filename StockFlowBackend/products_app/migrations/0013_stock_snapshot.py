@@ -0,0 +1,28 @@
+# Generated by Django 5.1.7 on 2026-10-18 03:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products_app', '0012_variant_listing'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('quantity', models.IntegerField()),
+                ('product_variant', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='stock_snapshots', to='products_app.productvariantitem')),
+            ],
+            options={
+                'db_table': 'stock_snapshots',
+                'indexes': [models.Index(fields=['date'], name='stock_snapshot_date_idx')],
+                'constraints': [models.UniqueConstraint(fields=('product_variant', 'date'), name='stock_snapshot_variant_date_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,90 @@
+from django.db import migrations
+
+
+def table_definitions(cursor, table):
+    """
+    Index and foreign key definitions of table, to recreate them under the same names
+    """
+    cursor.execute(
+        "SELECT indexdef FROM pg_indexes WHERE schemaname = current_schema() AND tablename = %s "
+        "AND indexname <> %s",
+        [table, f"{table}_pkey"]
+    )
+    indexes = [indexdef for indexdef, in cursor.fetchall()]
+    cursor.execute(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = %s::regclass "
+        "AND contype = 'f'",
+        [table]
+    )
+    return indexes, cursor.fetchall()
+
+
+def recreate_definitions(cursor, table, indexes, foreign_keys):
+    for indexdef in indexes:
+        cursor.execute(indexdef)
+    for name, definition in foreign_keys:
+        cursor.execute(f"ALTER TABLE {table} ADD CONSTRAINT {name} {definition}")
+
+
+def partition_stock_transactions(apps, schema_editor):
+    """
+    Rebuild stock_transactions as a table range-partitioned on timestamp, holding
+    every existing row in a DEFAULT partition; manage_stock_partitions create then
+    splits it into monthly partitions. A partitioned table's primary key has to
+    include the partition key, so it becomes (id, timestamp).
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        indexes, foreign_keys = table_definitions(cursor, 'stock_transactions')
+        cursor.execute("ALTER TABLE stock_transactions RENAME TO stock_transactions_unpartitioned")
+        cursor.execute(
+            "CREATE TABLE stock_transactions (LIKE stock_transactions_unpartitioned "
+            "INCLUDING DEFAULTS INCLUDING CONSTRAINTS) PARTITION BY RANGE (timestamp)"
+        )
+        cursor.execute("CREATE TABLE stock_transactions_default PARTITION OF stock_transactions DEFAULT")
+        cursor.execute("INSERT INTO stock_transactions SELECT * FROM stock_transactions_unpartitioned")
+        cursor.execute("DROP TABLE stock_transactions_unpartitioned")
+
+        cursor.execute("ALTER TABLE stock_transactions ADD PRIMARY KEY (id, timestamp)")
+        recreate_definitions(cursor, 'stock_transactions', indexes, foreign_keys)
+        # Name the default partition's indexes after their parents, as manage_stock_partitions does
+        cursor.execute(
+            """
+            SELECT child.relname, parent.relname
+            FROM pg_index
+            JOIN pg_class child ON child.oid = pg_index.indexrelid
+            JOIN pg_inherits ON pg_inherits.inhrelid = child.oid
+            JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+            WHERE pg_index.indrelid = 'stock_transactions_default'::regclass
+            """
+        )
+        for index, parent_index in cursor.fetchall():
+            cursor.execute(f'ALTER INDEX "{index}" RENAME TO "{parent_index[:54]}_default"')
+
+
+def unpartition_stock_transactions(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        indexes, foreign_keys = table_definitions(cursor, 'stock_transactions')
+        cursor.execute(
+            "CREATE TABLE stock_transactions_unpartitioned "
+            "(LIKE stock_transactions INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+        )
+        cursor.execute("INSERT INTO stock_transactions_unpartitioned SELECT * FROM stock_transactions")
+        cursor.execute("DROP TABLE stock_transactions")
+        cursor.execute("ALTER TABLE stock_transactions_unpartitioned RENAME TO stock_transactions")
+        cursor.execute("ALTER TABLE stock_transactions ADD PRIMARY KEY (id)")
+        recreate_definitions(cursor, 'stock_transactions', indexes, foreign_keys)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products_app', '0013_stock_snapshot'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_stock_transactions, unpartition_stock_transactions),
+    ]
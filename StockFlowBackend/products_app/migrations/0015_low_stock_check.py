@@ -0,0 +1,24 @@
+# Generated by Django 5.1.7 on 2026-10-18 03:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products_app', '0014_partition_stock_transactions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LowStockCheck',
+            fields=[
+                ('product_variant', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='+', serialize=False, to='products_app.productvariantitem')),
+                ('queued_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                'db_table': 'low_stock_checks',
+            },
+        ),
+    ]
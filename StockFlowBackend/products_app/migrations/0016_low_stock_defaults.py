@@ -0,0 +1,36 @@
+# Generated by Django 5.1.7 on 2026-10-18 03:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products_app', '0015_low_stock_check'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='low_stock_threshold',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='subcategory',
+            name='low_stock_threshold',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='lowstockalert',
+            name='threshold',
+            field=models.IntegerField(blank=True, default=10, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='lowstockalert',
+            index=models.Index(condition=models.Q(('is_active', True), ('threshold__isnull', False)), fields=['threshold'], name='low_stock_active_threshold_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productvariantitem',
+            index=models.Index(fields=['quantity', 'id'], name='variant_item_quantity_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.7 on 2026-10-18 03:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products_app', '0016_low_stock_defaults'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lowstockalert',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='variantlisting',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -0,0 +1,76 @@
+# Generated by Django 5.1.7 on 2026-10-18 03:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, DecimalField, F, OuterRef, Subquery, Sum
+
+
+def build_stock_summaries(apps, schema_editor):
+    SubCategory = apps.get_model('products_app', 'SubCategory')
+    Product = apps.get_model('products_app', 'Product')
+    VariantListing = apps.get_model('products_app', 'VariantListing')
+    CategoryStockSummary = apps.get_model('products_app', 'CategoryStockSummary')
+
+    VariantListing.objects.update(category=Subquery(
+        SubCategory.objects.filter(products=OuterRef('product')).values('category')[:1]
+    ))
+
+    summaries = {}
+    for category_id, products in Product.objects.values('subcategory__category').annotate(
+        count=Count('pk')
+    ).values_list('subcategory__category', 'count'):
+        summaries[category_id] = CategoryStockSummary(category_id=category_id, products=products)
+    for category_id, variants, units, stock_value in VariantListing.objects.values('category').annotate(
+        variants=Count('pk'),
+        units=Sum('quantity'),
+        stock_value=Sum(F('quantity') * F('price'), output_field=DecimalField()),
+    ).values_list('category', 'variants', 'units', 'stock_value'):
+        summary = summaries.setdefault(category_id, CategoryStockSummary(category_id=category_id))
+        summary.variants, summary.units, summary.stock_value = variants, units, stock_value
+    CategoryStockSummary.objects.bulk_create(summaries.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products_app', '0017_conditional_get_validators'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryStockSummary',
+            fields=[
+                ('category', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stock_summary', serialize=False, to='products_app.category')),
+                ('products', models.IntegerField(default=0)),
+                ('variants', models.IntegerField(default=0)),
+                ('units', models.BigIntegerField(default=0)),
+                ('stock_value', models.DecimalField(decimal_places=2, default=0, max_digits=18)),
+            ],
+            options={
+                'db_table': 'category_stock_summaries',
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyStockMovement',
+            fields=[
+                ('date', models.DateField(primary_key=True, serialize=False)),
+                ('movements', models.IntegerField(default=0)),
+                ('units_in', models.BigIntegerField(default=0)),
+                ('units_out', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'daily_stock_movements',
+            },
+        ),
+        migrations.AddField(
+            model_name='variantlisting',
+            name='category',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='products_app.category'),
+        ),
+        migrations.RunPython(build_stock_summaries, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='variantlisting',
+            name='category',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='products_app.category'),
+        ),
+    ]
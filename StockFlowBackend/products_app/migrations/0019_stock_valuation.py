@@ -0,0 +1,35 @@
+# Generated by Django 5.1.7 on 2026-10-18 04:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products_app', '0018_dashboard_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stocktransaction',
+            name='unit_cost',
+            field=models.DecimalField(blank=True, decimal_places=4, max_digits=12, null=True),
+        ),
+        migrations.CreateModel(
+            name='CostLayerCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('quantity', models.IntegerField()),
+                ('fifo_layers', models.JSONField(default=list)),
+                ('average_cost', models.DecimalField(decimal_places=4, max_digits=12)),
+                ('product_variant', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='cost_checkpoints', to='products_app.productvariantitem')),
+            ],
+            options={
+                'db_table': 'cost_layer_checkpoints',
+                'indexes': [models.Index(fields=['date'], name='cost_checkpoint_date_idx')],
+                'constraints': [models.UniqueConstraint(fields=('product_variant', 'date'), name='cost_checkpoint_variant_date_uniq')],
+            },
+        ),
+    ]
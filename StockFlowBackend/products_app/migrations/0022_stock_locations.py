@@ -0,0 +1,105 @@
+# Generated by Django 5.1.7 on 2026-10-18 17:10
+
+import uuid
+from itertools import islice
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def stock_default_location(apps, schema_editor):
+    """
+    Create the default location and book every variant's stock there
+    """
+    Location = apps.get_model('products_app', 'Location')
+    LocationStock = apps.get_model('products_app', 'LocationStock')
+    ProductVariantItem = apps.get_model('products_app', 'ProductVariantItem')
+
+    location = Location.objects.create(name="Main warehouse", code="MAIN", is_default=True)
+    stock = ProductVariantItem.objects.filter(quantity__gt=0).order_by('pk').values_list('pk', 'quantity')
+    rows = (
+        LocationStock(product_variant_id=pk, location=location, quantity=quantity)
+        for pk, quantity in stock.iterator(chunk_size=5000)
+    )
+    while batch := list(islice(rows, 5000)):
+        LocationStock.objects.bulk_create(batch)
+
+
+def name_partition_indexes(apps, schema_editor):
+    """
+    Name the new indexes on each partition of stock_transactions after their
+    parents, as manage_stock_partitions does
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    from products_app import partitions
+
+    with schema_editor.connection.cursor() as cursor:
+        if partitions.is_partitioned(cursor):
+            for name, _ in partitions.list_partitions(cursor):
+                partitions.name_partition_indexes(cursor, name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products_app', '0021_stock_reservations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Location',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('code', models.CharField(max_length=32, unique=True)),
+                ('address', models.TextField(blank=True, default='')),
+                ('is_default', models.BooleanField(default=False)),
+                ('is_active', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'locations',
+                'constraints': [models.UniqueConstraint(condition=models.Q(('is_default', True)), fields=('is_default',), name='location_single_default')],
+            },
+        ),
+        migrations.CreateModel(
+            name='LocationStock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField(default=0)),
+                ('location', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='stock', to='products_app.location')),
+                ('product_variant', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='location_stock', to='products_app.productvariantitem')),
+            ],
+            options={
+                'db_table': 'location_stock',
+                'indexes': [models.Index(fields=['location', 'product_variant'], name='location_stock_location_idx')],
+                'constraints': [models.UniqueConstraint(fields=('product_variant', 'location'), name='location_stock_variant_location_uniq')],
+            },
+        ),
+        migrations.AlterField(
+            model_name='stocktransaction',
+            name='transaction_type',
+            field=models.CharField(choices=[('add', 'Stock Addition'), ('remove', 'Stock Removal'), ('adjustment', 'Stock Adjustment'), ('transfer', 'Stock Transfer')], max_length=20),
+        ),
+        migrations.AddField(
+            model_name='stocktransaction',
+            name='source_location',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='products_app.location'),
+        ),
+        migrations.AddField(
+            model_name='stocktransaction',
+            name='destination_location',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='products_app.location'),
+        ),
+        migrations.AddIndex(
+            model_name='stocktransaction',
+            index=models.Index(fields=['source_location', '-timestamp'], name='stock_txn_source_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stocktransaction',
+            index=models.Index(fields=['destination_location', '-timestamp'], name='stock_txn_destination_ts_idx'),
+        ),
+        migrations.RunPython(name_partition_indexes, migrations.RunPython.noop),
+        migrations.RunPython(stock_default_location, migrations.RunPython.noop),
+    ]
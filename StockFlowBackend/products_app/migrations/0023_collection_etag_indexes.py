@@ -0,0 +1,23 @@
+# Generated by Django 5.1.7 on 2026-10-18 19:05
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products_app', '0022_stock_locations'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['updated_at'], name='products_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='variantlisting',
+            index=models.Index(fields=['updated_at'], name='variant_listing_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.1.7 on 2026-10-18 21:40
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_created_at(apps, schema_editor):
+    # A variant cannot predate its product; that is the closest record existing variants have
+    ProductVariantItem = apps.get_model('products_app', 'ProductVariantItem')
+    Product = apps.get_model('products_app', 'Product')
+    ProductVariantItem.objects.update(
+        created_at=Subquery(Product.objects.filter(pk=OuterRef('product_id')).values('created_at')[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products_app', '0023_collection_etag_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productvariantitem',
+            name='created_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.RunPython(backfill_created_at, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='productvariantitem',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True),
+        ),
+    ]
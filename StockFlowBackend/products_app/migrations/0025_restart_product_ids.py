@@ -0,0 +1,36 @@
+# Generated by Django 5.1.7 on 2026-10-18 22:15
+
+from django.db import migrations
+from django.db.models import Exists, Min, OuterRef
+
+PRODUCT_ID_START = 10000000
+
+
+def restart_product_ids(apps, schema_editor):
+    Product = apps.get_model('products_app', 'Product')
+    ProductIdCounter = apps.get_model('products_app', 'ProductIdCounter')
+
+    # 0010 started above the highest of the random 8-digit ids, which soon runs
+    # into 9 digits. Start again from the lowest free id instead; the allocator
+    # skips the ids above it that are already in use
+    start = PRODUCT_ID_START
+    if Product.objects.filter(product_id=start).exists():
+        start = Product.objects.filter(product_id__gte=start).exclude(
+            Exists(Product.objects.filter(product_id=OuterRef('product_id') + 1))
+        ).aggregate(last=Min('product_id'))['last'] + 1
+
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(f"ALTER SEQUENCE product_id_seq RESTART WITH {start}")
+    else:
+        ProductIdCounter.objects.update_or_create(name='product', defaults={'next_value': start})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products_app', '0024_productvariantitem_created_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(restart_product_ids, migrations.RunPython.noop),
+    ]
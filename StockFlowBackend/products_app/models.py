@@ -1,13 +1,25 @@
+import hashlib
+import re
+import threading
 import uuid
-from django.db import models
+import datetime
+from functools import partial
+from itertools import groupby
+from operator import itemgetter
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, TrigramWordSimilarity
+from django.db import IntegrityError, connections, models, router, transaction
+from django.db.models import Case, F, Max, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, Greatest, TruncDate
 from django.contrib.auth.models import User
-from django.db.models.signals import pre_save
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.dispatch import receiver
-import random
+from django.utils import timezone
 
 class Category(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     name = models.CharField(max_length=255, unique=True, db_index=True)  # Indexed for faster lookups
+    # Default low-stock threshold for variants in this category; see ProductVariantItemQuerySet.low_stock
+    low_stock_threshold = models.PositiveIntegerField(blank=True, null=True)
 
     class Meta:
         db_table = "categories"
@@ -20,16 +32,160 @@ class SubCategory(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name="subcategories")
     name = models.CharField(max_length=255, db_index=True)  # Indexed for searches
+    # Overrides the category's default low-stock threshold
+    low_stock_threshold = models.PositiveIntegerField(blank=True, null=True)
 
     class Meta:
         db_table = "subcategories"
         unique_together = (("category", "name"),)  # Avoid duplicate names under the same category
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Lets a save notice the subcategory moving category; see move_subcategory_in_stock_summary
+        instance._loaded_category_id = instance.__dict__.get("category_id")
+        return instance
+
     def __str__(self):
         return f"{self.category.name} - {self.name}"
 
 
 
+PRODUCT_ID_START = 10000000
+PRODUCT_ID_BLOCK_SIZE = 100
+PRODUCT_ID_SEQUENCE = "product_id_seq"
+
+
+class ProductIdCounter(models.Model):
+    """
+    High-water mark for product_id blocks on databases without sequences
+    """
+    name = models.CharField(max_length=50, primary_key=True)
+    next_value = models.BigIntegerField()
+
+    class Meta:
+        db_table = "product_id_counters"
+
+
+class ProductIdAllocator:
+    """
+    Hand out product_ids from blocks reserved in the database, so an insert
+    only touches the database once every PRODUCT_ID_BLOCK_SIZE ids.
+
+    On PostgreSQL a block is one nextval() on a sequence that increments by the
+    block size; sequences are never rolled back, so concurrent workers always
+    get disjoint blocks. Elsewhere the block is taken from a locked counter row.
+
+    Blocks count up from PRODUCT_ID_START, keeping product_ids (and the product
+    codes built from them) 8 digits long. Ids in a block that are already in
+    use, such as those drawn at random before blocks were reserved, are read in
+    one indexed range lookup when the block is reserved, and skipped.
+    """
+
+    block_size = PRODUCT_ID_BLOCK_SIZE
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._blocks = {}  # database alias -> [free ids left in the block, end of block]
+
+    def allocate(self, count=1, using=None):
+        using = using or router.db_for_write(Product)
+        ids = []
+        with self._lock:
+            block = self._blocks.setdefault(using, [[], 0])
+            while len(ids) < count:
+                if not block[0]:
+                    start = self._reserve_block(using, block[1])
+                    block[1] = start + self.block_size
+                    taken = set(
+                        Product.objects.using(using).filter(product_id__gte=start, product_id__lt=block[1])
+                        .values_list("product_id", flat=True)
+                    )
+                    block[0] = [product_id for product_id in range(start, block[1]) if product_id not in taken]
+                    continue
+                take = min(count - len(ids), len(block[0]))
+                ids.extend(block[0][:take])
+                del block[0][:take]
+        return ids
+
+    def _reserve_block(self, using, previous_end):
+        connection = connections[using]
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT nextval(%s)", [PRODUCT_ID_SEQUENCE])
+                return cursor.fetchone()[0]
+
+        with transaction.atomic(using=using):
+            counter = ProductIdCounter.objects.using(using).select_for_update().filter(name="product").first()
+            if counter is None:
+                counter = ProductIdCounter(name="product", next_value=PRODUCT_ID_START)
+            # The counter moves back if the caller's transaction rolls back;
+            # never hand out a block this process has already used
+            start = max(counter.next_value, previous_end)
+            counter.next_value = start + self.block_size
+            counter.save(using=using)
+        return start
+
+
+product_ids = ProductIdAllocator()
+
+
+# Databases where the pg_trgm extension is installed, checked once per process
+_trigram_support = {}
+
+
+def has_trigram_support(using):
+    if using not in _trigram_support:
+        with connections[using].cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+            _trigram_support[using] = cursor.fetchone() is not None
+    return _trigram_support[using]
+
+
+class ProductQuerySet(models.QuerySet):
+    def search(self, text):
+        """
+        Products whose search_document matches every word of text, best matches first.
+
+        On PostgreSQL each word is a prefix match against the full-text index, and
+        when pg_trgm is installed near misses (typos) match through trigram word
+        similarity too. Other databases fall back to a case-insensitive substring
+        match on every word.
+        """
+        terms = re.findall(r"\w+", text.lower())
+        if not terms:
+            return self.none()
+
+        if connections[self.db].vendor != "postgresql":
+            matches = Q()
+            for term in terms:
+                matches &= Q(search_document__icontains=term)
+            return self.filter(matches).annotate(
+                rank=Case(When(name__istartswith=terms[0], then=Value(1.0)), default=Value(0.0))
+            ).order_by("-rank", "-created_at", "id")
+
+        vector = SearchVector("search_document", config="simple")
+        query = SearchQuery(" & ".join(f"{term}:*" for term in terms), config="simple", search_type="raw")
+        queryset = self.annotate(search_vector=vector, rank=SearchRank(vector, query))
+        matches = Q(search_vector=query)
+        ordering = ["-rank"]
+        if has_trigram_support(self.db):
+            queryset = queryset.annotate(similarity=TrigramWordSimilarity(text, "search_document"))
+            matches |= Q(search_document__trigram_word_similar=text)
+            ordering.append("-similarity")
+        return queryset.filter(matches).order_by(*ordering, "-created_at", "id")
+
+    def bulk_create(self, objs, *args, **kwargs):
+        """
+        Assign product_ids up front, since bulk_create bypasses the pre_save signal
+        """
+        objs = list(objs)
+        missing = [obj for obj in objs if not obj.product_id]
+        for obj, product_id in zip(missing, product_ids.allocate(len(missing), using=self.db)):
+            obj.product_id = product_id
+        return super().bulk_create(objs, *args, **kwargs)
+
+
 class Product(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     product_id = models.BigIntegerField(unique=True, db_index=True, blank=True, null=True)  # Auto-generated now
@@ -42,26 +198,152 @@ class Product(models.Model):
     total_stock = models.PositiveIntegerField(default=0, blank=True, null=True)
     subcategory = models.ForeignKey(SubCategory, on_delete=models.CASCADE, related_name="products")
     hsn_code = models.CharField(max_length=255, blank=True, null=True)  # Add HSN code field to Product model
+    # Name, HSN code, variant product codes and option values; see refresh_search_documents
+    search_document = models.TextField(blank=True, default="", editable=False)
+
+    objects = ProductQuerySet.as_manager()
 
     class Meta:
         db_table = "products"
         ordering = ("-created_at", "product_id")
+        indexes = [
+            # Keyset pagination on (created_at, id)
+            models.Index(fields=["-created_at", "-id"], name="products_created_id_idx"),
+            # Default Meta.ordering
+            models.Index(fields=["-created_at", "product_id"], name="products_ordering_idx"),
+            # Latest write, for the collection ETag
+            models.Index(fields=["updated_at"], name="products_updated_idx"),
+        ]
 
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Lets a save notice the product moving category; see count_products_in_stock_summary
+        instance._loaded_subcategory_id = instance.__dict__.get("subcategory_id")
+        return instance
+
+    @classmethod
+    def apply_stock_delta(cls, product_id, delta):
+        """
+        Shift total_stock by delta in place, without re-aggregating the variants
+        or touching updated_at
+        """
+        if delta:
+            cls.objects.filter(pk=product_id).update(total_stock=Coalesce(F("total_stock"), 0) + delta)
+
+    @classmethod
+    def refresh_search_documents(cls, product_ids, batch_size=1000):
+        """
+        Rebuild search_document for the given products from their variants and options
+        """
+        product_ids = list(set(product_ids))
+        for start in range(0, len(product_ids), batch_size):
+            batch = product_ids[start:start + batch_size]
+            terms = {}
+            for product_id, code in ProductVariantItem.objects.filter(product_id__in=batch).values_list(
+                "product_id", "product_code"
+            ):
+                terms.setdefault(product_id, {})[code] = None
+            for product_id, option in ProductConfiguration.objects.filter(
+                product_item__product_id__in=batch
+            ).values_list("product_item__product_id", "variant_option__option"):
+                terms.setdefault(product_id, {})[option] = None
+
+            products = list(cls.objects.filter(pk__in=batch).only("id", "name", "hsn_code"))
+            for product in products:
+                words = [product.name, product.hsn_code or "", *terms.get(product.id, {})]
+                product.search_document = " ".join(word for word in words if word)
+            cls.objects.bulk_update(products, ["search_document"])
+
+
+class CommitQueue:
+    """
+    Collect ids by kind during a transaction and hand them to callback, as a
+    {kind: set of ids} dict, once the transaction commits. An id queued many
+    times in one transaction is processed once.
+    """
+
+    def __init__(self, callback):
+        self.callback = callback
+        self._local = threading.local()
+
+    def pending(self):
+        """
+        The current transaction's pending entries
+        """
+        pending = getattr(self._local, "pending", None)
+        flush = getattr(self._local, "flush", None)
+        # Entries queued by a transaction that rolled back lost their flush with it
+        if pending is None or flush is None or not any(
+            callback is flush for _, callback, _ in transaction.get_connection().run_on_commit
+        ):
+            pending = self._local.pending = {}
+            self._local.flush = None
+        return pending
+
+    def schedule(self):
+        """
+        Register one flush for the pending entries, run once the transaction
+        commits or at once outside a transaction, so entries are queued first
+        """
+        if getattr(self._local, "flush", None) is None:
+            self._local.flush = flush = partial(self.flush)
+            transaction.on_commit(flush)
+
+    def add(self, kind, ids):
+        self.pending().setdefault(kind, set()).update(ids)
+        self.schedule()
+
+    def flush(self):
+        pending = getattr(self._local, "pending", None)
+        self._local.pending = self._local.flush = None
+        if pending:
+            self.callback(pending)
+
+
+class CommitCounter(CommitQueue):
+    """
+    A CommitQueue of numeric deltas: add(kind, {key: deltas}) sums the deltas of
+    each key element-wise, and callback gets {kind: {key: [totals]}}
+    """
+
+    def add(self, kind, deltas):
+        totals = self.pending().setdefault(kind, {})
+        for key, values in deltas.items():
+            current = totals.setdefault(key, [0] * len(values))
+            for index, value in enumerate(values):
+                current[index] += value
+        self.schedule()
+
+
+def refresh_search_documents(pending):
+    product_ids = pending.get("product", set())
+    if pending.get("item"):
+        product_ids |= set(
+            ProductVariantItem.objects.filter(pk__in=pending["item"]).values_list("product_id", flat=True)
+        )
+    Product.refresh_search_documents(product_ids)
+
+
+# Products (or the products of variant items) whose search_document is stale
+search_refresh = CommitQueue(refresh_search_documents)
+
 
 # Signal to generate product_id before saving a new Product
 @receiver(pre_save, sender=Product)
-def generate_product_id(sender, instance, **kwargs):
+def generate_product_id(sender, instance, using=None, **kwargs):
     # Only generate if product_id is not set
     if not instance.product_id:
-        # Generate a unique 8-digit ID
-        while True:
-            product_id = random.randint(10000000, 99999999)
-            if not Product.objects.filter(product_id=product_id).exists():
-                instance.product_id = product_id
-                break
+        instance.product_id = product_ids.allocate(using=using)[0]
+
+
+@receiver(post_save, sender=Product)
+def refresh_product_search_document(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or {"name", "hsn_code"} & set(update_fields):
+        search_refresh.add("product", [instance.id])
 
 
 class Variant(models.Model):
@@ -90,21 +372,121 @@ class VariantOption(models.Model):  # Changed name from VariantOptions to Varian
         return f"{self.variant.name}: {self.option}"
 
 
+def configurations_prefetch(lookup="configurations"):
+    """
+    Prefetch a variant's configurations together with their option and variant names
+    """
+    return models.Prefetch(
+        lookup,
+        queryset=ProductConfiguration.objects.select_related("variant_option__variant"),
+    )
+
+
+class ProductVariantItemQuerySet(models.QuerySet):
+    def with_details(self):
+        """
+        Load everything a variant listing renders in a constant number of queries
+        """
+        return self.select_related("product__subcategory__category").prefetch_related(
+            configurations_prefetch()
+        )
+
+    def low_stock(self):
+        """
+        Variants at or below their effective low-stock threshold, annotated with it
+        as low_stock_threshold: the variant's own LowStockAlert threshold, else its
+        subcategory's default, else its category's. Variants whose alert is
+        inactive are muted; variants with no threshold at all are never low.
+
+        quantity is also bounded by the highest threshold in force, looked up
+        first in a small query of its own: the planner sees the bound as a
+        constant and can range-scan variant_item_quantity_idx instead of reading
+        every variant.
+        """
+        highest = LowStockAlert.objects.filter(is_active=True).aggregate(
+            highest=Greatest(*[
+                Coalesce(threshold, -1, output_field=models.IntegerField())
+                for threshold in (
+                    Max("threshold"),
+                    Subquery(
+                        SubCategory.objects.filter(low_stock_threshold__isnull=False)
+                        .order_by("-low_stock_threshold").values("low_stock_threshold")[:1]
+                    ),
+                    Subquery(
+                        Category.objects.filter(low_stock_threshold__isnull=False)
+                        .order_by("-low_stock_threshold").values("low_stock_threshold")[:1]
+                    ),
+                )
+            ])
+        )["highest"]
+        return self.annotate(
+            low_stock_threshold=Coalesce(
+                "lowstockalert__threshold",
+                "product__subcategory__low_stock_threshold",
+                "product__subcategory__category__low_stock_threshold",
+                output_field=models.IntegerField(),
+            )
+        ).filter(
+            Q(lowstockalert__isnull=True) | Q(lowstockalert__is_active=True),
+            quantity__lte=highest,
+        ).filter(quantity__lte=F("low_stock_threshold"))
+
+
 class ProductVariantItem(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="items")
     product_code = models.CharField(max_length=255, unique=True, db_index=True)  # Unique SKU for each variant
     image = models.ImageField(upload_to="uploads/", blank=True, null=True)  # Variant-specific image
     quantity = models.PositiveIntegerField(default=0)  # Stock level for this variant
+    # Units held by active reservations, which removals cannot take; see StockReservation
+    reserved_quantity = models.PositiveIntegerField(default=0, editable=False)
     price = models.DecimalField(max_digits=10, decimal_places=2)  # Variant price
     hsn_code = models.CharField(max_length=255, blank=True, null=True)  # Tax code specific to this variant
+    # Digest of the sorted variant option IDs, used for duplicate configuration lookups
+    configuration_signature = models.CharField(max_length=64, blank=True, default="", editable=False)
+    # Point-in-time stock leaves out variants created after the moment asked about
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = ProductVariantItemQuerySet.as_manager()
 
     class Meta:
         db_table = "product_variant_items"
+        indexes = [
+            models.Index(fields=["product", "configuration_signature"], name="variant_item_signature_idx"),
+            # Low-stock scans: range on quantity, ordered by (quantity, id) for pagination
+            models.Index(fields=["quantity", "id"], name="variant_item_quantity_idx"),
+        ]
 
     def __str__(self):
         return f"{self.product.name} - {self.product_code} | Stock: {self.quantity} | Price: {self.price}"
 
+    @property
+    def available_quantity(self):
+        """
+        Stock not held by a reservation
+        """
+        return self.quantity - self.reserved_quantity
+
+    @staticmethod
+    def build_configuration_signature(option_ids):
+        """
+        Return an order-independent digest for a set of variant option IDs
+        """
+        canonical = ",".join(sorted({str(option_id) for option_id in option_ids}))
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+    @classmethod
+    def refresh_configuration_signature(cls, item_id):
+        """
+        Recompute the stored signature of a variant item from its configurations
+        """
+        option_ids = ProductConfiguration.objects.filter(
+            product_item_id=item_id
+        ).values_list("variant_option_id", flat=True)
+        cls.objects.filter(pk=item_id).update(
+            configuration_signature=cls.build_configuration_signature(option_ids)
+        )
+
 class ProductConfiguration(models.Model):  # Changed name from Product_Configuration
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     product_item = models.ForeignKey(ProductVariantItem, on_delete=models.CASCADE, related_name="configurations")
@@ -117,11 +499,168 @@ class ProductConfiguration(models.Model):  # Changed name from Product_Configura
     def __str__(self):
         return f"{self.product_item.product.name} - {self.variant_option.variant.name}: {self.variant_option.option}"
 
+
+# Keep the configuration signature in sync when configurations are edited directly
+@receiver(post_save, sender=ProductConfiguration)
+@receiver(post_delete, sender=ProductConfiguration)
+def sync_configuration_signature(sender, instance, **kwargs):
+    ProductVariantItem.refresh_configuration_signature(instance.product_item_id)
+    search_refresh.add("item", [instance.product_item_id])
+
+
+# Product codes are part of the product's search document
+@receiver(post_save, sender=ProductVariantItem)
+@receiver(post_delete, sender=ProductVariantItem)
+def refresh_variant_search_document(sender, instance, **kwargs):
+    search_refresh.add("product", [instance.product_id])
+
 import uuid
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F
 from django.contrib.auth.models import User
 from django.utils import timezone
 
+
+class InsufficientStock(Exception):
+    """
+    Raised when a stock movement would take a variant below zero
+    """
+
+
+DEFAULT_LOCATION_NAME = "Main warehouse"
+DEFAULT_LOCATION_CODE = "MAIN"
+
+
+class Location(models.Model):
+    """
+    A warehouse or other place stock is held. Exactly one location is the
+    default, where movements that name no location are booked.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    name = models.CharField(max_length=255, unique=True)
+    code = models.CharField(max_length=32, unique=True)
+    address = models.TextField(blank=True, default="")
+    is_default = models.BooleanField(default=False)
+    is_active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = "locations"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["is_default"], condition=models.Q(is_default=True), name="location_single_default"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.code} - {self.name}"
+
+    @classmethod
+    def default_id(cls):
+        """
+        The default location's id, creating the location on a database that has none
+        """
+        location_id = cls.objects.filter(is_default=True).values_list("pk", flat=True).first()
+        if location_id is None:
+            location_id = cls.objects.get_or_create(
+                is_default=True, defaults={"name": DEFAULT_LOCATION_NAME, "code": DEFAULT_LOCATION_CODE}
+            )[0].pk
+        return location_id
+
+
+class LocationStock(models.Model):
+    """
+    Stock of one variant at one location. ProductVariantItem.quantity is the
+    sum of a variant's rows, and both are moved together by the stock ledger.
+    """
+    # Indexed through location_stock_variant_location_uniq, which leads with this column
+    product_variant = models.ForeignKey(
+        "ProductVariantItem", on_delete=models.CASCADE, related_name="location_stock", db_index=False
+    )
+    # Indexed through location_stock_location_idx, which leads with this column
+    location = models.ForeignKey(Location, on_delete=models.PROTECT, related_name="stock", db_index=False)
+    quantity = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        db_table = "location_stock"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["product_variant", "location"], name="location_stock_variant_location_uniq"
+            ),
+        ]
+        indexes = [
+            # A location's stock, in variant order for keyset pagination
+            models.Index(fields=["location", "product_variant"], name="location_stock_location_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.product_variant_id} @ {self.location_id}: {self.quantity}"
+
+    @classmethod
+    def apply_delta(cls, variant_id, location_id, delta):
+        """
+        Shift one variant's stock at one location with a conditional UPDATE,
+        creating the row on its first receipt. Callers hold the variant's row
+        lock, so the row cannot be created concurrently.
+        """
+        rows = cls.objects.filter(product_variant_id=variant_id, location_id=location_id)
+        if delta < 0:
+            rows = rows.filter(quantity__gte=-delta)
+        if rows.update(quantity=F("quantity") + delta):
+            return
+        if delta < 0:
+            raise InsufficientStock("Insufficient stock at this location")
+        cls.objects.create(product_variant_id=variant_id, location_id=location_id, quantity=delta)
+
+    @classmethod
+    def stock_opening(cls, items, location_id=None):
+        """
+        Book the quantity new variants were created with at a location (default
+        the default location); for variants written with bulk_create, which
+        sends no post_save
+        """
+        items = [item for item in items if item.quantity]
+        if items:
+            location_id = location_id or Location.default_id()
+            cls.objects.bulk_create(
+                [cls(product_variant_id=item.pk, location_id=location_id, quantity=item.quantity) for item in items],
+                batch_size=1000,
+            )
+
+
+@receiver(post_save, sender=ProductVariantItem)
+def stock_new_variant_at_default_location(sender, instance, created=False, raw=False, **kwargs):
+    if created and not raw:
+        LocationStock.stock_opening([instance])
+
+
+# Stock delta of a transaction in SQL; see StockTransaction.signed_quantity
+SIGNED_QUANTITY = Case(
+    When(transaction_type="remove", then=-F("quantity")),
+    When(transaction_type="transfer", then=Value(0)),
+    default=F("quantity"),
+)
+
+
+class StockTransactionQuerySet(models.QuerySet):
+    def with_details(self):
+        """
+        Load the variant, product, configurations and user rendered with each transaction
+        """
+        return self.select_related("product_variant__product", "user").prefetch_related(
+            configurations_prefetch("product_variant__configurations")
+        )
+
+    def net_quantities(self):
+        """
+        Net stock movement of each variant, as {variant id: delta}
+        """
+        return dict(
+            self.order_by().values("product_variant").annotate(delta=Sum(SIGNED_QUANTITY))
+            .values_list("product_variant", "delta")
+        )
+
+
 class StockTransaction(models.Model):
     """
     Model to track stock transactions (additions and removals)
@@ -129,11 +668,15 @@ class StockTransaction(models.Model):
     TRANSACTION_TYPES = (
         ('add', 'Stock Addition'),
         ('remove', 'Stock Removal'),
-        ('adjustment', 'Stock Adjustment')
+        ('adjustment', 'Stock Adjustment'),
+        ('transfer', 'Stock Transfer')
     )
 
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
-    product_variant = models.ForeignKey('ProductVariantItem', on_delete=models.CASCADE, related_name='stock_transactions')
+    # Indexed through stock_txn_variant_ts_idx, which leads with this column
+    product_variant = models.ForeignKey(
+        'ProductVariantItem', on_delete=models.CASCADE, related_name='stock_transactions', db_index=False
+    )
     quantity = models.IntegerField()
     transaction_type = models.CharField(max_length=20, choices=TRANSACTION_TYPES)
     timestamp = models.DateTimeField(auto_now_add=True)
@@ -142,43 +685,1087 @@ class StockTransaction(models.Model):
     
     # Optional reference to source document (like purchase order or sales invoice)
     reference_number = models.CharField(max_length=255, blank=True, null=True)
+    # Cost per unit received; receipts default to the variant's price. Issues are
+    # costed by the valuation engine, see products_app.valuation
+    unit_cost = models.DecimalField(max_digits=12, decimal_places=4, blank=True, null=True)
+    # Where stock left and arrived: removals and negative adjustments have a
+    # source, additions and positive adjustments a destination, transfers both.
+    # Rows recorded before locations existed have neither. Indexed through
+    # stock_txn_source_ts_idx and stock_txn_destination_ts_idx
+    source_location = models.ForeignKey(
+        Location, on_delete=models.PROTECT, related_name="+", null=True, blank=True, db_index=False
+    )
+    destination_location = models.ForeignKey(
+        Location, on_delete=models.PROTECT, related_name="+", null=True, blank=True, db_index=False
+    )
+
+    objects = StockTransactionQuerySet.as_manager()
     
     class Meta:
         db_table = 'stock_transactions'
         ordering = ['-timestamp']
         verbose_name_plural = 'Stock Transactions'
+        indexes = [
+            # Keyset pagination on (timestamp, id)
+            models.Index(fields=['-timestamp', '-id'], name='stock_txn_timestamp_id_idx'),
+            # Stock history: one variant, newest first, optionally within a date range
+            models.Index(fields=['product_variant', '-timestamp'], name='stock_txn_variant_ts_idx'),
+            # Stock history filtered by transaction type
+            models.Index(
+                fields=['product_variant', 'transaction_type', '-timestamp'],
+                name='stock_txn_variant_type_ts_idx'
+            ),
+            # A location's movements, newest first
+            models.Index(fields=['source_location', '-timestamp'], name='stock_txn_source_ts_idx'),
+            models.Index(fields=['destination_location', '-timestamp'], name='stock_txn_destination_ts_idx'),
+        ]
 
     def __str__(self):
         return f"{self.product_variant} - {self.transaction_type} - {self.quantity} units"
 
+    @property
+    def signed_quantity(self):
+        """
+        Stock delta of this transaction; adjustments carry their own sign and
+        transfers leave the variant's total unchanged
+        """
+        if self.transaction_type == 'remove':
+            return -self.quantity
+        if self.transaction_type == 'transfer':
+            return 0
+        return self.quantity
+
+    @property
+    def location_deltas(self):
+        """
+        Stock delta of this transaction at each location it touches, as [(location id, delta)]
+        """
+        if self.transaction_type == 'transfer':
+            return [(self.source_location_id, -self.quantity), (self.destination_location_id, self.quantity)]
+        delta = self.signed_quantity
+        return [(self.source_location_id if delta < 0 else self.destination_location_id, delta)]
+
+    @property
+    def location_error(self):
+        if self.transaction_type == 'transfer' and (
+            None in (self.source_location_id, self.destination_location_id)
+            or self.source_location_id == self.destination_location_id
+        ):
+            return "Transfers need distinct source and destination locations"
+        return None
+
+    def book_at_location(self, location_id):
+        """
+        Book a movement that names no location at location_id
+        """
+        if self.transaction_type == 'transfer':
+            return
+        if self.signed_quantity < 0:
+            self.source_location_id = self.source_location_id or location_id
+        else:
+            self.destination_location_id = self.destination_location_id or location_id
+
     def save(self, *args, **kwargs):
-        # Update product variant stock when transaction is saved
-        if self.transaction_type == 'add':
-            self.product_variant.quantity += self.quantity
-        elif self.transaction_type == 'remove':
-            self.product_variant.quantity -= self.quantity
-        
-        self.product_variant.save()
-        super().save(*args, **kwargs)
+        # Only a new transaction moves stock; re-saving history must not apply it twice
+        if not self._state.adding:
+            return super().save(*args, **kwargs)
+
+        with transaction.atomic():
+            self.apply_to_stock()
+            super().save(*args, **kwargs)
+
+    def apply_to_stock(self):
+        """
+        Apply this transaction to the variant's stock with a single conditional
+        UPDATE, so the availability check and the decrement cannot interleave
+        with a concurrent writer. Removals can only take stock that is not
+        reserved. The variant's row lock then covers the location rows it
+        moves, which follow with one conditional UPDATE each.
+        """
+        if self.location_error:
+            raise ValueError(self.location_error)
+        if None in (location_id for location_id, _ in self.location_deltas):
+            self.book_at_location(Location.default_id())
+
+        delta = self.signed_quantity
+        variants = ProductVariantItem.objects.filter(pk=self.product_variant_id)
+        if delta < 0:
+            variants = variants.filter(quantity__gte=F('reserved_quantity') - delta)
+
+        # A transfer's zero delta still takes the row lock
+        if not variants.update(quantity=F('quantity') + delta):
+            raise InsufficientStock(f"Insufficient stock for {self.product_variant.product_code}")
+        for location_id, location_delta in self.location_deltas:
+            LocationStock.apply_delta(self.product_variant_id, location_id, location_delta)
+        Product.apply_stock_delta(self.product_variant.product_id, delta)
+
+        self.product_variant.refresh_from_db(fields=['quantity'])
+        if delta > 0 and self.unit_cost is None:
+            self.unit_cost = self.product_variant.price
+        listings = VariantListing.objects.filter(pk=self.product_variant_id)
+        if listings.update(quantity=self.product_variant.quantity, updated_at=timezone.now()):
+            # The row is locked by the update, so its price is the one the stock moved at
+            category_id, price = listings.values_list('category_id', 'price').get()
+            stock_summary.add("category", {category_id: (0, 0, delta, delta * price)})
+        stock_summary.add("day", {timezone.localdate(): (1, max(delta, 0), max(-delta, 0))})
+        low_stock_checks.add("item", [self.product_variant_id])
+
+    @classmethod
+    def bulk_apply(cls, transactions, all_or_nothing=False, release=None):
+        """
+        Apply many new transactions in one database round-trip per step.
+
+        Affected variants are locked in primary key order (so concurrent batches
+        cannot deadlock), then their stock at the locations the batch touches.
+        Every line is checked against the running level of unreserved stock and
+        of stock at its source, and the accepted lines are written with
+        bulk_create.
+        release ({variant id: units}) frees reserved units first, which is how
+        committed reservations are removed. Product totals are shifted once per
+        product. Returns one error message (or None) per transaction, in input
+        order; with all_or_nothing nothing is written unless every line is
+        accepted. Accepted transactions get a ``quantity_after`` attribute
+        holding the variant's resulting stock.
+        """
+        release = release or {}
+        variant_ids = sorted({t.product_variant_id for t in transactions})
+        variants = {
+            variant.pk: variant
+            for variant in ProductVariantItem.objects.select_for_update().filter(pk__in=variant_ids).order_by('pk')
+        }
+        for variant_id, units in release.items():
+            if variant_id in variants:
+                variants[variant_id].reserved_quantity -= units
+
+        if any(None in (location_id for location_id, _ in t.location_deltas) for t in transactions):
+            default_location_id = Location.default_id()
+            for stock_transaction in transactions:
+                stock_transaction.book_at_location(default_location_id)
+        location_ids = sorted({
+            location_id for t in transactions for location_id, _ in t.location_deltas if location_id is not None
+        })
+        location_rows = {
+            (row.product_variant_id, row.location_id): row
+            for row in LocationStock.objects.select_for_update().filter(
+                product_variant__in=list(variants), location__in=location_ids
+            ).order_by('pk')
+        }
+        location_quantities = {key: row.quantity for key, row in location_rows.items()}
+
+        errors = []
+        accepted = []
+        product_deltas = {}
+        for stock_transaction in transactions:
+            variant = variants.get(stock_transaction.product_variant_id)
+            if variant is None:
+                errors.append("Product variant not found")
+                continue
+            if stock_transaction.location_error:
+                errors.append(stock_transaction.location_error)
+                continue
+            delta = stock_transaction.signed_quantity
+            if delta < 0 and variant.available_quantity + delta < 0:
+                errors.append("Insufficient stock")
+                continue
+            location_deltas = [
+                ((variant.pk, location_id), location_delta)
+                for location_id, location_delta in stock_transaction.location_deltas
+            ]
+            if any(location_quantities.get(key, 0) + location_delta < 0 for key, location_delta in location_deltas):
+                errors.append("Insufficient stock at this location")
+                continue
+
+            for key, location_delta in location_deltas:
+                location_quantities[key] = location_quantities.get(key, 0) + location_delta
+            variant.quantity += delta
+            if delta > 0 and stock_transaction.unit_cost is None:
+                stock_transaction.unit_cost = variant.price
+            stock_transaction.product_variant = variant
+            stock_transaction.quantity_after = variant.quantity
+            product_deltas[variant.product_id] = product_deltas.get(variant.product_id, 0) + delta
+            accepted.append(stock_transaction)
+            errors.append(None)
+
+        if not accepted or (all_or_nothing and any(errors)):
+            return errors
+
+        cls.objects.bulk_create(accepted, batch_size=500)
+        # Rows are locked, so the running quantities can be written back directly
+        variants_by_pk = {t.product_variant_id: t.product_variant for t in accepted}
+        variants = variants_by_pk.values()
+        ProductVariantItem.objects.bulk_update(
+            variants, ['quantity', 'reserved_quantity'] if release else ['quantity'], batch_size=500
+        )
+        # The batch locked every (variant, location) pair it names; write only the rows that moved
+        moved = {
+            (t.product_variant_id, location_id) for t in accepted for location_id, _ in t.location_deltas
+        }
+        for key in moved:
+            if key in location_rows:
+                location_rows[key].quantity = location_quantities[key]
+        LocationStock.objects.bulk_update(
+            [location_rows[key] for key in moved if key in location_rows], ['quantity'], batch_size=500
+        )
+        LocationStock.objects.bulk_create([
+            LocationStock(
+                product_variant_id=variant_id, location_id=location_id,
+                quantity=location_quantities[variant_id, location_id],
+            )
+            for variant_id, location_id in moved - set(location_rows)
+        ], batch_size=500)
+        now = timezone.now()
+        listings = list(
+            VariantListing.objects.select_for_update().filter(pk__in=[variant.pk for variant in variants])
+            .order_by('pk').only('category', 'price', 'quantity')
+        )
+        summary_deltas = {}
+        for listing in listings:
+            delta = variants_by_pk[listing.pk].quantity - listing.quantity
+            add_deltas(summary_deltas, {listing.category_id: (0, 0, delta, delta * listing.price)})
+            listing.quantity = variants_by_pk[listing.pk].quantity
+            listing.updated_at = now
+        VariantListing.objects.bulk_update(listings, ['quantity', 'updated_at'], batch_size=500)
+        for product_id in sorted(product_deltas):
+            Product.apply_stock_delta(product_id, product_deltas[product_id])
+        stock_summary.add("category", summary_deltas)
+        stock_summary.add("day", {timezone.localdate(now): (
+            len(accepted),
+            sum(max(t.signed_quantity, 0) for t in accepted),
+            sum(max(-t.signed_quantity, 0) for t in accepted),
+        )})
+        low_stock_checks.add("item", [variant.pk for variant in variants])
+        return errors
+
+
+class IdempotencyKey(models.Model):
+    """
+    An Idempotency-Key a user sent with a stock write, with the response it got
+    and the transactions it created; see products_app.idempotency. The
+    transactions are referenced by id, as stock_transactions is partitioned on
+    PostgreSQL and cannot be the target of a foreign key.
+    """
+    # Indexed through idempotency_key_user_key_uniq, which leads with this column
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+", db_index=False)
+    key = models.CharField(max_length=255)
+    request_fingerprint = models.CharField(max_length=64)
+    response_status = models.PositiveSmallIntegerField(null=True)
+    response_body = models.JSONField(null=True)
+    transaction_ids = models.JSONField(default=list)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = "idempotency_keys"
+        constraints = [
+            models.UniqueConstraint(fields=["user", "key"], name="idempotency_key_user_key_uniq"),
+        ]
+        indexes = [
+            # Pruning expired keys oldest first
+            models.Index(fields=["created_at"], name="idempotency_key_created_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.key} ({self.user_id})"
+
+
+class StockReservationQuerySet(models.QuerySet):
+    def with_details(self):
+        return self.select_related("product_variant", "user")
+
+    def expired(self, now=None):
+        """
+        Active reservations past their expiry, which the reclaimer releases
+        """
+        return self.filter(status="active", expires_at__lte=now or timezone.now())
+
+
+class StockReservation(models.Model):
+    """
+    A hold on units of a variant, such as the lines of an order being picked.
+    Active holds are summed into ProductVariantItem.reserved_quantity, which
+    removals cannot take. A hold is committed (its units are removed from
+    stock), released, or expired by the expire_stock_reservations command once
+    expires_at passes.
+    """
+    STATUSES = (
+        ('active', 'Active'),
+        ('committed', 'Committed'),
+        ('released', 'Released'),
+        ('expired', 'Expired'),
+    )
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    # Indexed through stock_reservation_variant_idx, which leads with this column
+    product_variant = models.ForeignKey(
+        ProductVariantItem, on_delete=models.CASCADE, related_name="reservations", db_index=False
+    )
+    quantity = models.PositiveIntegerField()
+    status = models.CharField(max_length=20, choices=STATUSES, default="active")
+    # Optional reference to the order the stock is held for
+    reference_number = models.CharField(max_length=255, blank=True, default="")
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name="+")
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+    closed_at = models.DateTimeField(null=True, blank=True)
+    # Removal recorded by a commit. stock_transactions is partitioned on
+    # PostgreSQL and cannot be the target of a foreign key
+    transaction_id = models.UUIDField(null=True, blank=True)
+
+    objects = StockReservationQuerySet.as_manager()
+
+    class Meta:
+        db_table = "stock_reservations"
+        indexes = [
+            # Keyset pagination on (created_at, id)
+            models.Index(fields=["-created_at", "-id"], name="stock_reservation_created_idx"),
+            models.Index(fields=["product_variant", "status"], name="stock_reservation_variant_idx"),
+            models.Index(fields=["reference_number"], name="stock_reservation_ref_idx"),
+            # The reclaimer only ever looks at active holds, soonest expiry first
+            models.Index(
+                fields=["expires_at"], condition=models.Q(status="active"), name="stock_reservation_expiry_idx"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product_variant_id} ({self.status})"
+
+    @classmethod
+    def reserve(cls, lines, expires_at, user=None, reference_number="", all_or_nothing=True):
+        """
+        Hold stock for many (variant id, quantity) lines. The variants are
+        locked in primary key order and their stock read in one query, every
+        line is checked against the running level of unreserved stock, and the
+        holds are written with one bulk update and one bulk insert. Returns
+        (reservations, errors), one of each per line in input order, with None
+        for a rejected line's reservation or an accepted line's error; with
+        all_or_nothing nothing is held unless every line is accepted.
+        Reservations get an ``available`` attribute holding the variant's
+        unreserved stock after the batch.
+        """
+        variant_ids = sorted({variant_id for variant_id, quantity in lines})
+        variants = {
+            variant.pk: variant
+            for variant in ProductVariantItem.objects.select_for_update().filter(pk__in=variant_ids)
+            .order_by("pk").only("id", "quantity", "reserved_quantity")
+        }
+
+        reservations = []
+        errors = []
+        for variant_id, quantity in lines:
+            variant = variants.get(variant_id)
+            if variant is None:
+                reservations.append(None)
+                errors.append("Product variant not found")
+            elif variant.available_quantity < quantity:
+                reservations.append(None)
+                errors.append("Insufficient stock")
+            else:
+                variant.reserved_quantity += quantity
+                reservations.append(cls(
+                    product_variant=variant, quantity=quantity, user=user,
+                    reference_number=reference_number, expires_at=expires_at,
+                ))
+                errors.append(None)
+
+        accepted = [reservation for reservation in reservations if reservation is not None]
+        if not accepted or (all_or_nothing and any(errors)):
+            return [None] * len(lines), errors
+
+        held = {reservation.product_variant_id: reservation.product_variant for reservation in accepted}
+        ProductVariantItem.objects.bulk_update(held.values(), ["reserved_quantity"], batch_size=500)
+        cls.objects.bulk_create(accepted, batch_size=500)
+        for reservation in accepted:
+            reservation.available = reservation.product_variant.available_quantity
+        return reservations, errors
+
+    @classmethod
+    def close(cls, reservation_ids, status, user=None, reference_number="", location_id=None):
+        """
+        Commit, release or expire active reservations, all or none of them.
+        The reservations are locked in primary key order and then their
+        variants; a commit records one removal per reservation (from
+        location_id, default the default location) through
+        StockTransaction.bulk_apply, which frees the held units as it takes
+        them. Returns (reservations, errors), errors mapping the id of each
+        reservation that is not active (or, for a commit, has expired) to a
+        message; nothing is changed if there are any. Committed reservations
+        get a ``stock_transaction`` attribute holding their removal.
+        """
+        reservation_ids = list(dict.fromkeys(reservation_ids))
+        reservations = list(
+            cls.objects.select_for_update().filter(pk__in=reservation_ids, status="active").order_by("pk")
+        )
+        found = {reservation.pk: reservation for reservation in reservations}
+        now = timezone.now()
+        errors = {}
+        for pk in reservation_ids:
+            reservation = found.get(pk)
+            if reservation is None:
+                errors[pk] = "Reservation not found or no longer active"
+            elif status == "committed" and reservation.expires_at <= now:
+                errors[pk] = "Reservation has expired"
+        if errors or not reservations:
+            return reservations, errors
+
+        held = {}
+        for reservation in reservations:
+            held[reservation.product_variant_id] = held.get(reservation.product_variant_id, 0) + reservation.quantity
+
+        if status == "committed":
+            stock_transactions = [
+                StockTransaction(
+                    product_variant_id=reservation.product_variant_id,
+                    quantity=reservation.quantity,
+                    transaction_type="remove",
+                    source_location_id=location_id,
+                    user=user,
+                    notes=f"Reservation {reservation.pk} committed",
+                    reference_number=reference_number or reservation.reference_number,
+                )
+                for reservation in reservations
+            ]
+            line_errors = StockTransaction.bulk_apply(stock_transactions, all_or_nothing=True, release=held)
+            if any(line_errors):
+                return reservations, {
+                    reservation.pk: error for reservation, error in zip(reservations, line_errors) if error
+                }
+            for reservation, stock_transaction in zip(reservations, stock_transactions):
+                reservation.stock_transaction = stock_transaction
+                reservation.transaction_id = stock_transaction.pk
+        else:
+            variants = list(
+                ProductVariantItem.objects.select_for_update().filter(pk__in=sorted(held)).order_by("pk")
+                .only("id", "reserved_quantity")
+            )
+            for variant in variants:
+                variant.reserved_quantity = max(variant.reserved_quantity - held[variant.pk], 0)
+            ProductVariantItem.objects.bulk_update(variants, ["reserved_quantity"], batch_size=500)
+
+        for reservation in reservations:
+            reservation.status = status
+            reservation.closed_at = now
+        cls.objects.bulk_update(reservations, ["status", "closed_at", "transaction_id"], batch_size=500)
+        return reservations, errors
+
+
+def day_start(day):
+    """
+    The aware datetime at which day begins in the current time zone
+    """
+    return timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+
+
+def ledger_total(since=None):
+    """
+    Subquery summing a variant's transactions, optionally only those stamped at or
+    after since; annotate it onto ProductVariantItem querysets
+    """
+    transactions = StockTransaction.objects.filter(product_variant=OuterRef("pk"))
+    if since is not None:
+        transactions = transactions.filter(timestamp__gte=since)
+    return Coalesce(
+        Subquery(
+            transactions.order_by().values("product_variant").annotate(total=Sum(SIGNED_QUANTITY)).values("total")
+        ),
+        0
+    )
+
+
+class StockSnapshot(models.Model):
+    """
+    Closing stock of a variant at the end of a day (in TIME_ZONE). Rows are
+    only written for days on which the variant moved, so the table stays sparse:
+    a variant's stock on any later day is its latest snapshot until the next one.
+
+    Snapshots are built incrementally from the ledger by build(), run daily
+    through the build_stock_snapshots command; quantities_as_of() answers
+    point-in-time lookups from them.
+    """
+    # Indexed through stock_snapshot_variant_date_uniq, which leads with this column
+    product_variant = models.ForeignKey(
+        ProductVariantItem, on_delete=models.CASCADE, related_name="stock_snapshots", db_index=False
+    )
+    date = models.DateField()
+    quantity = models.IntegerField()
+
+    class Meta:
+        db_table = "stock_snapshots"
+        constraints = [
+            models.UniqueConstraint(fields=["product_variant", "date"], name="stock_snapshot_variant_date_uniq"),
+        ]
+        indexes = [
+            # Latest built day, where the next incremental build starts
+            models.Index(fields=["date"], name="stock_snapshot_date_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.product_variant_id} on {self.date}: {self.quantity}"
+
+    @classmethod
+    def build(cls, through=None, batch_size=1000):
+        """
+        Write closing balances for every day after the latest snapshot up to and
+        including through (default yesterday), one transaction per day, and
+        return the number of rows written. Only closed days should be built:
+        a day's snapshots are never revisited once a later day exists.
+        """
+        through = through or timezone.localdate() - datetime.timedelta(days=1)
+        transactions = StockTransaction.objects.filter(timestamp__lt=day_start(through + datetime.timedelta(days=1)))
+        latest = cls.objects.aggregate(latest=Max("date"))["latest"]
+        if latest is not None:
+            transactions = transactions.filter(timestamp__gte=day_start(latest + datetime.timedelta(days=1)))
+
+        movements = (
+            transactions.order_by().annotate(day=TruncDate("timestamp"))
+            .values("day", "product_variant").annotate(delta=Sum(SIGNED_QUANTITY))
+            .order_by("day", "product_variant")
+        )
+        written = 0
+        for day, rows in groupby(movements.iterator(), key=itemgetter("day")):
+            deltas = {row["product_variant"]: row["delta"] for row in rows}
+            variant_ids = list(deltas)
+            with transaction.atomic():
+                for start in range(0, len(variant_ids), batch_size):
+                    batch = variant_ids[start:start + batch_size]
+                    previous = {
+                        variant_id: quantity for variant_id, (_, quantity) in cls.latest(batch, before=day).items()
+                    }
+                    # First snapshot of a variant: start from the stock it had before its
+                    # first transaction, i.e. its current stock less its whole ledger
+                    previous.update(
+                        ProductVariantItem.objects.filter(pk__in=[pk for pk in batch if pk not in previous])
+                        .annotate(opening=F("quantity") - ledger_total()).values_list("pk", "opening")
+                    )
+                    cls.objects.bulk_create(
+                        [
+                            cls(product_variant_id=pk, date=day, quantity=previous[pk] + deltas[pk])
+                            for pk in batch if pk in previous
+                        ],
+                        update_conflicts=True,
+                        unique_fields=["product_variant", "date"],
+                        update_fields=["quantity"],
+                    )
+            written += len(deltas)
+        return written
+
+    @classmethod
+    def latest(cls, variant_ids, before):
+        """
+        The latest snapshot of each variant dated before the given day, as
+        {variant id: (date, quantity)}; variants without one are left out
+        """
+        snapshots = cls.objects.filter(product_variant=OuterRef("pk"), date__lt=before).order_by("-date")
+        rows = ProductVariantItem.objects.filter(pk__in=variant_ids).annotate(
+            snapshot_date=Subquery(snapshots.values("date")[:1]),
+            snapshot_quantity=Subquery(snapshots.values("quantity")[:1]),
+        ).filter(snapshot_date__isnull=False).values_list("pk", "snapshot_date", "snapshot_quantity")
+        return {pk: (date, quantity) for pk, date, quantity in rows}
+
+    @classmethod
+    def quantities_as_of(cls, variant_ids, moment, batch_size=1000):
+        """
+        Stock of each variant as it stood at moment, before any transaction stamped
+        at or after it, as {variant id: quantity}. Variants created after moment
+        are left out.
+
+        Each variant starts from its latest snapshot closed by moment and replays
+        only the transactions after that snapshot. Variants without one walk back
+        from their current stock instead, which touches only the transactions
+        since moment when snapshots are up to date. Variants are looked up
+        batch_size at a time.
+        """
+        variant_ids = list(set(variant_ids))
+        quantities = {}
+        for start in range(0, len(variant_ids), batch_size):
+            batch = variant_ids[start:start + batch_size]
+            snapshots = cls.latest(batch, before=timezone.localdate(moment))
+
+            if snapshots:
+                by_date = {}
+                for pk, (date, _) in snapshots.items():
+                    by_date.setdefault(date, []).append(pk)
+                since = Q()
+                for date, pks in by_date.items():
+                    since |= Q(product_variant__in=pks, timestamp__gte=day_start(date + datetime.timedelta(days=1)))
+                deltas = StockTransaction.objects.filter(since, timestamp__lt=moment).net_quantities()
+                quantities.update((pk, quantity + deltas.get(pk, 0)) for pk, (_, quantity) in snapshots.items())
+
+            # A variant with a snapshot before moment already existed then
+            quantities.update(
+                ProductVariantItem.objects.filter(
+                    pk__in=[pk for pk in batch if pk not in snapshots], created_at__lte=moment
+                ).annotate(as_of=F("quantity") - ledger_total(since=moment)).values_list("pk", "as_of")
+            )
+        return quantities
+
+
+class CostLayerCheckpoint(models.Model):
+    """
+    Cost state of a variant at the end of a day (in TIME_ZONE): its stock, the
+    FIFO receipt layers still on hand, oldest first, as [quantity, unit cost]
+    pairs, and its weighted-average unit cost. Like StockSnapshot, rows are only
+    written for days on which the variant moved; see products_app.valuation.
+    """
+    # Indexed through cost_checkpoint_variant_date_uniq, which leads with this column
+    product_variant = models.ForeignKey(
+        ProductVariantItem, on_delete=models.CASCADE, related_name="cost_checkpoints", db_index=False
+    )
+    date = models.DateField()
+    quantity = models.IntegerField()
+    fifo_layers = models.JSONField(default=list)
+    average_cost = models.DecimalField(max_digits=12, decimal_places=4)
+
+    class Meta:
+        db_table = "cost_layer_checkpoints"
+        constraints = [
+            models.UniqueConstraint(fields=["product_variant", "date"], name="cost_checkpoint_variant_date_uniq"),
+        ]
+        indexes = [
+            # Latest built day, where the next incremental build starts
+            models.Index(fields=["date"], name="cost_checkpoint_date_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.product_variant_id} on {self.date}: {self.quantity} at {self.average_cost}"
+
+
+class LowStockAlertQuerySet(models.QuerySet):
+    def with_details(self):
+        """
+        Load the variant, product and configurations rendered with each alert
+        """
+        return self.select_related("product_variant__product").prefetch_related(
+            configurations_prefetch("product_variant__configurations")
+        )
+
 
 class LowStockAlert(models.Model):
     """
     Model to track and manage low stock alerts
     """
     product_variant = models.OneToOneField('ProductVariantItem', on_delete=models.CASCADE)
-    threshold = models.IntegerField(default=10)
+    # None inherits the subcategory/category default
+    threshold = models.IntegerField(default=10, blank=True, null=True)
     is_active = models.BooleanField(default=True)
     last_notified = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = LowStockAlertQuerySet.as_manager()
     
     class Meta:
         db_table = 'low_stock_alerts'
+        indexes = [
+            # Current alerts only ever look at active rows; carry the threshold for the quantity comparison
+            models.Index(
+                fields=['product_variant', 'threshold'],
+                condition=models.Q(is_active=True),
+                name='low_stock_active_idx'
+            ),
+            # Highest override in force, which bounds the low-stock scan
+            models.Index(
+                fields=['threshold'],
+                condition=models.Q(is_active=True, threshold__isnull=False),
+                name='low_stock_active_threshold_idx'
+            ),
+        ]
 
     def __str__(self):
         return f"Low Stock Alert for {self.product_variant}"
 
+    @property
+    def effective_threshold(self):
+        """
+        This alert's threshold, or the subcategory/category default it inherits
+        """
+        if self.threshold is not None:
+            return self.threshold
+        subcategory = self.product_variant.product.subcategory
+        if subcategory.low_stock_threshold is not None:
+            return subcategory.low_stock_threshold
+        return subcategory.category.low_stock_threshold
+
     def check_stock_level(self):
         """
         Check if current stock is below threshold
         """
-        return self.product_variant.quantity <= self.threshold
+        threshold = self.effective_threshold
+        return threshold is not None and self.product_variant.quantity <= threshold
+
+
+
+class LowStockCheck(models.Model):
+    """
+    Queue of variants whose stock moved since the alert worker last looked at
+    them. Rows are added after commit by low_stock_checks, at most one per
+    variant, and consumed by the process_low_stock_alerts command.
+    """
+    product_variant = models.OneToOneField(
+        ProductVariantItem, on_delete=models.CASCADE, primary_key=True, related_name="+"
+    )
+    queued_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        db_table = "low_stock_checks"
+
+    def __str__(self):
+        return f"Low stock check for {self.product_variant_id}"
+
+
+def enqueue_low_stock_checks(pending):
+    variant_ids = pending["item"]
+    try:
+        with transaction.atomic():
+            LowStockCheck.objects.bulk_create(
+                [LowStockCheck(product_variant_id=pk) for pk in variant_ids], ignore_conflicts=True
+            )
+    except IntegrityError:
+        # A variant was deleted since its stock moved
+        variant_ids = ProductVariantItem.objects.filter(pk__in=variant_ids).values_list("pk", flat=True)
+        LowStockCheck.objects.bulk_create(
+            [LowStockCheck(product_variant_id=pk) for pk in variant_ids], ignore_conflicts=True
+        )
+
+
+low_stock_checks = CommitQueue(enqueue_low_stock_checks)
+
+
+@receiver(post_save, sender=LowStockAlert)
+def check_saved_low_stock_alert(sender, instance, **kwargs):
+    # A new alert or a changed threshold may already be crossed
+    low_stock_checks.add("item", [instance.product_variant_id])
+
+
+class VariantListing(models.Model):
+    """
+    Read model for variant listings: one flat row per variant carrying
+    everything ProductVariantItemSerializer renders, with the configurations
+    stored as JSON, so a page of variants is a single indexed scan.
+
+    Rows are rebuilt after commit by listing_refresh whenever a variant, its
+    configurations, its product or the taxonomy above it changes; stock
+    movements write the new quantity directly. Every write stamps updated_at,
+    from which conditional GETs of variants are answered, and carries the
+    change in the row's stock over to its CategoryStockSummary.
+    """
+    variant = models.OneToOneField(
+        ProductVariantItem, on_delete=models.CASCADE, primary_key=True, related_name="listing"
+    )
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="+", db_index=False)
+    product_name = models.CharField(max_length=255)
+    product_code = models.CharField(max_length=255, db_index=True)
+    image = models.CharField(max_length=100, blank=True, null=True)
+    quantity = models.PositiveIntegerField(default=0)
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    hsn_code = models.CharField(max_length=255, blank=True, null=True)
+    subcategory = models.CharField(max_length=511)
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name="+", db_index=False)
+    configurations = models.JSONField(default=list)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = "variant_listings"
+        indexes = [
+            models.Index(fields=["product", "product_code"], name="variant_listing_product_idx"),
+            # Latest write, for the collection ETag
+            models.Index(fields=["updated_at"], name="variant_listing_updated_idx"),
+        ]
+
+    @classmethod
+    def from_item(cls, item):
+        """
+        Build the listing row for a variant loaded with ProductVariantItem.objects.with_details()
+        """
+        return cls(
+            variant=item,
+            product_id=item.product_id,
+            product_name=item.product.name,
+            product_code=item.product_code,
+            image=item.image.name or None,
+            quantity=item.quantity,
+            price=item.price,
+            hsn_code=item.hsn_code,
+            subcategory=str(item.product.subcategory),
+            category_id=item.product.subcategory.category_id,
+            configurations=[
+                {
+                    "id": str(configuration.id),
+                    "product_item": str(configuration.product_item_id),
+                    "variant_option": str(configuration.variant_option_id),
+                    "variant_name": configuration.variant_option.variant.name,
+                    "option_value": configuration.variant_option.option,
+                }
+                for configuration in item.configurations.all()
+            ],
+        )
+
+    def stock_totals(self, sign=1):
+        """
+        This row's contribution to its category summary, as summary deltas
+        """
+        return {self.category_id: (0, sign, sign * self.quantity, sign * self.quantity * self.price)}
+
+    @classmethod
+    def refresh(cls, item_ids, batch_size=1000):
+        """
+        Rebuild the listing rows of the given variants and move the difference
+        into the category summaries
+        """
+        item_ids = list(set(item_ids))
+        for start in range(0, len(item_ids), batch_size):
+            batch = item_ids[start:start + batch_size]
+            with transaction.atomic():
+                # Lock the current rows before reading the variants, so a stock movement
+                # committing meanwhile is read back rather than overwritten
+                deltas = {}
+                for listing in cls.objects.select_for_update().filter(pk__in=batch).order_by("pk").only(
+                    "category", "quantity", "price"
+                ):
+                    add_deltas(deltas, listing.stock_totals(sign=-1))
+                rows = [cls.from_item(item) for item in ProductVariantItem.objects.filter(pk__in=batch).with_details()]
+                for row in rows:
+                    add_deltas(deltas, row.stock_totals())
+                cls.objects.bulk_create(
+                    rows,
+                    update_conflicts=True,
+                    unique_fields=["variant"],
+                    update_fields=[
+                        "product", "product_name", "product_code", "image", "quantity",
+                        "price", "hsn_code", "subcategory", "category", "configurations", "updated_at",
+                    ],
+                )
+                # Already after commit; apply directly rather than queueing behind another commit
+                apply_stock_summary({"category": deltas})
+
+
+# Which variants each kind of queued id covers
+LISTING_REFRESH_LOOKUPS = {
+    "item": "pk__in",
+    "product": "product__in",
+    "subcategory": "product__subcategory__in",
+    "category": "product__subcategory__category__in",
+    "variant": "configurations__variant_option__variant__in",
+    "option": "configurations__variant_option__in",
+}
+
+
+def refresh_variant_listings(pending):
+    matches = models.Q()
+    for kind, ids in pending.items():
+        matches |= models.Q(**{LISTING_REFRESH_LOOKUPS[kind]: ids})
+    VariantListing.refresh(ProductVariantItem.objects.filter(matches).values_list("pk", flat=True).distinct())
+
+
+listing_refresh = CommitQueue(refresh_variant_listings)
+
+
+@receiver(post_save, sender=ProductVariantItem)
+def refresh_variant_listing(sender, instance, **kwargs):
+    listing_refresh.add("item", [instance.pk])
+
+
+@receiver(post_save, sender=ProductConfiguration)
+@receiver(post_delete, sender=ProductConfiguration)
+def refresh_configured_variant_listing(sender, instance, **kwargs):
+    listing_refresh.add("item", [instance.product_item_id])
+
+
+# Names rendered in listings; new rows cannot appear in any listing yet
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=SubCategory)
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Variant)
+@receiver(post_save, sender=VariantOption)
+def refresh_renamed_variant_listings(sender, instance, created=False, **kwargs):
+    if not created:
+        kind = {
+            Product: "product", SubCategory: "subcategory", Category: "category",
+            Variant: "variant", VariantOption: "option",
+        }[sender]
+        listing_refresh.add(kind, [instance.pk])
+
+
+class CategoryStockSummary(models.Model):
+    """
+    Running totals of a category's products, variants, units and stock value for
+    the dashboard. Maintained incrementally from variant listing and product
+    writes, after commit, by stock_summary; rebuild_stock_summary recomputes
+    them from scratch.
+    """
+    category = models.OneToOneField(
+        Category, on_delete=models.CASCADE, primary_key=True, related_name="stock_summary"
+    )
+    products = models.IntegerField(default=0)
+    variants = models.IntegerField(default=0)
+    units = models.BigIntegerField(default=0)
+    stock_value = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+
+    class Meta:
+        db_table = "category_stock_summaries"
+
+    def __str__(self):
+        return f"Stock summary for {self.category_id}"
+
+    @classmethod
+    def totals(cls, category_ids):
+        """
+        Unsaved summaries for the given categories, counted from products and variant listings
+        """
+        summaries = {pk: cls(category_id=pk) for pk in category_ids}
+        for category_id, products in Product.objects.filter(subcategory__category__in=category_ids).values(
+            "subcategory__category"
+        ).annotate(count=models.Count("pk")).values_list("subcategory__category", "count"):
+            summaries[category_id].products = products
+        for category_id, variants, units, stock_value in VariantListing.objects.filter(
+            category__in=category_ids
+        ).values("category").annotate(
+            variants=models.Count("pk"),
+            units=Sum("quantity"),
+            stock_value=Sum(F("quantity") * F("price"), output_field=models.DecimalField()),
+        ).values_list("category", "variants", "units", "stock_value"):
+            summary = summaries[category_id]
+            summary.variants, summary.units, summary.stock_value = variants, units, stock_value
+        return summaries
+
+    @classmethod
+    def overall(cls, *fields):
+        """
+        The given counters summed over every category
+        """
+        totals = cls.objects.aggregate(**{field: Coalesce(Sum(field), 0) for field in fields})
+        return [totals[field] for field in fields]
+
+    @classmethod
+    def rebuild(cls, category_ids=None):
+        """
+        Recompute and store the summaries of the given categories, or of every category
+        """
+        if category_ids is None:
+            category_ids = Category.objects.values_list("pk", flat=True)
+        cls.objects.bulk_create(
+            cls.totals(list(category_ids)).values(),
+            update_conflicts=True,
+            unique_fields=["category"],
+            update_fields=["products", "variants", "units", "stock_value"],
+        )
+
+
+class DailyStockMovement(models.Model):
+    """
+    Number of stock movements applied on each day (in TIME_ZONE) and the units
+    they moved in and out, maintained after commit by stock_summary
+    """
+    date = models.DateField(primary_key=True)
+    movements = models.IntegerField(default=0)
+    units_in = models.BigIntegerField(default=0)
+    units_out = models.BigIntegerField(default=0)
+
+    class Meta:
+        db_table = "daily_stock_movements"
+
+    def __str__(self):
+        return f"Stock movements on {self.date}"
+
+    @classmethod
+    def totals(cls, first, last):
+        """
+        Unsaved rows for every day from first to last, counted from the ledger
+        """
+        days = {}
+        day = first
+        while day <= last:
+            days[day] = cls(date=day)
+            day += datetime.timedelta(days=1)
+        for date, movements, units_in, units_out in StockTransaction.objects.filter(
+            timestamp__gte=day_start(first), timestamp__lt=day_start(last + datetime.timedelta(days=1))
+        ).annotate(date=TruncDate("timestamp")).values("date").annotate(
+            movements=models.Count("pk"),
+            units_in=Coalesce(Sum(SIGNED_QUANTITY, filter=Q(transaction_type="add") | Q(
+                transaction_type="adjustment", quantity__gt=0
+            )), 0),
+            units_out=Coalesce(-Sum(SIGNED_QUANTITY, filter=Q(transaction_type="remove") | Q(
+                transaction_type="adjustment", quantity__lt=0
+            )), 0),
+        ).values_list("date", "movements", "units_in", "units_out"):
+            days[date].movements, days[date].units_in, days[date].units_out = movements, units_in, units_out
+        return days
+
+
+# Summary delta fields of each kind queued on stock_summary
+STOCK_SUMMARY_FIELDS = {
+    "category": (CategoryStockSummary, ("products", "variants", "units", "stock_value")),
+    "day": (DailyStockMovement, ("movements", "units_in", "units_out")),
+}
+
+
+def add_deltas(totals, deltas):
+    for key, values in deltas.items():
+        current = totals.setdefault(key, [0] * len(values))
+        for index, value in enumerate(values):
+            current[index] += value
+
+
+def apply_stock_summary(pending):
+    """
+    Add the queued deltas to the summary rows, creating missing rows. Rows are
+    updated in key order, so concurrent flushes cannot deadlock.
+    """
+    with transaction.atomic():
+        for kind, deltas in pending.items():
+            model, fields = STOCK_SUMMARY_FIELDS[kind]
+            for key in sorted(deltas):
+                increments = {
+                    field: F(field) + value for field, value in zip(fields, deltas[key]) if value
+                }
+                if not increments or model.objects.filter(pk=key).update(**increments):
+                    continue
+                # Deltas for a category deleted since are dropped with it
+                if kind == "category" and not Category.objects.filter(pk=key).exists():
+                    continue
+                model.objects.bulk_create([model(pk=key)], ignore_conflicts=True)
+                model.objects.filter(pk=key).update(**increments)
+
+
+stock_summary = CommitCounter(apply_stock_summary)
+
+
+@receiver(post_delete, sender=VariantListing)
+def remove_listing_from_stock_summary(sender, instance, **kwargs):
+    stock_summary.add("category", instance.stock_totals(sign=-1))
+
+
+def subcategory_categories(subcategory_ids):
+    return dict(SubCategory.objects.filter(pk__in=subcategory_ids).values_list("pk", "category_id"))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def count_products_in_stock_summary(sender, instance, created=False, update_fields=None, **kwargs):
+    loaded = getattr(instance, "_loaded_subcategory_id", None)
+    if kwargs["signal"] is post_delete:
+        moves = {(loaded or instance.subcategory_id): -1}
+    elif created:
+        moves = {instance.subcategory_id: 1}
+    elif loaded != instance.subcategory_id and (update_fields is None or "subcategory" in update_fields):
+        moves = {loaded: -1, instance.subcategory_id: 1}
+    else:
+        return
+    instance._loaded_subcategory_id = instance.subcategory_id
+    if created and Product.subcategory.is_cached(instance):
+        categories = {instance.subcategory_id: instance.subcategory.category_id}
+    else:
+        categories = subcategory_categories(moves)
+    deltas = {}
+    for subcategory_id, count in moves.items():
+        if subcategory_id in categories:
+            add_deltas(deltas, {categories[subcategory_id]: (count, 0, 0, 0)})
+    stock_summary.add("category", deltas)
+
 
+@receiver(post_save, sender=SubCategory)
+def move_subcategory_in_stock_summary(sender, instance, created=False, **kwargs):
+    loaded = getattr(instance, "_loaded_category_id", None)
+    instance._loaded_category_id = instance.category_id
+    if created or loaded is None or loaded == instance.category_id:
+        return
+    # Variants follow through listing_refresh; only the product count moves here
+    products = Product.objects.filter(subcategory=instance).count()
+    stock_summary.add("category", {loaded: (-products, 0, 0, 0), instance.category_id: (products, 0, 0, 0)})
@@ -0,0 +1,52 @@
+from django.core.exceptions import ValidationError
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination as BaseCursorPagination, PageNumberPagination
+
+
+class StandardResultsSetPagination(PageNumberPagination):
+    """
+    Default page-number pagination for list endpoints
+    """
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+
+class CursorPagination(BaseCursorPagination):
+    """
+    Cursor pagination that answers a cursor whose position does not fit the
+    ordering field as an invalid cursor, instead of failing the query
+    """
+
+    def paginate_queryset(self, queryset, request, view=None):
+        try:
+            return super().paginate_queryset(queryset, request, view)
+        except ValidationError:
+            raise NotFound(self.invalid_cursor_message)
+
+
+class CreatedAtCursorPagination(CursorPagination):
+    """
+    Keyset pagination over (created_at, id), so deep pages cost the same as the first
+    """
+    ordering = ('-created_at', '-id')
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+
+class TimestampCursorPagination(CursorPagination):
+    """
+    Keyset pagination over (timestamp, id) for the stock ledger
+    """
+    ordering = ('-timestamp', '-id')
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+
+class LocationStockCursorPagination(CursorPagination):
+    """
+    Keyset pagination over the variant, for the stock held at one location
+    """
+    ordering = ('product_variant_id',)
+    page_size_query_param = 'page_size'
+    max_page_size = 500
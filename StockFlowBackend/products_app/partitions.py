@@ -0,0 +1,182 @@
+"""
+Monthly range partitions of stock_transactions (PostgreSQL only).
+
+Migration 0014 turns stock_transactions into a table partitioned by
+timestamp with a single DEFAULT partition; create_partition() then splits
+off one partition per calendar month (UTC), moving any rows the default
+partition already holds for that month. Old months can be archived to
+gzipped CSV files, which detaches and drops their partition, and restored
+from those files later. The StockTransaction model does not change: every
+query still goes through the parent table, and the planner prunes the
+partitions a timestamp filter cannot match.
+
+Each partition's indexes are renamed after the parent index they belong
+to (stock_txn_variant_ts_idx_p202501 and so on), so query plans stay
+readable.
+"""
+import csv
+import datetime
+import gzip
+import os
+import re
+
+PARENT = "stock_transactions"
+DEFAULT_PARTITION = f"{PARENT}_default"
+PARTITION_NAME = re.compile(rf"^{PARENT}_p(\d{{4}})(\d{{2}})$")
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def next_month(month):
+    return (month.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+
+
+def partition_name(month):
+    return f"{PARENT}_p{month:%Y%m}"
+
+
+def partition_month(name):
+    """
+    The month a partition (or its archive file) covers, or None for other tables
+    """
+    match = PARTITION_NAME.match(name)
+    return datetime.date(int(match[1]), int(match[2]), 1) if match else None
+
+
+def month_bounds(month):
+    return f"{month:%Y-%m-%d} 00:00:00+00", f"{next_month(month):%Y-%m-%d} 00:00:00+00"
+
+
+def is_partitioned(cursor):
+    cursor.execute(
+        "SELECT relkind FROM pg_class WHERE relname = %s AND relnamespace = current_schema()::regnamespace",
+        [PARENT]
+    )
+    row = cursor.fetchone()
+    return row is not None and row[0] == "p"
+
+
+def list_partitions(cursor):
+    """
+    Return [(name, estimated rows)] for every attached partition, oldest month first
+    """
+    cursor.execute(
+        """
+        SELECT child.relname, child.reltuples::bigint
+        FROM pg_inherits
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE pg_inherits.inhparent = %s::regclass
+        ORDER BY child.relname
+        """,
+        [PARENT]
+    )
+    return cursor.fetchall()
+
+
+def default_partition_months(cursor):
+    """
+    Months that have rows sitting in the default partition
+    """
+    cursor.execute(
+        f"""
+        SELECT DISTINCT date_trunc('month', timestamp AT TIME ZONE 'UTC')::date
+        FROM {DEFAULT_PARTITION} ORDER BY 1
+        """
+    )
+    return [month for month, in cursor.fetchall()]
+
+
+def name_partition_indexes(cursor, name):
+    """
+    Rename the indexes of a partition after the parent indexes they are attached to
+    """
+    suffix = name[len(PARENT) + 1:]
+    cursor.execute(
+        """
+        SELECT child.relname, parent.relname
+        FROM pg_index
+        JOIN pg_class child ON child.oid = pg_index.indexrelid
+        JOIN pg_inherits ON pg_inherits.inhrelid = child.oid
+        JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+        WHERE pg_index.indrelid = %s::regclass
+        """,
+        [name]
+    )
+    for index, parent_index in cursor.fetchall():
+        target = f"{parent_index[:62 - len(suffix)]}_{suffix}"
+        if index != target:
+            cursor.execute(f'ALTER INDEX "{index}" RENAME TO "{target}"')
+
+
+def attach_partition(cursor, name, month):
+    lower, upper = month_bounds(month)
+    cursor.execute(f"ALTER TABLE {PARENT} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)", [lower, upper])
+    name_partition_indexes(cursor, name)
+
+
+def create_partition(cursor, month):
+    """
+    Create the partition for month unless it exists, moving the month's rows out
+    of the default partition. Returns whether a partition was created.
+    """
+    name = partition_name(month)
+    cursor.execute("SELECT to_regclass(%s)", [name])
+    if cursor.fetchone()[0] is not None:
+        return False
+
+    lower, upper = month_bounds(month)
+    # Load before attaching: ATTACH would refuse while the default partition still holds the month
+    cursor.execute(f"CREATE TABLE {name} (LIKE {PARENT} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+    cursor.execute(
+        f"""
+        WITH moved AS (
+            DELETE FROM {DEFAULT_PARTITION} WHERE timestamp >= %s AND timestamp < %s RETURNING *
+        )
+        INSERT INTO {name} SELECT * FROM moved
+        """,
+        [lower, upper]
+    )
+    attach_partition(cursor, name, month)
+    return True
+
+
+def archive_path(directory, month):
+    return os.path.join(directory, f"{partition_name(month)}.csv.gz")
+
+
+def archive_partition(cursor, month, directory):
+    """
+    Detach the month's partition, write its rows to a gzipped CSV file in
+    directory and drop it. Run inside a transaction: if anything fails the
+    partition stays attached.
+    """
+    name = partition_name(month)
+    path = archive_path(directory, month)
+    if os.path.exists(path):
+        raise FileExistsError(f"{path} already exists")
+
+    cursor.execute(f"ALTER TABLE {PARENT} DETACH PARTITION {name}")
+    os.makedirs(directory, exist_ok=True)
+    with gzip.open(f"{path}.tmp", "wt", newline="") as archive:
+        cursor.copy_expert(f"COPY {name} TO STDOUT WITH (FORMAT csv, HEADER)", archive)
+    os.replace(f"{path}.tmp", path)
+    cursor.execute(f"DROP TABLE {name}")
+    return path
+
+
+def restore_partition(cursor, month, directory):
+    """
+    Load an archived month back from its file and attach it again; the file is kept
+    """
+    name = partition_name(month)
+    path = archive_path(directory, month)
+    with gzip.open(path, "rt", newline="") as archive:
+        columns = ", ".join(f'"{column}"' for column in next(csv.reader([archive.readline()])))
+        archive.seek(0)
+        cursor.execute(f"CREATE TABLE {name} (LIKE {PARENT} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+        # Name the columns from the header, so files written before a column was added still load
+        cursor.copy_expert(f"COPY {name} ({columns}) FROM STDIN WITH (FORMAT csv, HEADER)", archive)
+    attach_partition(cursor, name, month)
+    return path
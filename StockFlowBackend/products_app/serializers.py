@@ -1,5 +1,11 @@
+from decimal import Decimal
+
+from django.core.files.storage import default_storage
+from django.db import transaction
 from rest_framework import serializers
 from .models import *
+from .taxonomy import taxonomy_cache
+
 class CategorySerializer(serializers.ModelSerializer):
     class Meta:
         model = Category
@@ -14,9 +20,10 @@ class ProductSerializer(serializers.ModelSerializer):
     created_by = serializers.ReadOnlyField(source="created_by.id")
     class Meta:
         model = Product
-        fields = "__all__"
+        exclude = ("search_document",)
         extra_kwargs = {
-            'hsn_code': {'required': False}, }
+            'hsn_code': {'required': False},
+            'total_stock': {'read_only': True}, }
   
 
 class VariantSerializer(serializers.ModelSerializer):
@@ -48,6 +55,66 @@ class ProductVariantItemSerializer(serializers.ModelSerializer):
         fields = ['id', 'product','product_name', 'product_code', 'image', 'quantity', 'price', 
                   'hsn_code','subcategory', 'configurations']
                   
+class VariantListingSerializer(serializers.ModelSerializer):
+    """
+    Renders a VariantListing row exactly as ProductVariantItemSerializer renders the variant
+    """
+    id = serializers.UUIDField(source='variant_id', read_only=True)
+    product = serializers.UUIDField(source='product_id', read_only=True)
+    image = serializers.SerializerMethodField()
+
+    class Meta:
+        model = VariantListing
+        fields = ['id', 'product', 'product_name', 'product_code', 'image', 'quantity', 'price',
+                  'hsn_code', 'subcategory', 'configurations']
+
+    def get_image(self, listing):
+        if not listing.image:
+            return None
+        url = default_storage.url(listing.image)
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request is not None else url
+
+
+def load_variant_options(option_ids):
+    """
+    Return the given variant options (with their variant) keyed by id.
+
+    Options are read from the taxonomy cache; IDs it does not hold yet, such as
+    options created by another worker since the cache was filled, are fetched
+    from the database. Unknown IDs are left out.
+    """
+    cached = taxonomy_cache.variant_options()
+    options = {option_id: cached[option_id] for option_id in option_ids if option_id in cached}
+    missing = set(option_ids) - options.keys()
+    if missing:
+        options.update(VariantOption.objects.select_related('variant').in_bulk(missing))
+    return options
+
+
+def get_variant_options(option_ids):
+    """
+    Look up the given variant options in request order, dropping repeats, and
+    reject the payload if any of them do not exist.
+    """
+    option_ids = list(dict.fromkeys(option_ids))
+    options = load_variant_options(option_ids)
+    unknown = [str(option_id) for option_id in option_ids if option_id not in options]
+    if unknown:
+        raise serializers.ValidationError(
+            {'variant_options': [f"Unknown variant options: {', '.join(unknown)}"]}
+        )
+    return [options[option_id] for option_id in option_ids]
+
+
+def build_product_code(product, variant_options):
+    """
+    Create a code combining product ID and variant options
+    """
+    option_codes = "-".join([opt.option[:3].upper() for opt in variant_options])
+    return f"{product.product_id}-{option_codes}"
+
+
 class ProductVariantItemCreateUpdateSerializer(serializers.ModelSerializer):
     variant_options = serializers.ListField(
         child=serializers.UUIDField(),
@@ -68,113 +135,63 @@ class ProductVariantItemCreateUpdateSerializer(serializers.ModelSerializer):
         """
         Validate that no duplicate product configurations exist for the same product.
         """
-        product = data['product']
-        variant_options = data['variant_options']
-        
-        # Sort variant options to ensure consistent comparison
-        sorted_variant_options = sorted(variant_options)
-        
-        # Get all existing product variants for this product
-        existing_variants = ProductVariantItem.objects.filter(product=product)
-        
-        for existing_variant in existing_variants:
-            # Get configurations for this variant
-            existing_configs = ProductConfiguration.objects.filter(product_item=existing_variant)
-            existing_option_ids = sorted([str(config.variant_option.id) for config in existing_configs])
-            
-            # Check if the configuration is the same (same set of variant options)
-            if existing_option_ids == sorted_variant_options:
-                variant_options_info = []
-                for option_id in variant_options:
-                    try:
-                        option = VariantOption.objects.get(id=option_id)
-                        variant_options_info.append(f"{option.variant.name}: {option.option}")
-                    except VariantOption.DoesNotExist:
-                        continue
-                
-                option_details = ", ".join(variant_options_info)
-                raise serializers.ValidationError(
-                    f"A product variant with the same configuration already exists. "
-                    f"Configuration: {option_details}"
-                )
+        if 'variant_options' not in data:
+            return data
+
+        product = data.get('product') or self.instance.product
+        # Resolve the options once; create() and update() store exactly what was checked here
+        variant_options = data['variant_options'] = get_variant_options(data['variant_options'])
+        signature = data['configuration_signature'] = ProductVariantItem.build_configuration_signature(
+            [option.id for option in variant_options]
+        )
+
+        # Single indexed lookup on (product, configuration_signature)
+        duplicates = ProductVariantItem.objects.filter(product=product, configuration_signature=signature)
+        if self.instance is not None:
+            duplicates = duplicates.exclude(id=self.instance.id)
+
+        if duplicates.exists():
+            option_details = ", ".join(
+                f"{option.variant.name}: {option.option}" for option in variant_options
+            )
+            raise serializers.ValidationError(
+                f"A product variant with the same configuration already exists. "
+                f"Configuration: {option_details}"
+            )
         
         return data
     
     def create(self, validated_data):
         variant_options = validated_data.pop('variant_options')
+        product = validated_data['product']
         
         # Generate product_code if not provided
         if 'product_code' not in validated_data or not validated_data['product_code']:
-            product = validated_data['product']
-            # Get variant options details for code generation
-            variant_option_objects = []
-            for option_id in variant_options:
-                try:
-                    option = VariantOption.objects.get(id=option_id)
-                    variant_option_objects.append(option)
-                except VariantOption.DoesNotExist:
-                    pass
-            
-            # Create a code combining product ID and variant options
-            option_codes = "-".join([opt.option[:3].upper() for opt in variant_option_objects])
-            validated_data['product_code'] = f"{product.product_id}-{option_codes}"
+            validated_data['product_code'] = build_product_code(product, variant_options)
         
         # Copy hsn_code from product if not provided
         if 'hsn_code' not in validated_data or not validated_data['hsn_code']:
-            product = validated_data['product']
             if hasattr(product, 'hsn_code') and product.hsn_code:
                 validated_data['hsn_code'] = product.hsn_code
         
         product_item = ProductVariantItem.objects.create(**validated_data)
         
         # Create configurations
-        for option_id in variant_options:
-            try:
-                variant_option = VariantOption.objects.get(id=option_id)
-                ProductConfiguration.objects.create(
-                    product_item=product_item,
-                    variant_option=variant_option
-                )
-            except VariantOption.DoesNotExist:
-                pass
+        ProductConfiguration.objects.bulk_create([
+            ProductConfiguration(product_item=product_item, variant_option=option)
+            for option in variant_options
+        ])
                 
         return product_item
     
+    @transaction.atomic
     def update(self, instance, validated_data):
-        # Check for duplicates if variant_options are being updated
-        if 'variant_options' in validated_data:
-            variant_options = validated_data['variant_options']
-            product = instance.product
-            
-            # Sort variant options to ensure consistent comparison
-            sorted_variant_options = sorted(variant_options)
-            
-            # Get all existing product variants for this product except the current instance
-            existing_variants = ProductVariantItem.objects.filter(product=product).exclude(id=instance.id)
-            
-            for existing_variant in existing_variants:
-                # Get configurations for this variant
-                existing_configs = ProductConfiguration.objects.filter(product_item=existing_variant)
-                existing_option_ids = sorted([str(config.variant_option.id) for config in existing_configs])
-                
-                # Check if the configuration is the same (same set of variant options)
-                if existing_option_ids == sorted_variant_options:
-                    variant_options_info = []
-                    for option_id in variant_options:
-                        try:
-                            option = VariantOption.objects.get(id=option_id)
-                            variant_options_info.append(f"{option.variant.name}: {option.option}")
-                        except VariantOption.DoesNotExist:
-                            continue
-                    
-                    option_details = ", ".join(variant_options_info)
-                    raise serializers.ValidationError(
-                        f"A product variant with the same configuration already exists. "
-                        f"Configuration: {option_details}"
-                    )
-        
-        # Existing update logic
-        instance.quantity = validated_data.get('quantity', instance.quantity)
+        # Duplicate configurations are rejected in validate()
+        # Lock the row so the quantity edit is applied against the current stock level,
+        # and the save below does not write back a stale reservation count
+        instance.quantity, instance.reserved_quantity = ProductVariantItem.objects.select_for_update().values_list(
+            'quantity', 'reserved_quantity'
+        ).get(pk=instance.pk)
         instance.price = validated_data.get('price', instance.price)
         
         # Only update product_code if explicitly provided
@@ -188,8 +205,6 @@ class ProductVariantItemCreateUpdateSerializer(serializers.ModelSerializer):
         # Handle image separately to avoid overwriting with None
         if 'image' in validated_data:
             instance.image = validated_data.get('image')
-            
-        instance.save()
         
         # Handle variant options if provided
         if 'variant_options' in validated_data:
@@ -198,34 +213,182 @@ class ProductVariantItemCreateUpdateSerializer(serializers.ModelSerializer):
             # If product_code was not explicitly provided but variant options changed,
             # we may want to regenerate the product_code
             if 'product_code' not in validated_data:
-                variant_option_objects = []
-                for option_id in variant_options:
-                    try:
-                        option = VariantOption.objects.get(id=option_id)
-                        variant_option_objects.append(option)
-                    except VariantOption.DoesNotExist:
-                        pass
-                
-                # Create a code combining product ID and variant options
-                option_codes = "-".join([opt.option[:3].upper() for opt in variant_option_objects])
-                instance.product_code = f"{instance.product.product_id}-{option_codes}"
-                instance.save()
+                instance.product_code = build_product_code(instance.product, variant_options)
             
             # Update configurations
             instance.configurations.all().delete()
-            for option_id in variant_options:
-                try:
-                    variant_option = VariantOption.objects.get(id=option_id)
-                    ProductConfiguration.objects.create(
-                        product_item=instance,
-                        variant_option=variant_option
-                    )
-                except VariantOption.DoesNotExist:
-                    pass
+            ProductConfiguration.objects.bulk_create([
+                ProductConfiguration(product_item=instance, variant_option=option)
+                for option in variant_options
+            ])
+            instance.configuration_signature = validated_data['configuration_signature']
+
+        instance.save()
+
+        # Quantity edits go through the stock ledger instead of overwriting the row
+        quantity_change = validated_data.get('quantity', instance.quantity) - instance.quantity
+        if quantity_change:
+            request = self.context.get('request')
+            try:
+                StockTransaction.objects.create(
+                    product_variant=instance,
+                    quantity=quantity_change,
+                    transaction_type='adjustment',
+                    user=request.user if request else None,
+                    notes='Quantity edited on product variant'
+                )
+            except InsufficientStock as e:
+                # Reserved units, or stock held at other locations, cannot be edited away;
+                # the atomic block rolls back the rest of the edit with it
+                raise serializers.ValidationError({'quantity': [str(e)]})
                     
         return instance
 
 
+class ProductVariantItemBulkItemSerializer(serializers.Serializer):
+    """
+    Field-level validation for a single item of a bulk variant payload
+    """
+    product = serializers.UUIDField(required=False)
+    product_code = serializers.CharField(max_length=255, required=False, allow_blank=True)
+    quantity = serializers.IntegerField(min_value=0, default=0)
+    price = serializers.DecimalField(max_digits=10, decimal_places=2)
+    hsn_code = serializers.CharField(max_length=255, required=False, allow_blank=True, allow_null=True)
+    variant_options = serializers.ListField(child=serializers.UUIDField(), allow_empty=False)
+
+
+class ProductVariantItemBulkCreateSerializer(serializers.Serializer):
+    """
+    Validate and create many product variant items at once.
+
+    All referenced products and variant options are fetched up front and
+    duplicate checks run set-based, so the number of queries does not grow
+    with the number of items. Pass ``product`` in the context to attach every
+    item to the same product.
+    """
+    items = ProductVariantItemBulkItemSerializer(many=True, allow_empty=False)
+
+    batch_size = 500
+
+    def validate(self, data):
+        items = data['items']
+        context_product = self.context.get('product')
+        errors = [{} for _ in items]
+
+        if context_product is not None:
+            products = {context_product.id: context_product}
+        else:
+            products = Product.objects.in_bulk({item['product'] for item in items if 'product' in item})
+        options = load_variant_options(
+            {option_id for item in items for option_id in item['variant_options']}
+        )
+
+        seen_signatures = set()
+        seen_codes = set()
+        for index, item in enumerate(items):
+            product = context_product or products.get(item.get('product'))
+            if product is None:
+                errors[index]['product'] = ["This field is required." if 'product' not in item else "Product not found."]
+                continue
+
+            option_ids = list(dict.fromkeys(item['variant_options']))
+            missing = [str(option_id) for option_id in option_ids if option_id not in options]
+            if missing:
+                errors[index]['variant_options'] = [f"Unknown variant options: {', '.join(missing)}"]
+                continue
+
+            item['product'] = product
+            item['variant_options'] = [options[option_id] for option_id in option_ids]
+            item['configuration_signature'] = ProductVariantItem.build_configuration_signature(
+                [option.id for option in item['variant_options']]
+            )
+            if not item.get('product_code'):
+                item['product_code'] = build_product_code(product, item['variant_options'])
+            if not item.get('hsn_code'):
+                item['hsn_code'] = product.hsn_code
+
+            if (product.id, item['configuration_signature']) in seen_signatures:
+                errors[index]['variant_options'] = ["Duplicate configuration in this payload."]
+            seen_signatures.add((product.id, item['configuration_signature']))
+            if item['product_code'] in seen_codes:
+                errors[index]['product_code'] = ["Duplicate product code in this payload."]
+            seen_codes.add(item['product_code'])
+
+        valid_items = [item for item, item_errors in zip(items, errors) if not item_errors]
+        existing_signatures = set(
+            ProductVariantItem.objects.filter(
+                product__in={item['product'].id for item in valid_items},
+                configuration_signature__in={item['configuration_signature'] for item in valid_items},
+            ).values_list('product_id', 'configuration_signature')
+        )
+        existing_codes = set(
+            ProductVariantItem.objects.filter(
+                product_code__in={item['product_code'] for item in valid_items}
+            ).values_list('product_code', flat=True)
+        )
+        for item, item_errors in zip(items, errors):
+            if item_errors:
+                continue
+            if (item['product'].id, item['configuration_signature']) in existing_signatures:
+                option_details = ", ".join(
+                    f"{option.variant.name}: {option.option}" for option in item['variant_options']
+                )
+                item_errors['variant_options'] = [
+                    f"A product variant with the same configuration already exists. "
+                    f"Configuration: {option_details}"
+                ]
+            if item['product_code'] in existing_codes:
+                item_errors['product_code'] = ["A product variant with this product code already exists."]
+
+        if any(errors):
+            raise serializers.ValidationError({'items': errors})
+        return data
+
+    def create(self, validated_data):
+        product_items = []
+        configurations = []
+        for item in validated_data['items']:
+            product_item = ProductVariantItem(
+                product=item['product'],
+                product_code=item['product_code'],
+                quantity=item['quantity'],
+                price=item['price'],
+                hsn_code=item['hsn_code'],
+                configuration_signature=item['configuration_signature'],
+            )
+            product_items.append(product_item)
+            configurations.extend(
+                ProductConfiguration(product_item=product_item, variant_option=option)
+                for option in item['variant_options']
+            )
+
+        with transaction.atomic():
+            ProductVariantItem.objects.bulk_create(product_items, batch_size=self.batch_size)
+            ProductConfiguration.objects.bulk_create(configurations, batch_size=self.batch_size)
+            LocationStock.stock_opening(product_items)
+            # bulk_create sends no signals; the new variants are searchable and listed after commit
+            search_refresh.add("product", {item.product_id for item in product_items})
+            listing_refresh.add("item", [item.pk for item in product_items])
+        return product_items
+
+
+def product_variant_details(variant):
+    """
+    Summarise a variant for stock views; expects configurations to be prefetched
+    (see the with_details() querysets) to avoid per-row queries.
+    """
+    return {
+        'product_name': variant.product.name,
+        'product_code': variant.product_code,
+        'configurations': [
+            {
+                'variant_name': config.variant_option.variant.name,
+                'option_value': config.variant_option.option
+            } for config in variant.configurations.all()
+        ]
+    }
+
+
 class StockTransactionSerializer(serializers.ModelSerializer):
     """
     Serializer for Stock Transactions
@@ -245,25 +408,169 @@ class StockTransactionSerializer(serializers.ModelSerializer):
             'user', 
             'user_username',
             'notes', 
-            'reference_number'
+            'reference_number',
+            'unit_cost',
+            'source_location',
+            'destination_location'
         ]
         read_only_fields = ['timestamp']
 
+    def validate(self, data):
+        transaction_type = data.get('transaction_type', getattr(self.instance, 'transaction_type', None))
+        quantity = data.get('quantity', getattr(self.instance, 'quantity', 0))
+        if transaction_type == 'transfer':
+            source = data.get('source_location', getattr(self.instance, 'source_location', None))
+            destination = data.get('destination_location', getattr(self.instance, 'destination_location', None))
+            if source is None or destination is None or source == destination:
+                raise serializers.ValidationError("Transfers need distinct source and destination locations.")
+        # Removals, transfers and negative adjustments are costed by the valuation
+        if data.get('unit_cost') is not None and (
+            transaction_type in ('remove', 'transfer') or quantity < 0
+        ):
+            raise serializers.ValidationError({'unit_cost': "Only receipts carry a unit cost."})
+        return data
+
     def get_product_variant_details(self, obj):
         """
         Get detailed information about the product variant
         """
-        variant = obj.product_variant
-        return {
-            'product_name': variant.product.name,
-            'product_code': variant.product_code,
-            'configurations': [
-                {
-                    'variant_name': config.variant_option.variant.name,
-                    'option_value': config.variant_option.option
-                } for config in variant.configurations.all()
-            ]
-        }
+        return product_variant_details(obj.product_variant)
+
+class StockMovementLineSerializer(serializers.Serializer):
+    """
+    Serializer for a single line of a bulk stock movement
+    """
+    product_variant_id = serializers.UUIDField()
+    quantity = serializers.IntegerField()
+    transaction_type = serializers.ChoiceField(choices=StockTransaction.TRANSACTION_TYPES)
+    reference_number = serializers.CharField(max_length=255, required=False, allow_blank=True)
+    notes = serializers.CharField(required=False, allow_blank=True)
+    # Receipts only; defaults to the variant's price
+    unit_cost = serializers.DecimalField(max_digits=12, decimal_places=4, min_value=Decimal(0), required=False)
+    # Default to the default location; transfers need both
+    source_location_id = serializers.UUIDField(required=False)
+    destination_location_id = serializers.UUIDField(required=False)
+
+    def validate(self, data):
+        if data['transaction_type'] == 'adjustment':
+            if data['quantity'] == 0:
+                raise serializers.ValidationError({'quantity': "Adjustments must be non-zero."})
+        elif data['quantity'] <= 0:
+            raise serializers.ValidationError({'quantity': "Quantity must be a positive integer."})
+        if data.get('unit_cost') is not None and (
+            data['transaction_type'] in ('remove', 'transfer') or data['quantity'] < 0
+        ):
+            raise serializers.ValidationError({'unit_cost': "Only receipts carry a unit cost."})
+        if data['transaction_type'] == 'transfer' and (
+            None in (data.get('source_location_id'), data.get('destination_location_id'))
+            or data['source_location_id'] == data['destination_location_id']
+        ):
+            raise serializers.ValidationError("Transfers need distinct source and destination locations.")
+        return data
+
+
+class StockMovementBatchSerializer(serializers.Serializer):
+    """
+    Serializer for a batch of stock movements, such as a goods-received note
+    """
+    lines = StockMovementLineSerializer(many=True, allow_empty=False)
+    reference_number = serializers.CharField(max_length=255, required=False, allow_blank=True)
+    all_or_nothing = serializers.BooleanField(default=False)
+
+    def validate(self, data):
+        # Check every location the batch names in one query
+        location_fields = ('source_location_id', 'destination_location_id')
+        named = {line[field] for line in data['lines'] for field in location_fields if line.get(field)}
+        known = set(Location.objects.filter(pk__in=named).values_list('pk', flat=True)) if named else set()
+        errors = [
+            {field: ["Location not found."] for field in location_fields if line.get(field) and line[field] not in known}
+            for line in data['lines']
+        ]
+        if any(errors):
+            raise serializers.ValidationError({'lines': errors})
+        return data
+
+
+class StockReservationSerializer(serializers.ModelSerializer):
+    """
+    Serializer for Stock Reservations
+    """
+    product_code = serializers.CharField(source='product_variant.product_code', read_only=True)
+    user_username = serializers.CharField(source='user.username', read_only=True)
+
+    class Meta:
+        model = StockReservation
+        fields = [
+            'id', 'product_variant', 'product_code', 'quantity', 'status', 'reference_number',
+            'user', 'user_username', 'created_at', 'expires_at', 'closed_at', 'transaction_id'
+        ]
+        read_only_fields = fields
+
+
+class ReservationLineSerializer(serializers.Serializer):
+    """
+    Serializer for a single line of a stock reservation
+    """
+    product_variant_id = serializers.UUIDField()
+    quantity = serializers.IntegerField(min_value=1)
+
+
+class ReservationBatchSerializer(serializers.Serializer):
+    """
+    Serializer for a batch of stock holds, such as the lines of an order being picked
+    """
+    lines = ReservationLineSerializer(many=True, allow_empty=False)
+    reference_number = serializers.CharField(max_length=255, required=False, allow_blank=True)
+    # Defaults to STOCK_RESERVATION_TTL
+    ttl_seconds = serializers.IntegerField(min_value=1, max_value=7 * 24 * 60 * 60, required=False)
+    all_or_nothing = serializers.BooleanField(default=True)
+
+
+class ReservationCloseSerializer(serializers.Serializer):
+    """
+    Serializer for committing or releasing reservations
+    """
+    reservation_ids = serializers.ListField(child=serializers.UUIDField(), allow_empty=False, max_length=1000)
+    # Commits only; defaults to each reservation's own reference
+    reference_number = serializers.CharField(max_length=255, required=False, allow_blank=True)
+    # Commits only; where the held units are picked from, default the default location
+    location = serializers.PrimaryKeyRelatedField(queryset=Location.objects.all(), required=False)
+
+
+class LocationSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Location
+        fields = ['id', 'name', 'code', 'address', 'is_default', 'is_active', 'created_at']
+        read_only_fields = ['created_at']
+        # save() demotes the previous default rather than rejecting a second one
+        extra_kwargs = {'is_default': {'validators': []}}
+
+    def validate_is_default(self, value):
+        if not value and self.instance is not None and self.instance.is_default:
+            raise serializers.ValidationError("Make another location the default instead.")
+        return value
+
+    @transaction.atomic
+    def save(self, **kwargs):
+        if self.validated_data.get('is_default'):
+            # The previous default steps down in the same transaction
+            Location.objects.filter(is_default=True).exclude(
+                pk=getattr(self.instance, 'pk', None)
+            ).update(is_default=False)
+        return super().save(**kwargs)
+
+
+class LocationStockSerializer(serializers.ModelSerializer):
+    """
+    Stock of one variant at one location
+    """
+    location_code = serializers.CharField(source='location.code', read_only=True)
+    product_code = serializers.CharField(source='product_variant.product_code', read_only=True)
+
+    class Meta:
+        model = LocationStock
+        fields = ['location', 'location_code', 'product_variant', 'product_code', 'quantity']
+
 
 class LowStockAlertSerializer(serializers.ModelSerializer):
     """
@@ -288,17 +595,7 @@ class LowStockAlertSerializer(serializers.ModelSerializer):
         """
         Get detailed information about the product variant
         """
-        variant = obj.product_variant
-        return {
-            'product_name': variant.product.name,
-            'product_code': variant.product_code,
-            'configurations': [
-                {
-                    'variant_name': config.variant_option.variant.name,
-                    'option_value': config.variant_option.option
-                } for config in variant.configurations.all()
-            ]
-        }
+        return product_variant_details(obj.product_variant)
 
     def get_current_stock(self, obj):
         """
@@ -308,3 +605,92 @@ class LowStockAlertSerializer(serializers.ModelSerializer):
 
 
 
+
+
+class LowStockVariantSerializer(serializers.ModelSerializer):
+    """
+    A variant found by ProductVariantItem.objects.low_stock(), with the threshold it crossed
+    and where that threshold comes from; expects with_details() and lowstockalert loaded
+    """
+    product_variant = serializers.UUIDField(source='id', read_only=True)
+    product_variant_details = serializers.SerializerMethodField()
+    alert = serializers.IntegerField(source='lowstockalert.id', read_only=True)
+    threshold = serializers.IntegerField(source='low_stock_threshold', read_only=True)
+    threshold_source = serializers.SerializerMethodField()
+    last_notified = serializers.DateTimeField(source='lowstockalert.last_notified', read_only=True)
+    current_stock = serializers.IntegerField(source='quantity', read_only=True)
+
+    class Meta:
+        model = ProductVariantItem
+        fields = [
+            'product_variant',
+            'product_variant_details',
+            'alert',
+            'threshold',
+            'threshold_source',
+            'last_notified',
+            'current_stock'
+        ]
+
+    def get_product_variant_details(self, variant):
+        return product_variant_details(variant)
+
+    def get_threshold_source(self, variant):
+        alert = getattr(variant, 'lowstockalert', None)
+        if alert is not None and alert.threshold is not None:
+            return 'variant'
+        if variant.product.subcategory.low_stock_threshold is not None:
+            return 'subcategory'
+        return 'category'
+
+
+class CategoryStockSummarySerializer(serializers.ModelSerializer):
+    """
+    A category's stock counters; expects category loaded
+    """
+    name = serializers.CharField(source='category.name', read_only=True)
+
+    class Meta:
+        model = CategoryStockSummary
+        fields = ['category', 'name', 'products', 'variants', 'units', 'stock_value']
+
+
+class DashboardSummarySerializer(serializers.Serializer):
+    products = serializers.IntegerField()
+    variants = serializers.IntegerField()
+    categories = serializers.IntegerField()
+    units = serializers.IntegerField()
+    stock_value = serializers.DecimalField(max_digits=18, decimal_places=2)
+    low_stock = serializers.IntegerField()
+    low_stock_as_of = serializers.DateTimeField()
+    movements_today = serializers.IntegerField()
+    units_in_today = serializers.IntegerField()
+    units_out_today = serializers.IntegerField()
+    by_category = CategoryStockSummarySerializer(many=True)
+
+
+class StockValuationSerializer(serializers.Serializer):
+    """
+    Totals of a stock valuation; see products_app.valuation
+    """
+    as_of = serializers.DateTimeField()
+    quantity = serializers.IntegerField()
+    fifo_value = serializers.DecimalField(max_digits=18, decimal_places=2)
+    average_value = serializers.DecimalField(max_digits=18, decimal_places=2)
+
+
+class CategoryValuationSerializer(serializers.Serializer):
+    category = serializers.UUIDField()
+    name = serializers.CharField()
+    quantity = serializers.IntegerField()
+    fifo_value = serializers.DecimalField(max_digits=18, decimal_places=2)
+    average_value = serializers.DecimalField(max_digits=18, decimal_places=2)
+
+
+class VariantValuationSerializer(serializers.Serializer):
+    product_variant = serializers.UUIDField()
+    product_code = serializers.CharField()
+    quantity = serializers.IntegerField()
+    average_cost = serializers.DecimalField(max_digits=12, decimal_places=4)
+    fifo_value = serializers.DecimalField(max_digits=18, decimal_places=2)
+    average_value = serializers.DecimalField(max_digits=18, decimal_places=2)
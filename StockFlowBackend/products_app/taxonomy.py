@@ -0,0 +1,102 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Category, SubCategory, Variant, VariantOption
+
+VERSION_KEY = "taxonomy:version"
+
+
+class TaxonomyCache:
+    """
+    Read-through cache for the category/subcategory/variant/option taxonomy.
+
+    Entries are keyed by a version number kept in a shared Django cache
+    (``TAXONOMY_CACHE_ALIAS``, "default" unless configured), so bumping the
+    version from any process invalidates every process's copy. Each process
+    keeps a small LRU in front of the shared cache so repeated reads are
+    served from memory. Entries also expire after ``TAXONOMY_CACHE_TIMEOUT``
+    seconds, which bounds staleness when the backend is not shared between
+    workers or rows are written without signals (bulk_create, raw SQL).
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def timeout(self):
+        return getattr(settings, "TAXONOMY_CACHE_TIMEOUT", 300)
+
+    @property
+    def backend(self):
+        return caches[getattr(settings, "TAXONOMY_CACHE_ALIAS", "default")]
+
+    def version(self):
+        version = self.backend.get(VERSION_KEY)
+        if version is None:
+            self.backend.add(VERSION_KEY, 1, timeout=None)
+            version = self.backend.get(VERSION_KEY, 1)
+        return version
+
+    def get_or_load(self, key, loader):
+        """
+        Return the cached value for key, calling loader() to build it on a miss
+        """
+        local_key = (self.version(), key)
+        with self._lock:
+            entry = self._local.get(local_key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._local.move_to_end(local_key)
+                return entry[1]
+
+        shared_key = f"taxonomy:{local_key[0]}:{key}"
+        value = self.backend.get(shared_key)
+        if value is None:
+            value = loader()
+            self.backend.set(shared_key, value, timeout=self.timeout)
+
+        with self._lock:
+            self._local[local_key] = (time.monotonic() + self.timeout, value)
+            self._local.move_to_end(local_key)
+            while len(self._local) > self.maxsize:
+                self._local.popitem(last=False)
+        return value
+
+    def invalidate(self):
+        with self._lock:
+            self._local.clear()
+        try:
+            self.backend.incr(VERSION_KEY)
+        except ValueError:
+            self.backend.set(VERSION_KEY, 1, timeout=None)
+
+    def variant_options(self):
+        """
+        Every variant option, with its variant loaded, keyed by id
+        """
+        return self.get_or_load(
+            "variant_options",
+            lambda: VariantOption.objects.select_related("variant").in_bulk()
+        )
+
+
+taxonomy_cache = TaxonomyCache()
+
+
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=SubCategory)
+@receiver([post_save, post_delete], sender=Variant)
+@receiver([post_save, post_delete], sender=VariantOption)
+def invalidate_taxonomy_cache(sender, **kwargs):
+    # Invalidate now so this transaction reads its own writes, and again on
+    # commit in case another request cached the old rows in the meantime
+    taxonomy_cache.invalidate()
+    transaction.on_commit(taxonomy_cache.invalidate)
@@ -1,3 +1,2296 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+import warnings
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.cache.backends.base import CacheKeyWarning
+from django.core.management import CommandError, call_command
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.db.models import F
+from django.test import TestCase, TransactionTestCase, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from . import benchmarks, partitions
+from .alerts import LOW_STOCK_COUNT_KEY, process_low_stock_checks
+from .models import *
+from .pagination import CreatedAtCursorPagination
+from .serializers import ProductVariantItemSerializer, build_product_code
+from .taxonomy import taxonomy_cache
+from .valuation import CostLayers, build_checkpoints, value_inventory
+
+
+def create_catalogue(user, quantity=0):
+    """
+    Create the smallest catalogue needed to hold stock: one product with one variant
+    """
+    category = Category.objects.create(name="Apparel")
+    subcategory = SubCategory.objects.create(category=category, name="Shirts")
+    product = Product.objects.create(
+        name="Oxford Shirt", subcategory=subcategory, created_by=user, total_stock=quantity
+    )
+    return ProductVariantItem.objects.create(
+        product=product,
+        product_code=f"{product.product_id}-STD",
+        quantity=quantity,
+        price="25.00"
+    )
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class StockLedgerConcurrencyTests(TransactionTestCase):
+    """
+    Hammer the stock endpoints from several threads and check that no update is lost
+    """
+    workers = 8
+    requests_per_worker = 25
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="scanner", password="scanner")
+
+    def run_concurrently(self, path, payload):
+        """
+        Post the same payload from every worker at once and return the response status codes
+        """
+        barrier = threading.Barrier(self.workers)
+        status_codes = []
+        errors = []
+
+        def worker():
+            client = APIClient()
+            client.force_authenticate(self.user)
+            try:
+                barrier.wait()
+                for _ in range(self.requests_per_worker):
+                    status_codes.append(client.post(path, payload, format='json').status_code)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        return status_codes
+
+    def test_concurrent_additions_are_not_lost(self):
+        self.variant = create_catalogue(self.user)
+
+        status_codes = self.run_concurrently(
+            '/api/stock/add-stock/',
+            {'product_variant_id': str(self.variant.id), 'quantity': 1}
+        )
+
+        self.assertEqual(set(status_codes), {201})
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.quantity, self.workers * self.requests_per_worker)
+        self.assertEqual(self.variant.stock_transactions.count(), self.workers * self.requests_per_worker)
+        self.variant.product.refresh_from_db()
+        self.assertEqual(self.variant.product.total_stock, self.variant.quantity)
+
+    def test_concurrent_removals_never_oversell(self):
+        self.variant = create_catalogue(self.user, quantity=50)
+
+        status_codes = self.run_concurrently(
+            '/api/stock/remove-stock/',
+            {'product_variant_id': str(self.variant.id), 'quantity': 1}
+        )
+
+        self.assertEqual(status_codes.count(201), 50)
+        self.assertEqual(status_codes.count(400), self.workers * self.requests_per_worker - 50)
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.quantity, 0)
+        self.assertEqual(self.variant.stock_transactions.filter(transaction_type='remove').count(), 50)
+        self.variant.product.refresh_from_db()
+        self.assertEqual(self.variant.product.total_stock, 0)
+
+    def test_concurrent_reservations_never_overbook(self):
+        self.variant = create_catalogue(self.user, quantity=50)
+
+        status_codes = self.run_concurrently(
+            '/api/reservations/reserve/',
+            {'lines': [{'product_variant_id': str(self.variant.id), 'quantity': 1}]}
+        )
+
+        self.assertEqual(status_codes.count(201), 50)
+        self.variant.refresh_from_db()
+        self.assertEqual((self.variant.quantity, self.variant.reserved_quantity), (50, 50))
+        self.assertEqual(self.variant.reservations.filter(status='active').count(), 50)
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class ProductIdAllocatorConcurrencyTests(TransactionTestCase):
+    """
+    Separate allocators stand in for separate worker processes; their blocks must never overlap
+    """
+    workers = 8
+    ids_per_worker = 250
+
+    def test_workers_never_share_ids(self):
+        barrier = threading.Barrier(self.workers)
+        allocated = []
+        errors = []
+
+        def worker():
+            allocator = ProductIdAllocator()
+            try:
+                barrier.wait()
+                for _ in range(self.ids_per_worker):
+                    allocated.extend(allocator.allocate())
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(set(allocated)), self.workers * self.ids_per_worker)
+
+
+class StockMovementTests(TestCase):
+    """
+    Movements that would take more stock than is available are rejected with a 400, not applied
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="storeman", password="storeman")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.item = create_catalogue(self.user, quantity=5)
+
+    def stock(self):
+        self.item.refresh_from_db(fields=['quantity'])
+        return self.item.quantity, Product.objects.get(pk=self.item.product_id).total_stock
+
+    def test_over_withdrawal_through_the_ledger_endpoint(self):
+        response = self.client.post('/api/stock/', {
+            'product_variant': str(self.item.id), 'quantity': 6, 'transaction_type': 'remove'
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'quantity': [f"Insufficient stock for {self.item.product_code}"]})
+        self.assertEqual(self.stock(), (5, 5))
+        self.assertFalse(StockTransaction.objects.exists())
+
+        response = self.client.post('/api/stock/', {
+            'product_variant': str(self.item.id), 'quantity': 5, 'transaction_type': 'remove'
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.stock(), (0, 0))
+
+    def edit_quantity(self, quantity):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.patch(
+                f'/api/product-variants/{self.item.id}/', {'quantity': quantity, 'price': '30.00'}, format='json'
+            )
+
+    def test_quantity_edits_cannot_take_reserved_stock(self):
+        StockReservation.reserve([(self.item.pk, 3)], expires_at=timezone.now() + timedelta(hours=1), user=self.user)
+
+        response = self.edit_quantity(2)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'quantity': [f"Insufficient stock for {self.item.product_code}"]})
+        # The rest of the edit is rolled back with the quantity
+        self.assertEqual(self.stock(), (5, 5))
+        self.assertEqual(ProductVariantItem.objects.get(pk=self.item.pk).price, Decimal("25.00"))
+
+        self.assertEqual(self.edit_quantity(3).status_code, 200)
+        self.assertEqual(self.stock(), (3, 3))
+
+    def test_quantity_edits_cannot_take_stock_held_at_other_locations(self):
+        store = Location.objects.create(name="High street store", code="STORE")
+        StockTransaction.objects.create(
+            product_variant=self.item, quantity=2, transaction_type='transfer',
+            source_location_id=Location.default_id(), destination_location=store,
+        )
+
+        # Edits are booked at the default location, which now holds 3 of the 5 units
+        response = self.edit_quantity(1)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'quantity': ["Insufficient stock at this location"]})
+        self.assertEqual(self.stock(), (5, 5))
+        self.assertEqual(self.edit_quantity(2).status_code, 200)
+        self.assertEqual(self.stock(), (2, 2))
+
+
+class TotalStockReconcileTests(TestCase):
+    """
+    reconcile_total_stock finds products whose total_stock has drifted from their variants and repairs them
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="auditor", password="auditor")
+        self.item = create_catalogue(self.user, quantity=8)
+        self.products = [self.item.product] + [
+            Product.objects.create(name=f"Polo {number}", subcategory=self.item.product.subcategory, created_by=self.user)
+            for number in range(2)
+        ]
+        ProductVariantItem.objects.create(product=self.products[1], product_code="POLO-0", quantity=3, price="20.00")
+        Product.apply_stock_delta(self.products[1].pk, 3)
+        # Corrupt two of the three totals behind the ledger's back
+        Product.objects.filter(pk=self.products[0].pk).update(total_stock=99)
+        Product.objects.filter(pk=self.products[2].pk).update(total_stock=4)
+
+    def reconcile(self, **options):
+        out = io.StringIO()
+        call_command('reconcile_total_stock', batch_size=2, stdout=out, **options)
+        return out.getvalue()
+
+    def totals(self):
+        return [Product.objects.get(pk=product.pk).total_stock for product in self.products]
+
+    def test_reports_and_repairs_drift(self):
+        output = self.reconcile(dry_run=True)
+        self.assertIn(f"Product {self.products[0].pk}: total_stock=99, variants sum to 8", output)
+        self.assertIn(f"Product {self.products[2].pk}: total_stock=4, variants sum to 0", output)
+        self.assertNotIn(str(self.products[1].pk), output)
+        self.assertIn("Checked 3 products, found 2 with drift", output)
+        self.assertEqual(self.totals(), [99, 3, 4])
+
+        self.assertIn("Checked 3 products, repaired 2 with drift", self.reconcile())
+        self.assertEqual(self.totals(), [8, 3, 0])
+        self.assertIn("Checked 3 products, repaired 0 with drift", self.reconcile())
+
+    def test_repairs_change_the_product_etags(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        paths = ['/api/products/', f'/api/products/{self.products[0].pk}/']
+        before = [client.get(path)['ETag'] for path in paths]
+
+        self.reconcile()
+        for path, etag in zip(paths, before):
+            response = client.get(path, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200, path)
+
+
+class BulkMovementTests(TestCase):
+    """
+    stock/bulk-movements applies a batch of lines against running stock levels, one result per line
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="scanner", password="scanner")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.item = create_catalogue(self.user, quantity=5)
+            self.other = ProductVariantItem.objects.create(
+                product=self.item.product, product_code="OTHER", quantity=2, price="10.00"
+            )
+            Product.apply_stock_delta(self.item.product_id, 2)
+
+    def line(self, variant, transaction_type, quantity):
+        return {'product_variant_id': str(variant.id), 'transaction_type': transaction_type, 'quantity': quantity}
+
+    def post(self, lines, **options):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/api/stock/bulk-movements/', {'lines': lines, **options}, format='json')
+
+    def stock(self):
+        return (
+            dict(ProductVariantItem.objects.values_list('product_code', 'quantity')),
+            Product.objects.get(pk=self.item.product_id).total_stock,
+        )
+
+    def test_lines_of_one_variant_apply_against_its_running_level(self):
+        response = self.post([
+            self.line(self.item, 'add', 5),
+            self.line(self.item, 'remove', 3),
+            self.line(self.item, 'remove', 8),
+            self.line(self.item, 'remove', 7),
+            self.line(self.other, 'adjustment', -1),
+        ], reference_number="GRN-7")
+        self.assertEqual(response.status_code, 201)
+        results = response.json()['results']
+        self.assertEqual([line['status'] for line in results], ['applied', 'applied', 'rejected', 'applied', 'applied'])
+        self.assertEqual([line.get('new_quantity') for line in results], [10, 7, None, 0, 1])
+        self.assertEqual(results[2]['error'], "Insufficient stock")
+        self.assertEqual(self.stock(), ({self.item.product_code: 0, 'OTHER': 1}, 1))
+        self.assertEqual(
+            sorted(StockTransaction.objects.values_list('quantity', flat=True)), [-1, 3, 5, 7]
+        )
+        self.assertEqual(set(StockTransaction.objects.values_list('reference_number', flat=True)), {"GRN-7"})
+
+    def test_all_or_nothing_applies_no_line_unless_every_line_is_accepted(self):
+        lines = [self.line(self.item, 'remove', 2), self.line(self.other, 'remove', 3)]
+        response = self.post(lines, all_or_nothing=True)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            [(line['status'], line.get('error')) for line in response.json()['results']],
+            [('not_applied', None), ('rejected', "Insufficient stock")]
+        )
+        self.assertEqual(self.stock(), ({self.item.product_code: 5, 'OTHER': 2}, 7))
+        self.assertFalse(StockTransaction.objects.exists())
+
+        # Without it the accepted line goes through alone
+        response = self.post(lines)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.stock(), ({self.item.product_code: 3, 'OTHER': 2}, 5))
+
+    def test_invalid_lines_reject_the_batch_with_errors_per_line(self):
+        response = self.post([
+            self.line(self.item, 'add', 1),
+            self.line(self.item, 'remove', 0),
+            self.line(self.item, 'steal', 1),
+            self.line(self.item, 'adjustment', 0),
+            {'transaction_type': 'add', 'quantity': 1},
+        ])
+        self.assertEqual(response.status_code, 400)
+        errors = response.json()['lines']
+        self.assertEqual(errors[0], {})
+        self.assertEqual(errors[1], {'quantity': ["Quantity must be a positive integer."]})
+        self.assertIn('transaction_type', errors[2])
+        self.assertEqual(errors[3], {'quantity': ["Adjustments must be non-zero."]})
+        self.assertIn('product_variant_id', errors[4])
+
+        # A variant that does not exist fails only its own line
+        missing = dict(self.line(self.item, 'add', 1), product_variant_id=str(uuid.uuid4()))
+        response = self.post([self.line(self.item, 'add', 1), missing])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            response.json()['results'][1], {'line': 1, 'status': 'rejected', 'error': "Product variant not found"}
+        )
+        self.assertEqual(self.stock(), ({self.item.product_code: 6, 'OTHER': 2}, 8))
+
+
+class VariantConfigurationTests(TestCase):
+    """
+    Duplicate configurations are found through the stored signature, which follows every configuration change
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="designer", password="designer")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        category = Category.objects.create(name="Apparel")
+        subcategory = SubCategory.objects.create(category=category, name="Shirts")
+        size = Variant.objects.create(subcategory=subcategory, name="Size")
+        colour = Variant.objects.create(subcategory=subcategory, name="Colour")
+        self.small = VariantOption.objects.create(variant=size, option="Small")
+        self.large = VariantOption.objects.create(variant=size, option="Large")
+        self.red = VariantOption.objects.create(variant=colour, option="Red")
+        self.product = Product.objects.create(name="Oxford Shirt", subcategory=subcategory, created_by=self.user)
+        self.small_red = self.create_variant(self.small, self.red).json()['id']
+
+    def create_variant(self, *options):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/api/product-variants/', {
+                'product': str(self.product.id),
+                'variant_options': [str(option.id) for option in options],
+                'quantity': 1,
+                'price': '30.00',
+            }, format='json')
+
+    def signature(self, item_id):
+        return ProductVariantItem.objects.get(pk=item_id).configuration_signature
+
+    def test_duplicate_configurations_are_rejected(self):
+        self.assertEqual(
+            self.signature(self.small_red), ProductVariantItem.build_configuration_signature([self.red.id, self.small.id])
+        )
+        # Option order does not matter
+        response = self.create_variant(self.red, self.small)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("same configuration already exists", response.json()['non_field_errors'][0])
+
+        large_red = self.create_variant(self.large, self.red).json()['id']
+        response = self.client.patch(
+            f'/api/product-variants/{large_red}/',
+            {'variant_options': [str(self.small.id), str(self.red.id)]}, format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("same configuration already exists", response.json()['non_field_errors'][0])
+
+        # Re-saving a variant's own configuration is not a duplicate
+        response = self.client.patch(
+            f'/api/product-variants/{self.small_red}/',
+            {'variant_options': [str(self.red.id), str(self.small.id)]}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_signature_follows_configuration_changes(self):
+        response = self.client.patch(
+            f'/api/product-variants/{self.small_red}/', {'variant_options': [str(self.large.id), str(self.red.id)]},
+            format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            self.signature(self.small_red), ProductVariantItem.build_configuration_signature([self.large.id, self.red.id])
+        )
+        # The old configuration is free again, the new one taken
+        self.assertEqual(self.create_variant(self.small, self.red).status_code, 201)
+        self.assertEqual(self.create_variant(self.large, self.red).status_code, 400)
+
+        # Configurations edited directly move the signature too
+        configuration = ProductConfiguration.objects.get(product_item=self.small_red, variant_option=self.red)
+        self.assertEqual(self.client.delete(f'/api/product-configurations/{configuration.id}/').status_code, 204)
+        self.assertEqual(self.signature(self.small_red), ProductVariantItem.build_configuration_signature([self.large.id]))
+        response = self.client.post('/api/product-configurations/', {
+            'product_item': self.small_red, 'variant_option': str(self.red.id)
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            self.signature(self.small_red), ProductVariantItem.build_configuration_signature([self.large.id, self.red.id])
+        )
+
+
+class BulkVariantCreateTests(TestCase):
+    """
+    Bulk variant payloads are validated whole and written in a number of queries set by batches, not items
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="merchandiser", password="merchandiser")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        category = Category.objects.create(name="Apparel")
+        self.subcategory = SubCategory.objects.create(category=category, name="Shirts")
+        size = Variant.objects.create(subcategory=self.subcategory, name="Size")
+        colour = Variant.objects.create(subcategory=self.subcategory, name="Colour")
+        sizes = VariantOption.objects.bulk_create([VariantOption(variant=size, option=f"S{s}") for s in range(100)])
+        colours = VariantOption.objects.bulk_create([VariantOption(variant=colour, option=f"C{c}") for c in range(50)])
+        self.pairs = [(s, c) for s in sizes for c in colours]
+
+    def new_product(self, name):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Product.objects.create(name=name, subcategory=self.subcategory, created_by=self.user)
+
+    def items(self, count, start=0):
+        return [
+            {'variant_options': [str(size.id), str(colour.id)], 'quantity': 2, 'price': '9.99'}
+            for size, colour in self.pairs[start:start + count]
+        ]
+
+    def add_to_product(self, product, items):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(f'/api/product-variants/add-to-product/{product.id}/', {'items': items}, format='json')
+
+    def test_a_bad_item_rejects_the_whole_batch(self):
+        product = self.new_product("Oxford Shirt")
+        self.assertEqual(self.add_to_product(product, self.items(1)).status_code, 201)
+
+        items = self.items(3)
+        items[2]['variant_options'] = [str(uuid.uuid4())]
+        response = self.add_to_product(product, items[1:] + [items[1]])
+        self.assertEqual(response.status_code, 400)
+        errors = response.json()['items']
+        self.assertEqual(errors[0], {})
+        self.assertIn('Unknown variant options', errors[1]['variant_options'][0])
+        self.assertEqual(errors[2]['variant_options'], ["Duplicate configuration in this payload."])
+
+        # An item duplicating a stored configuration fails the batch it is in too
+        response = self.add_to_product(product, self.items(2))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("same configuration already exists", response.json()['items'][0]['variant_options'][0])
+        self.assertEqual(response.json()['items'][1], {})
+
+        response = self.client.post('/api/product-variants/bulk-create/', {'items': self.items(1, start=5)}, format='json')
+        self.assertEqual(response.json()['items'][0]['product'], ["This field is required."])
+
+        self.assertEqual(product.items.count(), 1)
+        self.assertEqual(Product.objects.get(pk=product.pk).total_stock, 2)
+
+    def test_query_count_does_not_grow_with_items(self):
+        # Prime the taxonomy cache, which a running worker already holds
+        self.add_to_product(self.new_product("Warm-up"), self.items(1))
+
+        product = self.new_product("Oxford Shirt")
+        with self.assertNumQueries(28):
+            response = self.add_to_product(product, self.items(2))
+        self.assertEqual(response.status_code, 201)
+        product = self.new_product("Polo Shirt")
+        with self.assertNumQueries(28):
+            response = self.add_to_product(product, self.items(40))
+        self.assertEqual(len(response.json()), 40)
+
+    def test_five_thousand_items_in_bounded_queries(self):
+        product = self.new_product("Oxford Shirt")
+        with CaptureQueriesContext(connection) as context:
+            response = self.add_to_product(product, self.items(5000))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(product.items.count(), 5000)
+        self.assertEqual(ProductConfiguration.objects.filter(product_item__product=product).count(), 10000)
+        self.assertEqual(Product.objects.get(pk=product.pk).total_stock, 10000)
+        # Rows are written in batches (smaller on SQLite, which caps the parameters
+        # per statement), so queries grow by the batch, never by the item
+        self.assertLess(len(context.captured_queries), 250)
+
+
+class CursorPaginationTests(TestCase):
+    """
+    Keyset-paginated lists visit every row exactly once, in a stable order, whatever the ties
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="browser", password="browser")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        category = Category.objects.create(name="Apparel")
+        subcategory = SubCategory.objects.create(category=category, name="Shirts")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.products = [
+                Product.objects.create(name=f"Shirt {number}", subcategory=subcategory, created_by=self.user)
+                for number in range(7)
+            ]
+        # Every product created in the same instant: only the id breaks the tie
+        Product.objects.update(created_at=timezone.now())
+
+    def walk(self, path):
+        """
+        Follow next links from path to the last page, returning the ids of every page
+        """
+        pages = []
+        while path:
+            response = self.client.get(path)
+            self.assertEqual(response.status_code, 200)
+            pages.append([row['id'] for row in response.json()['results']])
+            path = response.json()['next']
+        return pages
+
+    def test_next_cursors_visit_every_row_once_despite_ties(self):
+        pages = self.walk('/api/products/?page_size=3')
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        expected = sorted((str(product.id) for product in self.products), reverse=True)
+        self.assertEqual([product_id for page in pages for product_id in page], expected)
+        # Walking again gives the same pages
+        self.assertEqual(self.walk('/api/products/?page_size=3'), pages)
+
+    def test_ledger_pages_follow_timestamp_then_id(self):
+        item = ProductVariantItem.objects.create(
+            product=self.products[0], product_code="SHIRT-0", quantity=0, price="25.00"
+        )
+        moment = timezone.now()
+        StockTransaction.objects.bulk_create([
+            StockTransaction(product_variant=item, quantity=1, transaction_type='add', timestamp=moment)
+            for _ in range(5)
+        ])
+        StockTransaction.objects.update(timestamp=moment)
+        pages = self.walk('/api/stock/?page_size=2')
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+        expected = sorted(StockTransaction.objects.values_list('id', flat=True), reverse=True)
+        self.assertEqual([row for page in pages for row in page], [str(pk) for pk in expected])
+
+    def test_page_size(self):
+        response = self.client.get('/api/products/')
+        self.assertEqual(len(response.json()['results']), 7)
+        self.assertIsNone(response.json()['next'])
+
+        request = Request(APIRequestFactory().get('/api/products/', {'page_size': 10000}))
+        self.assertEqual(CreatedAtCursorPagination().get_page_size(request), 500)
+        request = Request(APIRequestFactory().get('/api/products/'))
+        self.assertEqual(CreatedAtCursorPagination().get_page_size(request), 50)
+
+    def test_bad_cursor_is_rejected(self):
+        # Undecodable, and decodable with a position that is not a timestamp
+        for cursor in ('garbage', 'cD0yMDI2'):
+            response = self.client.get('/api/products/', {'cursor': cursor})
+            self.assertEqual(response.status_code, 404)
+            self.assertEqual(response.json(), {'detail': "Invalid cursor"})
+
+
+class ProductIdAllocationTests(TestCase):
+    """
+    product_ids come from reserved blocks, without probing the products table
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="catalogue", password="catalogue")
+        category = Category.objects.create(name="Apparel")
+        self.subcategory = SubCategory.objects.create(category=category, name="Shirts")
+
+    def test_bulk_create_assigns_unique_ids(self):
+        products = Product.objects.bulk_create([
+            Product(name=f"Shirt {i}", subcategory=self.subcategory, created_by=self.user) for i in range(250)
+        ])
+
+        product_ids = [product.product_id for product in products]
+        self.assertNotIn(None, product_ids)
+        self.assertEqual(len(set(product_ids)), len(products))
+        self.assertEqual(
+            set(Product.objects.values_list('product_id', flat=True)), set(product_ids)
+        )
+
+    def test_create_needs_no_extra_queries_within_a_block(self):
+        creates = 20
+        with CaptureQueriesContext(connection) as context:
+            for i in range(creates):
+                Product.objects.create(name=f"Shirt {i}", subcategory=self.subcategory, created_by=self.user)
+
+        # One INSERT per product, plus at most one block reservation (a nextval(), or a
+        # locked read and update of the counter row inside a savepoint) and the read
+        # of the ids already taken in that block
+        self.assertLessEqual(len(context.captured_queries), creates + 5)
+        self.assertLessEqual(len([
+            query for query in context.captured_queries if 'FROM "products"' in query['sql']
+        ]), 1)
+
+    def test_ids_in_use_are_skipped_and_ids_stay_8_digits(self):
+        # Start from a fresh block, as a new worker process would
+        with mock.patch.object(product_ids, '_blocks', {}):
+            first = product_ids.allocate()[0]
+        # Ids drawn at random before blocks were reserved, in the block after it
+        taken = set(range(first + PRODUCT_ID_BLOCK_SIZE, first + PRODUCT_ID_BLOCK_SIZE + 60, 2))
+        Product.objects.bulk_create([
+            Product(product_id=product_id, name=f"Legacy {product_id}", subcategory=self.subcategory, created_by=self.user)
+            for product_id in taken
+        ])
+
+        with mock.patch.object(product_ids, '_blocks', {}):
+            allocated = product_ids.allocate(PRODUCT_ID_BLOCK_SIZE)
+        self.assertFalse(taken & set(allocated))
+        self.assertEqual(len(set(allocated)), PRODUCT_ID_BLOCK_SIZE)
+
+        product = Product.objects.create(name="Oxford Shirt", subcategory=self.subcategory, created_by=self.user)
+        self.assertEqual(len(str(product.product_id)), 8)
+        option = VariantOption(option="Small")
+        self.assertRegex(build_product_code(product, [option]), r'^\d{8}-SMA$')
+
+
+class TaxonomyCacheTests(TestCase):
+    """
+    Taxonomy reads are served from the cache until a taxonomy row changes
+    """
+
+    def setUp(self):
+        # Test transactions roll back without sending signals, so start from an empty cache
+        taxonomy_cache.invalidate()
+        self.user = User.objects.create_user(username="forms", password="forms")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.category = Category.objects.create(name="Apparel")
+        self.subcategory = SubCategory.objects.create(category=self.category, name="Shirts")
+        self.variant = Variant.objects.create(subcategory=self.subcategory, name="Size")
+        self.option = VariantOption.objects.create(variant=self.variant, option="Small")
+
+    def test_repeated_reads_skip_the_database(self):
+        paths = [
+            '/api/categories/',
+            f'/api/categories/{self.category.id}/',
+            f'/api/sub-categories/?category={self.category.id}',
+            f'/api/variants/?subcategory={self.subcategory.id}',
+            f'/api/variant-options/?variant={self.variant.id}',
+        ]
+        first = [self.client.get(path).json() for path in paths]
+
+        with self.assertNumQueries(0):
+            second = [self.client.get(path).json() for path in paths]
+        self.assertEqual(first, second)
+
+    def test_list_keys_are_memcached_safe_and_ignore_other_params(self):
+        path = f'/api/sub-categories/?category={self.category.id}'
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always', CacheKeyWarning)
+            first = self.client.get(path + '&ref=home%20page&tags=[a,b]').json()
+        self.assertEqual([warning.category for warning in caught], [])
+
+        # Params the list does not filter on, paging included, read the same entry
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(path).json(), first)
+            self.assertEqual(len(self.client.get(path + '&page_size=1&utm=mail').json()['results']), 1)
+        self.assertEqual(self.client.get(f'/api/sub-categories/?category={uuid.uuid4()}').json()['results'], [])
+
+    def test_writes_invalidate_cached_reads(self):
+        self.client.get('/api/categories/')
+
+        response = self.client.post('/api/categories/', {'name': 'Footwear'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        names = [row['name'] for row in self.client.get('/api/categories/').json()['results']]
+        self.assertEqual(names, ['Apparel', 'Footwear'])
+
+        VariantOption.objects.filter(pk=self.option.pk).first().delete()
+        self.assertEqual(self.client.get(f'/api/variant-options/?variant={self.variant.id}').json()['results'], [])
+
+    def test_option_lookups_skip_the_database(self):
+        taxonomy_cache.variant_options()
+
+        from .serializers import get_variant_options
+        with self.assertNumQueries(0):
+            options = get_variant_options([self.option.id])
+            self.assertEqual(options[0].variant.name, "Size")
+
+    def test_options_missing_from_the_cache_are_read_from_the_database(self):
+        taxonomy_cache.variant_options()
+        # As if another worker added the option after this process filled its cache
+        large, = VariantOption.objects.bulk_create([VariantOption(variant=self.variant, option="Large")])
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(name="Oxford Shirt", subcategory=self.subcategory, created_by=self.user)
+
+        response = self.client.post('/api/product-variants/', {
+            'product': str(product.id), 'price': '9.99', 'quantity': 0,
+            'variant_options': [str(large.id), str(self.option.id)],
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        item = ProductVariantItem.objects.get(pk=response.json()['id'])
+        self.assertEqual(
+            set(item.configurations.values_list('variant_option_id', flat=True)), {large.id, self.option.id}
+        )
+        self.assertEqual(
+            item.configuration_signature, ProductVariantItem.build_configuration_signature([large.id, self.option.id])
+        )
+
+        response = self.client.post(f'/api/product-variants/add-to-product/{product.id}/', {'items': [
+            {'variant_options': [str(large.id)], 'price': '9.99'},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 201)
+
+        missing = uuid.uuid4()
+        response = self.client.post('/api/product-variants/', {
+            'product': str(product.id), 'price': '9.99', 'quantity': 0,
+            'variant_options': [str(self.option.id), str(missing)],
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['variant_options'], [f"Unknown variant options: {missing}"])
+        self.assertEqual(product.items.count(), 2)
+
+
+class ProductSearchTests(TestCase):
+    """
+    products/search matches names, HSN codes, variant codes and option values
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="searcher", password="searcher")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        category = Category.objects.create(name="Apparel")
+        subcategory = SubCategory.objects.create(category=category, name="Shirts")
+        colour = Variant.objects.create(subcategory=subcategory, name="Colour")
+        self.crimson = VariantOption.objects.create(variant=colour, option="Crimson")
+        self.navy = VariantOption.objects.create(variant=colour, option="Navy")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.oxford = Product.objects.create(
+                name="Oxford Shirt", subcategory=subcategory, created_by=self.user, hsn_code="6205"
+            )
+            self.polo = Product.objects.create(
+                name="Polo Shirt", subcategory=subcategory, created_by=self.user, hsn_code="6105"
+            )
+            response = self.client.post('/api/product-variants/', {
+                'product': str(self.oxford.id),
+                'variant_options': [str(self.crimson.id)],
+                'quantity': 3,
+                'price': '30.00',
+            }, format='json')
+            self.assertEqual(response.status_code, 201)
+            self.oxford_code = response.json()['product_code']
+
+    def search(self, query):
+        response = self.client.get('/api/products/search/', {'q': query})
+        self.assertEqual(response.status_code, 200)
+        return [row['name'] for row in response.json()['results']]
+
+    def test_matches_every_searchable_field(self):
+        self.assertEqual(self.search("oxford"), ["Oxford Shirt"])
+        self.assertEqual(self.search("6105"), ["Polo Shirt"])
+        self.assertEqual(self.search(self.oxford_code), ["Oxford Shirt"])
+        self.assertEqual(self.search("crims"), ["Oxford Shirt"])
+        self.assertEqual(set(self.search("shirt")), {"Oxford Shirt", "Polo Shirt"})
+        self.assertEqual(self.search("polo crimson"), [])
+
+    def test_search_document_follows_variant_edits(self):
+        item = self.oxford.items.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(
+                f'/api/product-variants/{item.id}/', {'variant_options': [str(self.navy.id)]}, format='json'
+            )
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(self.search("navy"), ["Oxford Shirt"])
+        self.assertEqual(self.search("crimson"), [])
+
+    def test_query_is_required(self):
+        response = self.client.get('/api/products/search/', {'q': '  '})
+        self.assertEqual(response.status_code, 400)
+
+    def test_typos_match_when_trigrams_are_available(self):
+        if connection.vendor != 'postgresql' or not has_trigram_support(connection.alias):
+            self.skipTest("pg_trgm is not installed")
+        self.assertEqual(self.search("oxfrod"), ["Oxford Shirt"])
+
+
+class VariantListingTests(TestCase):
+    """
+    The variant_listings read model renders exactly what the normalised tables do
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="lister", password="lister")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.category = Category.objects.create(name="Apparel")
+        subcategory = SubCategory.objects.create(category=self.category, name="Shirts")
+        size = Variant.objects.create(subcategory=subcategory, name="Size")
+        colour = Variant.objects.create(subcategory=subcategory, name="Colour")
+        self.small = VariantOption.objects.create(variant=size, option="Small")
+        self.red = VariantOption.objects.create(variant=colour, option="Red")
+        self.product = Product.objects.create(name="Oxford Shirt", subcategory=subcategory, created_by=self.user)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/product-variants/', {
+                'product': str(self.product.id),
+                'variant_options': [str(self.small.id), str(self.red.id)],
+                'quantity': 8,
+                'price': '30.00',
+            }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.item = ProductVariantItem.objects.get(pk=response.json()['id'])
+
+    def normalised(self):
+        serializer = ProductVariantItemSerializer(
+            ProductVariantItem.objects.with_details().get(pk=self.item.pk)
+        )
+        row = serializer.data
+        row['configurations'] = sorted(row['configurations'], key=lambda c: c['id'])
+        return json.loads(json.dumps(row, cls=DjangoJSONEncoder))
+
+    def listed(self):
+        rows = self.client.get('/api/product-variants/').json()['results']
+        self.assertEqual(len(rows), 1)
+        rows[0]['configurations'] = sorted(rows[0]['configurations'], key=lambda c: c['id'])
+        return rows[0]
+
+    def test_listing_matches_normalised_rendering(self):
+        self.assertEqual(self.listed(), self.normalised())
+        by_product = self.client.get(f'/api/product-variants/by-product/{self.product.id}/').json()
+        self.assertEqual(by_product[0]['product_code'], self.item.product_code)
+
+    def test_stock_movements_update_listed_quantity(self):
+        response = self.client.post(
+            '/api/stock/remove-stock/', {'product_variant_id': str(self.item.id), 'quantity': 3}, format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.listed()['quantity'], 5)
+
+        response = self.client.post('/api/stock/bulk-movements/', {
+            'lines': [{'product_variant_id': str(self.item.id), 'transaction_type': 'add', 'quantity': 4}]
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.listed()['quantity'], 9)
+
+    def test_renames_propagate_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.red.option = "Crimson"
+            self.red.save()
+            self.category.name = "Clothing"
+            self.category.save()
+
+        self.assertEqual(self.listed(), self.normalised())
+        self.assertEqual(self.listed()['subcategory'], "Clothing - Shirts")
+
+    def test_deleting_a_variant_removes_its_listing(self):
+        response = self.client.delete(f'/api/product-variants/{self.item.id}/')
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(VariantListing.objects.exists())
+
+
+class ExportTests(TestCase):
+    """
+    Exports stream every matching row in one query, whatever the row count
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="auditor", password="auditor")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.variant = create_catalogue(self.user)
+        VariantListing.refresh([self.variant.pk])
+        StockTransaction.objects.bulk_create([
+            StockTransaction(product_variant=self.variant, quantity=i, transaction_type='add', user=self.user)
+            for i in range(1, 121)
+        ])
+        # Back-date half of the ledger so it falls outside the exported range
+        old = list(StockTransaction.objects.filter(quantity__lte=60))
+        for stock_transaction in old:
+            stock_transaction.timestamp = timezone.now() - timedelta(days=40)
+        StockTransaction.objects.bulk_update(old, ['timestamp'])
+
+    def export(self, path, params):
+        response = self.client.get(path, params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        with self.assertNumQueries(1):
+            return b"".join(response.streaming_content).decode()
+
+    def test_ledger_csv_is_filtered_by_date_range(self):
+        body = self.export('/api/stock/export/', {
+            'output': 'csv',
+            'start_date': (timezone.now() - timedelta(days=7)).date().isoformat(),
+            'end_date': timezone.now().date().isoformat(),
+        })
+
+        rows = list(csv.DictReader(io.StringIO(body)))
+        self.assertEqual(len(rows), 60)
+        self.assertEqual(sorted(int(row['quantity']) for row in rows), list(range(61, 121)))
+        self.assertEqual(rows[0]['product_code'], self.variant.product_code)
+        self.assertEqual(rows[0]['user'], "auditor")
+
+    def test_ndjson_exports(self):
+        ledger = [json.loads(line) for line in self.export('/api/stock/export/', {'output': 'ndjson'}).splitlines()]
+        self.assertEqual(len(ledger), 120)
+        self.assertEqual(ledger[0]['product_variant_id'], str(self.variant.pk))
+
+        products = self.export('/api/products/export/', {'output': 'ndjson'}).splitlines()
+        self.assertEqual(json.loads(products[0])['name'], "Oxford Shirt")
+
+        variants = list(csv.DictReader(io.StringIO(self.export('/api/product-variants/export/', {}))))
+        self.assertEqual([row['product_code'] for row in variants], [self.variant.product_code])
+
+    def test_rejects_bad_parameters(self):
+        for params in ({'output': 'xml'}, {'start_date': 'last week'}, {'product_variant': 'nope'}):
+            response = self.client.get('/api/stock/export/', params)
+            self.assertEqual(response.status_code, 400, params)
+
+
+class ImportCatalogueTests(TestCase):
+    """
+    import_catalogue loads a CSV catalogue in chunks and can resume from its checkpoint
+    """
+    headers = ['category', 'subcategory', 'product_name', 'hsn_code', 'quantity', 'price', 'option:Size', 'option:Colour']
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="importer", password="importer")
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, "catalogue.csv")
+
+    def write_catalogue(self, rows):
+        with open(self.path, 'w', newline='') as catalogue:
+            writer = csv.writer(catalogue)
+            writer.writerow(self.headers)
+            writer.writerows(rows)
+
+    def import_catalogue(self, *args):
+        stdout, stderr = io.StringIO(), io.StringIO()
+        call_command('import_catalogue', self.path, '--user', 'importer', *args, stdout=stdout, stderr=stderr)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def test_imports_taxonomy_products_and_variants(self):
+        self.write_catalogue(
+            [['Apparel', 'Shirts', f'Shirt {n}', '6205', n, '19.99', size, 'Red']
+             for n in range(10) for size in ('S', 'M', 'L')]
+            + [['Apparel', 'Shirts', 'Shirt 0', '6205', 1, '19.99', 'S', 'Red'],
+               ['Apparel', 'Shirts', 'Shirt 0', '6205', 'many', '19.99', 'XL', 'Red']]
+        )
+
+        stdout, stderr = self.import_catalogue('--chunk-size', '7')
+
+        self.assertIn("created 10 products and 30 variants, skipped 2 rows", stdout)
+        self.assertIn("Row 31: Shirt 0 already has this configuration", stderr)
+        self.assertIn("Row 32: quantity must be an integer", stderr)
+        self.assertEqual(Category.objects.get().subcategories.get().variants.count(), 2)
+        self.assertEqual(VariantOption.objects.count(), 4)
+        shirt = Product.objects.get(name='Shirt 4')
+        self.assertIsNotNone(shirt.product_id)
+        self.assertEqual(shirt.total_stock, 12)
+        self.assertEqual(
+            set(shirt.items.values_list('product_code', flat=True)),
+            {f"{shirt.product_id}-S-RED", f"{shirt.product_id}-M-RED", f"{shirt.product_id}-L-RED"}
+        )
+        self.assertEqual(ProductConfiguration.objects.count(), 60)
+        self.assertFalse(os.path.exists(f"{self.path}.checkpoint"))
+
+    def test_chunk_queries_do_not_grow_with_new_products(self):
+        self.write_catalogue([['Apparel', 'Shirts', 'Shirt', '', 1, '10.00', 'M', 'Blue']])
+        self.import_catalogue()
+
+        queries = []
+        for count in (5, 50):
+            self.write_catalogue(
+                [['Apparel', 'Shirts', f'Shirt {count}-{n}', '', 1, '10.00', 'M', 'Blue'] for n in range(count)]
+            )
+            # Start each run without a reserved block, so both reserve exactly one
+            with mock.patch.object(product_ids, '_blocks', {}), CaptureQueriesContext(connection) as context:
+                self.import_catalogue()
+            queries.append(len(context.captured_queries))
+        self.assertEqual(queries[0], queries[1])
+        self.assertEqual(Product.objects.count(), 56)
+
+    def test_resumes_after_the_checkpointed_rows(self):
+        self.write_catalogue([['Apparel', 'Shirts', f'Shirt {n}', '', 1, '10.00', 'M', 'Blue'] for n in range(20)])
+        # A previous run committed the first 15 rows before stopping
+        with open(f"{self.path}.checkpoint", 'w') as checkpoint:
+            json.dump({'source': {'path': os.path.abspath(self.path), 'size': os.path.getsize(self.path)}, 'rows': 15}, checkpoint)
+
+        stdout, _ = self.import_catalogue('--resume')
+
+        self.assertIn("Resuming after row 15", stdout)
+        self.assertEqual(
+            sorted(Product.objects.values_list('name', flat=True)), [f'Shirt {n}' for n in range(15, 20)]
+        )
+
+
+class StockSnapshotTests(TestCase):
+    """
+    Point-in-time stock answered from snapshots matches a full replay of the ledger
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="auditor", password="auditor")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        # Opening stock is set on the variant, not recorded in the ledger
+        with self.captureOnCommitCallbacks(execute=True):
+            self.item = create_catalogue(self.user, quantity=10)
+        self.today = timezone.localdate()
+        ProductVariantItem.objects.filter(pk=self.item.pk).update(created_at=self.at(7))
+        for days_ago, transaction_type, quantity in [
+            (5, 'add', 5), (5, 'remove', 2), (3, 'adjustment', -4), (2, 'add', 7), (0, 'remove', 1),
+        ]:
+            self.move(transaction_type, quantity, self.at(days_ago, hours=10))
+
+    def at(self, days_ago, hours=0):
+        return day_start(self.today - timedelta(days=days_ago)) + timedelta(hours=hours)
+
+    def move(self, transaction_type, quantity, timestamp):
+        stock_transaction = StockTransaction.objects.create(
+            product_variant=self.item, transaction_type=transaction_type, quantity=quantity, user=self.user
+        )
+        # timestamp is auto_now_add, so backdate the row afterwards
+        StockTransaction.objects.filter(pk=stock_transaction.pk).update(timestamp=timestamp)
+
+    def replayed(self, moment):
+        later = StockTransaction.objects.filter(timestamp__gte=moment).net_quantities()
+        return ProductVariantItem.objects.get(pk=self.item.pk).quantity - later.get(self.item.pk, 0)
+
+    def assert_matches_ledger(self):
+        for days_ago in range(7):
+            for hours in (0, 9, 11):
+                moment = self.at(days_ago, hours)
+                self.assertEqual(
+                    StockSnapshot.quantities_as_of([self.item.pk], moment), {self.item.pk: self.replayed(moment)}
+                )
+
+    def test_as_of_matches_ledger_replay(self):
+        self.assert_matches_ledger()
+        self.assertEqual(StockSnapshot.build(), 3)
+        self.assertEqual(
+            list(StockSnapshot.objects.order_by('date').values_list('quantity', flat=True)), [13, 9, 16]
+        )
+        self.assert_matches_ledger()
+
+    def test_variants_created_later_are_left_out(self):
+        later = ProductVariantItem.objects.create(
+            product=self.item.product, product_code="LATER", quantity=6, price="10.00"
+        )
+        ProductVariantItem.objects.filter(pk=later.pk).update(created_at=self.at(2))
+        StockSnapshot.build()
+
+        for batch_size in (1, 1000):
+            self.assertEqual(
+                StockSnapshot.quantities_as_of([self.item.pk, later.pk], self.at(3), batch_size=batch_size),
+                {self.item.pk: self.replayed(self.at(3))}
+            )
+            self.assertEqual(
+                StockSnapshot.quantities_as_of([self.item.pk, later.pk], self.at(1), batch_size=batch_size),
+                {self.item.pk: self.replayed(self.at(1)), later.pk: 6}
+            )
+        product = self.client.get(f'/api/products/{self.item.product_id}/', {'as_of': self.at(3).isoformat()}).json()
+        self.assertEqual(product['total_stock'], self.replayed(self.at(3)))
+
+    def test_builds_are_incremental(self):
+        StockSnapshot.build(through=self.today - timedelta(days=4))
+        self.assertEqual(StockSnapshot.objects.count(), 1)
+        self.move('remove', 3, self.at(1, hours=12))
+        self.assertEqual(StockSnapshot.build(), 3)
+        self.assertEqual(StockSnapshot.build(), 0)
+        self.assertEqual(
+            list(StockSnapshot.objects.order_by('date').values_list('quantity', flat=True)), [13, 9, 16, 13]
+        )
+        self.assert_matches_ledger()
+
+    def test_as_of_parameter(self):
+        call_command('build_stock_snapshots', stdout=io.StringIO())
+        as_of = (self.today - timedelta(days=3)).isoformat()
+
+        rows = self.client.get('/api/product-variants/', {'as_of': as_of}).json()['results']
+        self.assertEqual(rows[0]['quantity'], 9)
+        row = self.client.get(f'/api/product-variants/{self.item.pk}/', {'as_of': as_of}).json()
+        self.assertEqual(row['quantity'], 9)
+        product = self.client.get(f'/api/products/{self.item.product_id}/', {'as_of': as_of}).json()
+        self.assertEqual(product['total_stock'], 9)
+        self.assertEqual(self.client.get(f'/api/products/{self.item.product_id}/').json()['total_stock'], 15)
+
+        response = self.client.get('/api/product-variants/', {'as_of': 'last tuesday'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('error', response.json())
+
+
+class StockValuationTests(TestCase):
+    """
+    FIFO and weighted-average valuations from cost checkpoints match a full replay of the ledger
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="accountant", password="accountant")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        # Opening stock: 10 units at the variant's price of 25.00
+        with self.captureOnCommitCallbacks(execute=True):
+            self.item = create_catalogue(self.user, quantity=10)
+        self.today = timezone.localdate()
+        # Today's removal is stamped at midnight, so it is in the past whenever the tests run
+        for days_ago, hours, transaction_type, quantity, unit_cost in [
+            (5, 10, 'add', 10, "30.00"), (4, 10, 'remove', 15, None), (2, 10, 'add', 5, "40.00"),
+            (0, 0, 'remove', 2, None),
+        ]:
+            self.move(transaction_type, quantity, unit_cost, self.at(days_ago, hours))
+
+    def at(self, days_ago, hours=0):
+        return day_start(self.today - timedelta(days=days_ago)) + timedelta(hours=hours)
+
+    def move(self, transaction_type, quantity, unit_cost, timestamp):
+        stock_transaction = StockTransaction.objects.create(
+            product_variant=self.item, transaction_type=transaction_type, quantity=quantity,
+            unit_cost=unit_cost, user=self.user
+        )
+        StockTransaction.objects.filter(pk=stock_transaction.pk).update(timestamp=timestamp)
+
+    def valued(self, moment=None):
+        state = value_inventory(ProductVariantItem.objects.filter(pk=self.item.pk), as_of=moment)[self.item.pk]
+        return state.quantity, str(state.fifo_value), str(state.average_value)
+
+    def valuations(self):
+        return [self.valued(self.at(days_ago, hours)) for days_ago in range(7) for hours in (0, 11)]
+
+    def test_fifo_and_weighted_average(self):
+        self.assertEqual(self.valued(), (8, "290.00", "270.00"))
+        self.assertEqual(self.valued(self.at(3)), (5, "150.00", "137.50"))
+        self.assertEqual(self.valued(self.at(6)), (10, "250.00", "250.00"))
+        self.assertEqual(
+            list(StockTransaction.objects.order_by('timestamp').values_list('unit_cost', flat=True)),
+            [Decimal("30.0000"), None, Decimal("40.0000"), None]
+        )
+
+    def test_checkpoints_match_full_replay(self):
+        replayed = self.valuations()
+        self.assertEqual(build_checkpoints(through=self.today - timedelta(days=5)), 1)
+        self.assertEqual(self.valuations(), replayed)
+        self.assertEqual(build_checkpoints(), 2)
+        self.assertEqual(build_checkpoints(), 0)
+        self.assertEqual(
+            list(CostLayerCheckpoint.objects.order_by('date').values_list('quantity', 'fifo_layers', 'average_cost')),
+            [
+                (20, [[10, "25.00"], [10, "30.0000"]], Decimal("27.5000")),
+                (5, [[5, "30.0000"]], Decimal("27.5000")),
+                (10, [[5, "30.0000"], [5, "40.0000"]], Decimal("33.7500")),
+            ]
+        )
+        self.assertEqual(self.valuations(), replayed)
+
+        # Only the transactions after the latest checkpoint are replayed
+        with self.assertNumQueries(4):
+            self.assertEqual(self.valued(), (8, "290.00", "270.00"))
+
+    def test_ledger_is_read_in_batches_of_variants(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            other = ProductVariantItem.objects.create(
+                product=self.item.product, product_code="OTHER", quantity=4, price="10.00"
+            )
+            StockTransaction.objects.create(product_variant=other, transaction_type='add', quantity=2, unit_cost="12.00")
+        # One variant resumes from a checkpoint, the other replays its whole ledger
+        build_checkpoints(through=self.today - timedelta(days=3))
+
+        def totals(states):
+            return {pk: (state.quantity, state.fifo_value, state.average_value) for pk, state in states.items()}
+        whole = totals(value_inventory())
+        with CaptureQueriesContext(connection) as context:
+            batched = totals(value_inventory(batch_size=1))
+        self.assertEqual(batched, whole)
+        self.assertEqual(whole[other.pk], (6, Decimal("64.00"), Decimal("64.00")))
+        ledger_reads = [
+            query for query in context.captured_queries if 'ORDER BY "stock_transactions"."timestamp"' in query['sql']
+        ]
+        self.assertEqual(len(ledger_reads), 2)
+
+    def test_receipts_default_to_price(self):
+        state = CostLayers.opening(2, Decimal("10.00"))
+        state.apply('adjustment', 2, Decimal("20.00"))
+        state.apply('remove', 5, None)
+        self.assertEqual((state.quantity, state.fifo_value, state.average_value), (-1, Decimal("0.00"), Decimal("0.00")))
+        state.apply('add', 3, Decimal("12.00"))
+        self.assertEqual((state.quantity, state.fifo_value, state.average_value), (2, Decimal("24.00"), Decimal("24.00")))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/stock/bulk-movements/', {'lines': [
+                {'product_variant_id': str(self.item.pk), 'transaction_type': 'add', 'quantity': 1},
+                {'product_variant_id': str(self.item.pk), 'transaction_type': 'add', 'quantity': 1, 'unit_cost': '12.5'},
+            ]}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            sorted(StockTransaction.objects.order_by('-timestamp').values_list('unit_cost', flat=True)[:2]),
+            [Decimal("12.5000"), Decimal("25.0000")]
+        )
+        response = self.client.post('/api/stock/bulk-movements/', {'lines': [
+            {'product_variant_id': str(self.item.pk), 'transaction_type': 'remove', 'quantity': 1, 'unit_cost': '1'},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/api/stock/add-stock/', {
+            'product_variant_id': str(self.item.pk), 'quantity': 1, 'unit_cost': 'cheap'
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_only_receipts_take_a_unit_cost(self):
+        for transaction_type, quantity in (('remove', 1), ('adjustment', -1)):
+            response = self.client.post('/api/stock/', {
+                'product_variant': str(self.item.pk), 'transaction_type': transaction_type,
+                'quantity': quantity, 'unit_cost': '5.00',
+            }, format='json')
+            self.assertEqual(response.status_code, 400, transaction_type)
+            self.assertEqual(response.json(), {'unit_cost': ["Only receipts carry a unit cost."]})
+
+        response = self.client.post('/api/stock/', {
+            'product_variant': str(self.item.pk), 'transaction_type': 'adjustment', 'quantity': 1, 'unit_cost': '5.00',
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+
+    def test_valuation_endpoint(self):
+        call_command('build_cost_checkpoints', stdout=io.StringIO())
+        response = self.client.get('/api/stock/valuation/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            {key: value for key, value in response.json().items() if key != 'as_of'},
+            {
+                'quantity': 8, 'fifo_value': '290.00', 'average_value': '270.00',
+                'results': [{
+                    'category': str(self.item.product.subcategory.category_id), 'name': "Apparel",
+                    'quantity': 8, 'fifo_value': '290.00', 'average_value': '270.00',
+                }],
+            }
+        )
+
+        response = self.client.get('/api/stock/valuation/', {
+            'group_by': 'variant', 'as_of': (self.today - timedelta(days=3)).isoformat()
+        })
+        self.assertEqual(response.json()['results'], [{
+            'product_variant': str(self.item.pk), 'product_code': self.item.product_code,
+            'quantity': 5, 'average_cost': '27.5000', 'fifo_value': '150.00', 'average_value': '137.50',
+        }])
+
+        for params in ({'group_by': 'product'}, {'as_of': 'soon'}, {'category': 'all'}):
+            response = self.client.get('/api/stock/valuation/', params)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('error', response.json())
+
+    def test_benchmark_valuations_agree(self):
+        benchmarks.seed_catalogue(self.user, products=10, variants_per_product=3, transactions=400)
+        timings, replayed, checkpointed = benchmarks.time_valuation(days=20)
+        self.assertEqual(timings['transactions'], 405)
+        self.assertGreater(timings['checkpoints'], 0)
+        self.assertEqual(checkpointed, replayed)
+
+
+class IdempotencyKeyTests(TestCase):
+    """
+    A stock write retried with the same Idempotency-Key is applied once and answered with the first response
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="clerk", password="clerk")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.item = create_catalogue(self.user, quantity=10)
+
+    def post(self, path, data, key):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(path, data, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def quantity(self):
+        return ProductVariantItem.objects.values_list('quantity', flat=True).get(pk=self.item.pk)
+
+    def test_retry_replays_the_first_response(self):
+        data = {'product_variant_id': str(self.item.id), 'quantity': 3}
+        first = self.post('/api/stock/remove-stock/', data, 'retry-1')
+        self.assertEqual(first.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', first.headers)
+
+        with self.assertNumQueries(1):
+            retry = self.post('/api/stock/remove-stock/', data, 'retry-1')
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry.headers['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(self.quantity(), 7)
+        self.assertEqual(StockTransaction.objects.count(), 1)
+
+        record = IdempotencyKey.objects.get(user=self.user, key='retry-1')
+        self.assertEqual(record.transaction_ids, [first.json()['id']])
+
+        # Keys are scoped per user
+        other = User.objects.create_user(username="other", password="other")
+        self.client.force_authenticate(other)
+        self.assertEqual(self.post('/api/stock/remove-stock/', data, 'retry-1').status_code, 201)
+        self.assertEqual(self.quantity(), 4)
+
+    def test_key_reused_for_a_different_request_is_rejected(self):
+        self.post('/api/stock/add-stock/', {'product_variant_id': str(self.item.id), 'quantity': 3}, 'reused')
+        response = self.post('/api/stock/add-stock/', {'product_variant_id': str(self.item.id), 'quantity': 4}, 'reused')
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(self.quantity(), 13)
+
+        response = self.post('/api/stock/add-stock/', {'quantity': 4}, 'x' * 256)
+        self.assertEqual(response.status_code, 400)
+
+    def test_client_errors_are_stored_and_server_errors_are_not(self):
+        data = {'product_variant_id': str(self.item.id), 'quantity': 30}
+        self.assertEqual(self.post('/api/stock/remove-stock/', data, 'too-many').status_code, 400)
+        retry = self.post('/api/stock/remove-stock/', data, 'too-many')
+        self.assertEqual(retry.status_code, 400)
+        self.assertEqual(retry.headers['Idempotent-Replayed'], 'true')
+        self.assertEqual(IdempotencyKey.objects.get(key='too-many').transaction_ids, [])
+
+        # A malformed variant id fails in the database and answers 500; the key is released
+        data = {'product_variant_id': 'not-a-uuid', 'quantity': 1}
+        self.assertEqual(self.post('/api/stock/add-stock/', data, 'broken').status_code, 500)
+        self.assertFalse(IdempotencyKey.objects.filter(key='broken').exists())
+
+    def test_adjustments_and_batches(self):
+        path = f'/api/product-variants/{self.item.id}/adjust-stock/'
+        for attempt in range(2):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.put(path, {'quantity_change': -2}, format='json', HTTP_IDEMPOTENCY_KEY='adjust')
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.quantity(), 8)
+
+        data = {'lines': [
+            {'product_variant_id': str(self.item.id), 'transaction_type': 'add', 'quantity': 4},
+            {'product_variant_id': str(self.item.id), 'transaction_type': 'remove', 'quantity': 1},
+        ]}
+        first = self.post('/api/stock/bulk-movements/', data, 'batch')
+        retry = self.post('/api/stock/bulk-movements/', data, 'batch')
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(self.quantity(), 11)
+        self.assertEqual(
+            sorted(IdempotencyKey.objects.get(key='batch').transaction_ids),
+            sorted(line['transaction_id'] for line in first.json()['results'])
+        )
+        self.assertEqual(StockTransaction.objects.count(), 3)
+
+    def test_expired_keys_are_rerun_and_pruned(self):
+        data = {'product_variant_id': str(self.item.id), 'quantity': 1}
+        self.post('/api/stock/add-stock/', data, 'old')
+        self.post('/api/stock/add-stock/', data, 'fresh')
+        IdempotencyKey.objects.filter(key='old').update(created_at=timezone.now() - timedelta(days=2))
+
+        out = io.StringIO()
+        call_command('prune_idempotency_keys', dry_run=True, stdout=out)
+        self.assertIn("1 idempotency keys", out.getvalue())
+        call_command('prune_idempotency_keys', batch_size=1, stdout=out)
+        self.assertEqual(list(IdempotencyKey.objects.values_list('key', flat=True)), ['fresh'])
+
+        IdempotencyKey.objects.filter(key='fresh').update(created_at=timezone.now() - timedelta(days=2))
+        response = self.post('/api/stock/add-stock/', data, 'fresh')
+        self.assertNotIn('Idempotent-Replayed', response.headers)
+        self.assertEqual(self.quantity(), 13)
+
+
+class StockReservationTests(TestCase):
+    """
+    Reserved units cannot be removed by anyone else, and leave stock only when their hold is committed
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="picker", password="picker")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.item = create_catalogue(self.user, quantity=10)
+            self.other = ProductVariantItem.objects.create(
+                product=self.item.product, product_code="OTHER", quantity=3, price="10.00"
+            )
+            Product.apply_stock_delta(self.item.product_id, 3)
+
+    def post(self, path, data):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(path, data, format='json')
+
+    def reserve(self, *lines, **options):
+        return self.post('/api/reservations/reserve/', {'lines': [
+            {'product_variant_id': str(variant.id), 'quantity': quantity} for variant, quantity in lines
+        ], **options})
+
+    def stock(self, variant):
+        return ProductVariantItem.objects.values_list('quantity', 'reserved_quantity').get(pk=variant.pk)
+
+    def test_reserved_units_cannot_be_removed_until_committed(self):
+        response = self.reserve((self.item, 4), (self.item, 2), (self.other, 3), reference_number="SO-1")
+        self.assertEqual(response.status_code, 201)
+        results = response.json()['results']
+        self.assertEqual([line['available'] for line in results], [4, 4, 0])
+        self.assertEqual(self.stock(self.item), (10, 6))
+
+        # Only the 4 unreserved units can be taken, by single and bulk removals alike
+        remove = {'product_variant_id': str(self.item.id), 'quantity': 5}
+        self.assertEqual(self.post('/api/stock/remove-stock/', remove).status_code, 400)
+        response = self.post('/api/stock/bulk-movements/', {'lines': [
+            {'product_variant_id': str(self.other.id), 'transaction_type': 'remove', 'quantity': 1}
+        ]})
+        self.assertEqual(response.json()['results'][0]['error'], "Insufficient stock")
+        response = self.client.put(
+            f'/api/product-variants/{self.item.id}/adjust-stock/', {'quantity_change': -5}, format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.post('/api/stock/remove-stock/', dict(remove, quantity=4)).status_code, 201)
+        self.assertEqual(self.stock(self.item), (6, 6))
+
+        ids = [line['reservation_id'] for line in results]
+        response = self.post('/api/reservations/commit/', {'reservation_ids': ids})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.stock(self.item), (0, 0))
+        self.assertEqual(self.stock(self.other), (0, 0))
+        self.assertEqual(Product.objects.get(pk=self.item.product_id).total_stock, 0)
+
+        committed = StockReservation.objects.order_by('quantity')
+        self.assertEqual({reservation.status for reservation in committed}, {'committed'})
+        removals = StockTransaction.objects.filter(pk__in=[r.transaction_id for r in committed])
+        self.assertEqual(sorted(removals.values_list('quantity', flat=True)), [2, 3, 4])
+        self.assertEqual(set(removals.values_list('reference_number', flat=True)), {"SO-1"})
+
+        # A reservation is closed only once
+        response = self.post('/api/reservations/commit/', {'reservation_ids': ids[:1]})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['results'][0]['status'], 'rejected')
+
+    def test_batches_are_all_or_nothing_by_default(self):
+        response = self.reserve((self.item, 4), (self.other, 4))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            [line['status'] for line in response.json()['results']], ['not_reserved', 'rejected']
+        )
+        self.assertFalse(StockReservation.objects.exists())
+        self.assertEqual(self.stock(self.item), (10, 0))
+
+        response = self.reserve((self.item, 4), (self.other, 4), all_or_nothing=False)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([line['status'] for line in response.json()['results']], ['reserved', 'rejected'])
+        self.assertEqual(self.stock(self.item), (10, 4))
+
+    def test_availability_is_checked_in_one_round_trip(self):
+        variants = [
+            ProductVariantItem.objects.create(
+                product=self.item.product, product_code=f"LINE-{number}", quantity=5, price="10.00"
+            )
+            for number in range(20)
+        ]
+        with CaptureQueriesContext(connection) as one_line:
+            StockReservation.reserve([(variants[0].pk, 1)], expires_at=timezone.now() + timedelta(minutes=5))
+        with CaptureQueriesContext(connection) as many_lines:
+            StockReservation.reserve(
+                [(variant.pk, 2) for variant in variants], expires_at=timezone.now() + timedelta(minutes=5)
+            )
+        self.assertEqual(len(many_lines), len(one_line))
+        self.assertEqual(sum(query['sql'].startswith('SELECT') for query in many_lines.captured_queries), 1)
+
+    def test_release_and_expiry(self):
+        first, second = [line['reservation_id'] for line in self.reserve(
+            (self.item, 4), (self.item, 3), ttl_seconds=60
+        ).json()['results']]
+
+        response = self.post('/api/reservations/release/', {'reservation_ids': [first]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.stock(self.item), (10, 3))
+        listed = self.client.get('/api/reservations/?status=active').json()['results']
+        self.assertEqual([reservation['id'] for reservation in listed], [second])
+
+        StockReservation.objects.filter(pk=second).update(expires_at=timezone.now() - timedelta(seconds=1))
+        response = self.post('/api/reservations/commit/', {'reservation_ids': [second]})
+        self.assertEqual(response.json()['results'][0]['error'], "Reservation has expired")
+
+        out = io.StringIO()
+        call_command('expire_stock_reservations', dry_run=True, stdout=out)
+        self.assertIn("1 reservations would be expired", out.getvalue())
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('expire_stock_reservations', batch_size=1, stdout=out)
+        self.assertIn("Expired 1 reservations", out.getvalue())
+        self.assertEqual(StockReservation.objects.get(pk=second).status, 'expired')
+        self.assertEqual(self.stock(self.item), (10, 0))
+
+    def test_editing_a_variant_keeps_its_holds(self):
+        self.reserve((self.item, 4))
+        response = self.client.patch(
+            f'/api/product-variants/{self.item.id}/', {'price': "30.00", 'quantity': 12}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.stock(self.item), (12, 4))
+
+
+class LocationTests(TestCase):
+    """
+    Stock is held per location; the variant's quantity is the sum over its locations
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="keeper", password="keeper")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.item = create_catalogue(self.user, quantity=10)
+        self.main = Location.objects.get(is_default=True)
+        self.store = Location.objects.create(name="High street store", code="STORE")
+
+    def post(self, path, data):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(path, data, format='json')
+
+    def stock(self):
+        """
+        The variant's quantity, its product's total and its stock at each location, by code
+        """
+        self.item.refresh_from_db(fields=['quantity'])
+        return (
+            self.item.quantity,
+            Product.objects.get(pk=self.item.product_id).total_stock,
+            dict(LocationStock.objects.filter(product_variant=self.item).values_list('location__code', 'quantity')),
+        )
+
+    def transfer(self, quantity, source, destination):
+        return self.post('/api/stock/transfer-stock/', {
+            'product_variant_id': str(self.item.id), 'quantity': quantity,
+            'source_location_id': str(source.pk), 'destination_location_id': str(destination.pk),
+        })
+
+    def test_new_variants_are_stocked_at_the_default_location(self):
+        self.assertEqual(self.stock(), (10, 10, {'MAIN': 10}))
+
+    def test_movements_are_booked_at_their_location(self):
+        response = self.post('/api/stock/add-stock/', {
+            'product_variant_id': str(self.item.id), 'quantity': 5, 'location_id': str(self.store.pk)
+        })
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['destination_location'], str(self.store.pk))
+        self.post('/api/stock/remove-stock/', {'product_variant_id': str(self.item.id), 'quantity': 3})
+        self.assertEqual(self.stock(), (12, 12, {'MAIN': 7, 'STORE': 5}))
+
+        # The variant holds enough, but not at the store
+        response = self.post('/api/stock/remove-stock/', {
+            'product_variant_id': str(self.item.id), 'quantity': 6, 'location_id': str(self.store.pk)
+        })
+        self.assertEqual(response.status_code, 400)
+        response = self.client.put(f'/api/product-variants/{self.item.id}/adjust-stock/', {
+            'quantity_change': -5, 'location_id': str(self.store.pk)
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.stock(), (7, 7, {'MAIN': 7, 'STORE': 0}))
+
+        response = self.post('/api/stock/add-stock/', {
+            'product_variant_id': str(self.item.id), 'quantity': 1, 'location_id': str(uuid.uuid4())
+        })
+        self.assertEqual(response.status_code, 400)
+
+    def test_transfers_move_stock_between_locations_only(self):
+        response = self.transfer(4, self.main, self.store)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['transaction_type'], 'transfer')
+        self.assertEqual(self.stock(), (10, 10, {'MAIN': 6, 'STORE': 4}))
+
+        self.assertEqual(self.transfer(5, self.store, self.main).status_code, 400)
+        self.assertEqual(self.transfer(1, self.store, self.store).status_code, 400)
+        self.assertEqual(self.stock(), (10, 10, {'MAIN': 6, 'STORE': 4}))
+
+        # A transfer moves units, not value, and no units in or out of the business
+        state = value_inventory()[self.item.pk]
+        self.assertEqual((state.quantity, state.fifo_value), (10, Decimal(self.item.price) * 10))
+        movements = DailyStockMovement.objects.get(date=timezone.localdate())
+        self.assertEqual((movements.movements, movements.units_in, movements.units_out), (1, 0, 0))
+
+        response = self.client.get(f'/api/stock/export/?output=csv&location={self.store.pk}')
+        rows = list(csv.DictReader(io.StringIO(b"".join(response.streaming_content).decode())))
+        self.assertEqual([(row['source_location'], row['destination_location']) for row in rows], [('MAIN', 'STORE')])
+
+    def test_bulk_movements_check_stock_per_location(self):
+        transfer = {
+            'product_variant_id': str(self.item.id), 'transaction_type': 'transfer', 'quantity': 6,
+            'source_location_id': str(self.main.pk), 'destination_location_id': str(self.store.pk),
+        }
+        removal = {
+            'product_variant_id': str(self.item.id), 'transaction_type': 'remove', 'quantity': 7,
+            'source_location_id': str(self.store.pk),
+        }
+        response = self.post('/api/stock/bulk-movements/', {'lines': [transfer, removal, dict(removal, quantity=2)]})
+        self.assertEqual(response.status_code, 201)
+        results = response.json()['results']
+        self.assertEqual([line['status'] for line in results], ['applied', 'rejected', 'applied'])
+        self.assertEqual(results[1]['error'], "Insufficient stock at this location")
+        self.assertEqual(self.stock(), (8, 8, {'MAIN': 4, 'STORE': 4}))
+
+        response = self.post('/api/stock/bulk-movements/', {'lines': [
+            dict(removal, quantity=1), dict(removal, quantity=1, source_location_id=str(uuid.uuid4())),
+        ]})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['lines'][1], {'source_location_id': ["Location not found."]})
+
+    def test_reservations_are_committed_from_a_location(self):
+        self.transfer(4, self.main, self.store)
+        response = self.post('/api/reservations/reserve/', {
+            'lines': [{'product_variant_id': str(self.item.id), 'quantity': 3}]
+        })
+        reservation_id = response.json()['results'][0]['reservation_id']
+        response = self.post('/api/reservations/commit/', {
+            'reservation_ids': [reservation_id], 'location': str(self.store.pk)
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.stock(), (7, 7, {'MAIN': 6, 'STORE': 1}))
+
+    def test_location_endpoints(self):
+        self.transfer(4, self.main, self.store)
+        response = self.client.get(f'/api/product-variants/{self.item.id}/locations/')
+        self.assertEqual(
+            [(row['location_code'], row['quantity']) for row in response.json()], [('MAIN', 6), ('STORE', 4)]
+        )
+        response = self.client.get(f'/api/locations/{self.store.pk}/stock/')
+        self.assertEqual([row['product_code'] for row in response.json()['results']], [self.item.product_code])
+        response = self.client.get(f'/api/stock/stock-history/{self.item.id}/?location={self.store.pk}')
+        self.assertEqual(response.status_code, 200)
+
+        # Locations that hold stock or have history cannot be deleted, nor can the default
+        self.assertEqual(self.client.delete(f'/api/locations/{self.store.pk}/').status_code, 409)
+        self.assertEqual(self.client.delete(f'/api/locations/{self.main.pk}/').status_code, 400)
+
+        # Making another location the default demotes the previous one
+        response = self.client.patch(f'/api/locations/{self.store.pk}/', {'is_default': True}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(Location.default_id(), self.store.pk)
+        self.main.refresh_from_db()
+        self.assertFalse(self.main.is_default)
+
+
+@skipUnless(connection.vendor == 'postgresql', "stock_transactions is only partitioned on PostgreSQL")
+class StockPartitionTests(TestCase):
+    """
+    Monthly partitions can be created, archived to disk and restored without the stock API noticing
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="archivist", password="archivist")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.item = create_catalogue(self.user, quantity=100)
+        self.old_month = partitions.month_start(timezone.now().date() - timedelta(days=430))
+        for timestamp in (
+            timezone.now() - timedelta(days=430), timezone.now() - timedelta(days=60), timezone.now()
+        ):
+            stock_transaction = StockTransaction.objects.create(
+                product_variant=self.item, transaction_type='remove', quantity=1, user=self.user
+            )
+            StockTransaction.objects.filter(pk=stock_transaction.pk).update(timestamp=timestamp)
+        self.archive_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.archive_dir)
+
+    def manage(self, *args):
+        stdout = io.StringIO()
+        call_command('manage_stock_partitions', *args, '--archive-dir', self.archive_dir, stdout=stdout)
+        return stdout.getvalue()
+
+    def history(self):
+        response = self.client.get(f'/api/stock/stock-history/{self.item.pk}/')
+        self.assertEqual(response.status_code, 200)
+        return [row['id'] for row in response.json()['results']]
+
+    def test_create_splits_default_partition_by_month(self):
+        before = self.history()
+        self.manage('create', '--ahead', '2')
+        with connection.cursor() as cursor:
+            names = [name for name, _ in partitions.list_partitions(cursor)]
+            cursor.execute(f"SELECT count(*) FROM {partitions.DEFAULT_PARTITION}")
+            self.assertEqual(cursor.fetchone()[0], 0)
+            cursor.execute(f"SELECT count(*) FROM {partitions.partition_name(self.old_month)}")
+            self.assertEqual(cursor.fetchone()[0], 1)
+        # Three months with rows, plus the next two
+        self.assertEqual(len(names), 6)
+        self.assertEqual(self.history(), before)
+        self.assertIn("Created 0 partitions", self.manage('create', '--ahead', '2'))
+
+    def test_archive_and_restore(self):
+        self.manage('create')
+        before = self.history()
+        with self.assertRaises(CommandError):
+            self.manage('archive', '--keep-months', '12')
+
+        StockSnapshot.build()
+        with self.assertRaises(CommandError):
+            self.manage('archive', '--keep-months', '12')
+        build_checkpoints()
+        self.manage('archive', '--keep-months', '12')
+        self.assertTrue(os.path.exists(partitions.archive_path(self.archive_dir, self.old_month)))
+        self.assertEqual(self.history(), before[:2])
+
+        self.manage('restore', f"{self.old_month:%Y-%m}")
+        self.assertEqual(self.history(), before)
+        with self.assertRaises(CommandError):
+            self.manage('restore', f"{self.old_month:%Y-%m}")
+
+
+class RecordingBackend:
+    def __init__(self):
+        self.sent = []
+
+    def send(self, variants):
+        self.sent.append(sorted(variant.product_code for variant in variants))
+
+
+class FailingBackend:
+    def send(self, variants):
+        raise ConnectionError("mail server down")
+
+
+class LowStockAlertPipelineTests(TestCase):
+    """
+    Stock movements queue their variants; the worker notifies once per low-stock episode
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="buyer", password="buyer")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.item = create_catalogue(self.user, quantity=20)
+            self.alert = LowStockAlert.objects.create(product_variant=self.item, threshold=10)
+        self.backend = RecordingBackend()
+
+    def move(self, path, quantity):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                f'/api/stock/{path}/', {'product_variant_id': str(self.item.pk), 'quantity': quantity}, format='json'
+            )
+        self.assertEqual(response.status_code, 201)
+
+    def process(self):
+        return process_low_stock_checks(backends=[self.backend])
+
+    def test_notifies_once_per_low_stock_episode(self):
+        self.move('remove-stock', 12)
+        self.assertEqual(list(LowStockCheck.objects.values_list('product_variant', flat=True)), [self.item.pk])
+        self.assertEqual(self.process(), 1)
+        self.assertEqual(self.backend.sent, [[self.item.product_code]])
+        self.assertFalse(LowStockCheck.objects.exists())
+
+        self.move('remove-stock', 1)
+        self.process()
+        self.assertEqual(len(self.backend.sent), 1)
+
+        self.move('add-stock', 20)
+        self.process()
+        self.alert.refresh_from_db()
+        self.assertIsNone(self.alert.last_notified)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/stock/bulk-movements/', {
+                'lines': [{'product_variant_id': str(self.item.pk), 'transaction_type': 'remove', 'quantity': 20}]
+            }, format='json')
+        self.process()
+        self.assertEqual(len(self.backend.sent), 2)
+
+    def test_failed_delivery_is_retried(self):
+        self.move('remove-stock', 15)
+        with self.assertRaises(ConnectionError):
+            process_low_stock_checks(backends=[FailingBackend()])
+        self.alert.refresh_from_db()
+        self.assertIsNone(self.alert.last_notified)
+        self.assertTrue(LowStockCheck.objects.exists())
+
+        self.assertEqual(self.process(), 1)
+        self.assertEqual(self.backend.sent, [[self.item.product_code]])
+
+
+class LowStockScanTests(TestCase):
+    """
+    current-alerts finds every variant below its own, its subcategory's or its category's threshold
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="planner", password="planner")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        category = Category.objects.create(name="Apparel", low_stock_threshold=5)
+        shirts = SubCategory.objects.create(category=category, name="Shirts")
+        socks = SubCategory.objects.create(category=category, name="Socks", low_stock_threshold=20)
+        self.variants = {}
+        for code, subcategory, quantity, alert in [
+            ("SHIRT-LOW", shirts, 3, None),
+            ("SHIRT-OK", shirts, 8, None),
+            ("SOCK-LOW", socks, 15, None),
+            ("SOCK-OVERRIDDEN", socks, 15, {'threshold': 10}),
+            ("SHIRT-WATCHED", shirts, 50, {'threshold': 60}),
+            ("SHIRT-MUTED", shirts, 1, {'is_active': False}),
+        ]:
+            product = Product.objects.create(name=code, subcategory=subcategory, created_by=self.user)
+            variant = ProductVariantItem.objects.create(
+                product=product, product_code=code, quantity=quantity, price="5.00"
+            )
+            if alert:
+                LowStockAlert.objects.create(product_variant=variant, **alert)
+            self.variants[code] = variant
+
+    def queue_all(self):
+        LowStockCheck.objects.bulk_create([LowStockCheck(product_variant=variant) for variant in self.variants.values()])
+
+    def test_current_alerts_use_effective_thresholds(self):
+        with self.assertNumQueries(4):
+            response = self.client.get('/api/low-stock-alerts/current-alerts/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['count'], 3)
+        self.assertEqual(
+            [(row['product_variant_details']['product_code'], row['threshold'], row['threshold_source'])
+             for row in response.json()['results']],
+            [("SHIRT-LOW", 5, 'category'), ("SOCK-LOW", 20, 'subcategory'), ("SHIRT-WATCHED", 60, 'variant')]
+        )
+
+    def test_worker_notifies_on_default_thresholds(self):
+        backend = RecordingBackend()
+        self.queue_all()
+        process_low_stock_checks(backends=[backend])
+        self.assertEqual(backend.sent, [["SHIRT-LOW", "SHIRT-WATCHED", "SOCK-LOW"]])
+        inherited = LowStockAlert.objects.get(product_variant=self.variants["SHIRT-LOW"])
+        self.assertIsNone(inherited.threshold)
+        self.assertIsNotNone(inherited.last_notified)
+
+        self.queue_all()
+        process_low_stock_checks(backends=[backend])
+        self.assertEqual(len(backend.sent), 1)
+
+
+class DashboardSummaryTests(TestCase):
+    """
+    dashboard/summary is served from counters that follow every product, variant and stock write
+    """
+
+    def setUp(self):
+        cache.delete(LOW_STOCK_COUNT_KEY)
+        self.user = User.objects.create_user(username="manager", password="manager")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.item = create_catalogue(self.user, quantity=10)
+            self.category = self.item.product.subcategory.category
+            self.footwear = Category.objects.create(name="Footwear", low_stock_threshold=5)
+            self.boots = SubCategory.objects.create(category=self.footwear, name="Boots")
+            boot = Product.objects.create(
+                name="Chelsea Boot", subcategory=self.boots, created_by=self.user, total_stock=4
+            )
+            self.boot = ProductVariantItem.objects.create(
+                product=boot, product_code="BOOT-42", quantity=4, price="80.00"
+            )
+
+    def summary(self):
+        response = self.client.get('/api/dashboard/summary/')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def assert_counters_match_rebuild(self):
+        out = io.StringIO()
+        call_command('rebuild_stock_summary', dry_run=True, stdout=out)
+        self.assertIn("found 0 with drift; checked 1 days of movements, found 0 with drift", out.getvalue())
+
+    def test_summary_totals(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            StockTransaction.objects.create(product_variant=self.item, quantity=5, transaction_type='add')
+            StockTransaction.objects.create(product_variant=self.boot, quantity=1, transaction_type='remove')
+
+        with self.assertNumQueries(4):
+            summary = self.summary()
+        self.assertEqual(
+            {key: value for key, value in summary.items() if key not in ('by_category', 'low_stock_as_of')},
+            {
+                'products': 2, 'variants': 2, 'categories': 2, 'units': 18, 'stock_value': '615.00',
+                'low_stock': 1, 'movements_today': 2, 'units_in_today': 5, 'units_out_today': 1,
+            }
+        )
+        self.assertEqual(
+            [(row['name'], row['products'], row['variants'], row['units'], row['stock_value'])
+             for row in summary['by_category']],
+            [("Apparel", 1, 1, 15, '375.00'), ("Footwear", 1, 1, 3, '240.00')]
+        )
+        self.assert_counters_match_rebuild()
+
+    def test_low_stock_is_cached_until_the_alert_worker_runs(self):
+        first = self.summary()
+        self.assertEqual(first['low_stock'], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            StockTransaction.objects.create(product_variant=self.boot, quantity=6, transaction_type='add')
+        # Only the counter rows are read
+        with self.assertNumQueries(2):
+            summary = self.summary()
+        self.assertEqual((summary['low_stock'], summary['low_stock_as_of']), (1, first['low_stock_as_of']))
+
+        process_low_stock_checks(backends=[])
+        self.assertEqual(self.summary()['low_stock'], 0)
+
+    def test_bulk_movements_update_counters(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            StockTransaction.bulk_apply([
+                StockTransaction(product_variant_id=self.item.pk, quantity=3, transaction_type='remove'),
+                StockTransaction(product_variant_id=self.boot.pk, quantity=6, transaction_type='add'),
+                StockTransaction(product_variant_id=self.boot.pk, quantity=-2, transaction_type='adjustment'),
+            ])
+        summary = self.summary()
+        self.assertEqual((summary['units'], summary['stock_value']), (15, '815.00'))
+        self.assertEqual(
+            (summary['movements_today'], summary['units_in_today'], summary['units_out_today']), (3, 6, 5)
+        )
+        self.assert_counters_match_rebuild()
+
+    def test_catalogue_edits_move_counters(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.item.price = "30.00"
+            self.item.save()
+            product = Product.objects.get(pk=self.item.product_id)
+            product.subcategory = self.boots
+            product.save()
+        self.assertEqual(
+            [(row['name'], row['products'], row['units'], row['stock_value']) for row in self.summary()['by_category']],
+            [("Apparel", 0, 0, '0.00'), ("Footwear", 2, 14, '620.00')]
+        )
+        self.assert_counters_match_rebuild()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            boots = SubCategory.objects.get(pk=self.boots.pk)
+            boots.category = self.category
+            boots.save()
+        self.assertEqual(
+            [(row['name'], row['products'], row['variants']) for row in self.summary()['by_category']],
+            [("Apparel", 2, 2), ("Footwear", 0, 0)]
+        )
+        self.assert_counters_match_rebuild()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.boot.delete()
+            Product.objects.get(pk=self.item.product_id).delete()
+        summary = self.summary()
+        self.assertEqual((summary['products'], summary['variants'], summary['units']), (1, 0, 0))
+        self.assert_counters_match_rebuild()
+
+    def test_rebuild_repairs_drift(self):
+        CategoryStockSummary.objects.filter(category=self.category).update(units=999)
+        DailyStockMovement.objects.create(date=timezone.localdate(), movements=7)
+        out = io.StringIO()
+        call_command('rebuild_stock_summary', stdout=out)
+        self.assertIn("repaired 1 with drift; checked 1 days of movements, repaired 1 with drift", out.getvalue())
+        summary = self.summary()
+        self.assertEqual((summary['units'], summary['movements_today']), (14, 0))
+
+
+class AutocommitFollowUpTests(TransactionTestCase):
+    """
+    Work queued on commit also runs for writes made outside a transaction, as
+    the API's are: views run in autocommit
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="clerk", password="clerk")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.category = Category.objects.create(name="Apparel")
+        self.subcategory = SubCategory.objects.create(category=self.category, name="Shirts")
+        colour = Variant.objects.create(subcategory=self.subcategory, name="Colour")
+        self.navy = VariantOption.objects.create(variant=colour, option="Navy")
+
+    def test_api_writes_run_their_follow_up_work(self):
+        response = self.client.post('/api/products/', {
+            'name': "Oxford Shirt", 'subcategory': str(self.subcategory.id), 'hsn_code': "6205"
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        product_id = response.json()['id']
+        response = self.client.get('/api/products/search/', {'q': "oxford"})
+        self.assertEqual([row['name'] for row in response.json()['results']], ["Oxford Shirt"])
+        self.assertEqual(self.client.get('/api/dashboard/summary/').json()['products'], 1)
+
+        response = self.client.post('/api/product-variants/', {
+            'product': product_id, 'variant_options': [str(self.navy.id)], 'quantity': 3, 'price': '30.00'
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        item_id = response.json()['id']
+        response = self.client.patch(f'/api/categories/{self.category.id}/', {'name': "Clothing"}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(VariantListing.objects.get(pk=item_id).subcategory, "Clothing - Shirts")
+
+        response = self.client.post(
+            '/api/low-stock-alerts/', {'product_variant': item_id, 'threshold': 10}, format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(LowStockCheck.objects.filter(product_variant=item_id).exists())
+
+    def test_entries_queued_in_one_transaction_flush_once(self):
+        flushed = []
+        queue = CommitQueue(flushed.append)
+        queue.add("product", [1])
+        self.assertEqual(flushed, [{"product": {1}}])
+
+        with transaction.atomic():
+            queue.add("product", [2])
+            queue.add("product", [2, 3])
+            self.assertEqual(len(connection.run_on_commit), 1)
+        self.assertEqual(flushed[1:], [{"product": {2, 3}}])
+
+
+class ConditionalGetTests(TestCase):
+    """
+    Read endpoints carry weak ETags and answer unchanged resources with 304 before serializing
+    """
+
+    def setUp(self):
+        taxonomy_cache.invalidate()
+        self.user = User.objects.create_user(username="poller", password="poller")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.item = create_catalogue(self.user, quantity=10)
+        self.alert = LowStockAlert.objects.create(product_variant=self.item, threshold=2)
+        self.paths = [
+            '/api/products/',
+            f'/api/products/{self.item.product_id}/',
+            '/api/product-variants/',
+            f'/api/product-variants/{self.item.id}/',
+            f'/api/product-variants/by-product/{self.item.product_id}/',
+            '/api/low-stock-alerts/',
+            f'/api/low-stock-alerts/{self.alert.id}/',
+        ]
+
+    def etags(self, paths):
+        responses = [self.client.get(path) for path in paths]
+        self.assertEqual([response.status_code for response in responses], [200] * len(paths))
+        return [response['ETag'] for response in responses]
+
+    def test_unchanged_resources_return_304_before_serializing(self):
+        # Products also check their variants' listings; whole lists also read the dashboard counters
+        queries = [3, 2, 2, 1, 1, 1, 1]
+        for path, etag, count in zip(self.paths, self.etags(self.paths), queries):
+            self.assertTrue(etag.startswith('W/"'))
+            with self.assertNumQueries(count):
+                response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304, path)
+            self.assertEqual(response['ETag'], etag)
+            self.assertEqual(response.content, b'')
+
+    def test_if_modified_since(self):
+        response = self.client.get(f'/api/products/{self.item.product_id}/')
+        self.assertEqual(
+            self.client.get(
+                f'/api/products/{self.item.product_id}/', HTTP_IF_MODIFIED_SINCE=response['Last-Modified']
+            ).status_code,
+            304
+        )
+
+    def test_stock_movements_change_etags(self):
+        before = self.etags(self.paths)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/stock/add-stock/', {
+                'product_variant_id': str(self.item.id), 'quantity': 5
+            }, format='json')
+        self.assertEqual(response.status_code, 201)
+
+        for path, etag in zip(self.paths, before):
+            response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200, path)
+            self.assertNotEqual(response['ETag'], etag)
+
+    def test_deletes_change_list_etags(self):
+        paths = ['/api/product-variants/', '/api/low-stock-alerts/']
+        before = self.etags(paths)
+        self.alert.delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductVariantItem.objects.create(
+                product=self.item.product, product_code="SPARE", quantity=0, price="1.00"
+            )
+        self.assertNotEqual(self.etags(paths), before)
+
+    def test_list_etags_do_not_scan_tables(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            spare = ProductVariantItem.objects.create(
+                product=self.item.product, product_code="SPARE", quantity=0, price="1.00"
+            )
+        # The spare's listing is not the latest write, so deleting it leaves the latest stamps alone
+        VariantListing.objects.filter(pk=self.item.pk).update(updated_at=timezone.now() + timedelta(seconds=1))
+        paths = ['/api/products/', '/api/product-variants/']
+        before = self.etags(paths)
+        for path, etag in zip(paths, before):
+            with CaptureQueriesContext(connection) as context:
+                self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+            self.assertFalse([query for query in context.captured_queries if 'COUNT(' in query['sql']], path)
+
+        # Deleting it stamps nothing newer, but moves the counters
+        with self.captureOnCommitCallbacks(execute=True):
+            spare.delete()
+        after = self.etags(paths)
+        self.assertTrue(all(etag != previous for etag, previous in zip(after, before)))
+
+    def test_taxonomy_etags_follow_the_cache(self):
+        etag = self.client.get('/api/categories/')['ETag']
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/api/categories/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.client.post('/api/categories/', {'name': 'Footwear'}, format='json')
+        response = self.client.get('/api/categories/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 2)
+
+
+class ListQueryCountTests(TestCase):
+    """
+    List endpoints must run in a constant number of queries, however many rows they return
+    """
+    list_paths = [
+        '/api/products/',
+        '/api/product-variants/',
+        '/api/product-configurations/',
+        '/api/stock/',
+        '/api/low-stock-alerts/',
+        '/api/low-stock-alerts/current-alerts/',
+    ]
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="clerk", password="clerk")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        category = Category.objects.create(name="Apparel")
+        self.subcategory = SubCategory.objects.create(category=category, name="Shirts")
+        variant = Variant.objects.create(subcategory=self.subcategory, name="Size")
+        self.options = [VariantOption.objects.create(variant=variant, option=f"Size {i}") for i in range(20)]
+        self.product_count = 0
+
+    def add_rows(self, count):
+        """
+        Add products, each with one configured variant, an alert and a stock transaction
+        """
+        for _ in range(count):
+            product = Product.objects.create(
+                name=f"Shirt {self.product_count}", subcategory=self.subcategory, created_by=self.user
+            )
+            item = ProductVariantItem.objects.create(
+                product=product, product_code=f"{product.product_id}-SZ", quantity=0, price="10.00"
+            )
+            ProductConfiguration.objects.create(product_item=item, variant_option=self.options[self.product_count])
+            LowStockAlert.objects.create(product_variant=item, threshold=5)
+            StockTransaction.objects.create(product_variant=item, quantity=1, transaction_type='add', user=self.user)
+            self.product_count += 1
+        return item
+
+    def count_queries(self, path):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(path)
+        self.assertEqual(response.status_code, 200, path)
+        return len(context.captured_queries)
+
+    def test_list_endpoints_do_not_scale_with_rows(self):
+        item = self.add_rows(2)
+        paths = self.list_paths + [f'/api/stock/stock-history/{item.id}/']
+        baseline = {path: self.count_queries(path) for path in paths}
+
+        self.add_rows(10)
+        StockTransaction.objects.bulk_create([
+            StockTransaction(product_variant=item, quantity=1, transaction_type='add') for _ in range(10)
+        ])
+
+        for path in paths:
+            self.assertEqual(self.count_queries(path), baseline[path], path)
+
+
+class EndpointBudgetTests(TestCase):
+    """
+    Every router endpoint must stay within the query budget in benchmark_budgets.json.
+    Latency and response size budgets are enforced by `manage.py benchmark_endpoints`.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="benchmark", password="benchmark")
+        cls.fixtures = benchmarks.seed_catalogue(cls.user, **benchmarks.SCALES["small"])
+
+    def test_routes_stay_within_query_budget(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        results = benchmarks.run_benchmarks(client, self.fixtures)
+
+        violations = benchmarks.check_budgets(results, benchmarks.load_budgets(), metrics=("queries",))
+        self.assertEqual(violations, [])
+
+
+class QueryPlanTests(TestCase):
+    """
+    The planner must pick the access path indexes for the queries the API actually runs
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user(username="planner", password="planner")
+        category = Category.objects.create(name="Apparel")
+        subcategory = SubCategory.objects.create(category=category, name="Shirts")
+        products = Product.objects.bulk_create([
+            Product(name=f"Shirt {i}", subcategory=subcategory, created_by=user)
+            for i in range(1000)
+        ])
+        cls.variants = ProductVariantItem.objects.bulk_create([
+            ProductVariantItem(product=product, product_code=f"{product.product_id}-{size}", quantity=10, price="10.00")
+            for product in products for size in ("S", "M", "L")
+        ])
+        transaction_types = [choice for choice, _ in StockTransaction.TRANSACTION_TYPES]
+        StockTransaction.objects.bulk_create([
+            StockTransaction(
+                product_variant=variant,
+                quantity=1,
+                transaction_type=transaction_types[i % len(transaction_types)]
+            )
+            for variant in cls.variants for i in range(6)
+        ], batch_size=1000)
+        # A fast-moving variant with a long history, as paginated by stock-history
+        cls.busy_variant = cls.variants[0]
+        StockTransaction.objects.bulk_create([
+            StockTransaction(
+                product_variant=cls.busy_variant,
+                quantity=1,
+                transaction_type=transaction_types[i % len(transaction_types)]
+            )
+            for i in range(3000)
+        ], batch_size=1000)
+        # Most alerts have been dismissed; only a handful are still active
+        LowStockAlert.objects.bulk_create([
+            LowStockAlert(product_variant=variant, threshold=5, is_active=i % 50 == 0)
+            for i, variant in enumerate(cls.variants)
+        ])
+        with connection.cursor() as cursor:
+            for table in ("products", "product_variant_items", "stock_transactions", "low_stock_alerts"):
+                cursor.execute(f"ANALYZE {table}")
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(index_name, plan)
+
+    def test_stock_history_uses_variant_timestamp_index(self):
+        queryset = StockTransaction.objects.filter(
+            product_variant=self.busy_variant, timestamp__gte=timezone.now() - timedelta(days=30)
+        ).order_by('-timestamp')[:50]
+        self.assertUsesIndex(queryset, 'stock_txn_variant_ts_idx')
+
+    def test_stock_history_by_type_uses_variant_type_index(self):
+        queryset = StockTransaction.objects.filter(
+            product_variant=self.busy_variant, transaction_type='remove'
+        ).order_by('-timestamp')[:50]
+        self.assertUsesIndex(queryset, 'stock_txn_variant_type_ts_idx')
+
+    def test_product_default_ordering_uses_ordering_index(self):
+        self.assertUsesIndex(Product.objects.all()[:50], 'products_ordering_idx')
+
+    def test_low_stock_scan_uses_quantity_index(self):
+        queryset = ProductVariantItem.objects.low_stock().order_by('quantity', 'id')[:50]
+        self.assertUsesIndex(queryset, 'variant_item_quantity_idx')
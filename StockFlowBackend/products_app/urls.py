@@ -12,7 +12,10 @@ router.register(r'variant-options', VariantOptionViewSet, basename='variant-opti
 router.register(r'product-variants', ProductVariantItemViewSet)
 router.register(r'product-configurations', ProductConfigurationViewSet)
 router.register(r'stock', StockManagementViewSet,basename='stocktransaction')
+router.register(r'locations', LocationViewSet, basename='location')
+router.register(r'reservations', StockReservationViewSet, basename='stock-reservation')
 router.register(r'low-stock-alerts', LowStockAlertViewSet, basename='low-stock-alert')
+router.register(r'dashboard', DashboardViewSet, basename='dashboard')
 
 urlpatterns = [
     path('', include(router.urls)),
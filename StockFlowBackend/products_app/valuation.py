@@ -0,0 +1,266 @@
+"""
+Inventory valuation over the stock ledger, by FIFO and by weighted-average cost.
+
+Receipts (additions and positive adjustments) carry a unit_cost, which
+defaults to the variant's price when the movement does not give one. Issues
+(removals and negative adjustments) are costed here: FIFO consumes the oldest
+receipt layers still on hand, weighted average takes the running average cost.
+Stock a variant held before its first transaction, such as the quantity it
+was created with, opens as one layer at the variant's price.
+
+Replaying every variant's whole ledger on each request would not scale, so
+build_checkpoints(), run daily through the build_cost_checkpoints command,
+closes each day on which a variant moved into a CostLayerCheckpoint, as
+StockSnapshot does for quantities. value_inventory() starts every variant
+from its latest checkpoint and replays only the transactions after it.
+"""
+import datetime
+from collections import deque
+from decimal import Decimal
+from itertools import groupby
+from operator import itemgetter
+
+from django.db import transaction
+from django.db.models import F, Max, OuterRef, Q, Subquery
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import (
+    Category, CostLayerCheckpoint, ProductVariantItem, StockTransaction, VariantListing, day_start, ledger_total,
+)
+
+COST_PLACES = Decimal("0.0001")
+CENTS = Decimal("0.01")
+
+LEDGER_FIELDS = ("product_variant_id", "transaction_type", "quantity", "unit_cost")
+
+
+class CostLayers:
+    """
+    Running cost state of one variant: its stock, the FIFO receipt layers still
+    on hand (oldest first, as [quantity, unit cost]) and the weighted-average
+    unit cost of the units on hand. Issues beyond the layers on hand, which a
+    ledger that does not add up can produce, leave the stock negative until
+    later receipts cover it.
+    """
+
+    def __init__(self, quantity=0, layers=(), average_cost=0):
+        self.quantity = quantity
+        self.layers = deque([layer_quantity, Decimal(cost)] for layer_quantity, cost in layers)
+        self.average_cost = Decimal(average_cost)
+
+    @classmethod
+    def opening(cls, quantity, unit_cost):
+        return cls(quantity, [(quantity, unit_cost)] if quantity > 0 else [], unit_cost)
+
+    @classmethod
+    def from_checkpoint(cls, checkpoint):
+        return cls(checkpoint.quantity, checkpoint.fifo_layers, checkpoint.average_cost)
+
+    def receive(self, quantity, unit_cost):
+        on_hand = max(self.quantity, 0)
+        self.average_cost = (
+            (on_hand * self.average_cost + quantity * unit_cost) / (on_hand + quantity)
+        ).quantize(COST_PLACES)
+        # Receipts cover any shortfall before they are layered
+        layered = quantity - max(-self.quantity, 0)
+        if layered > 0:
+            self.layers.append([layered, unit_cost])
+        self.quantity += quantity
+
+    def issue(self, quantity):
+        self.quantity -= quantity
+        while quantity and self.layers:
+            layer = self.layers[0]
+            taken = min(quantity, layer[0])
+            layer[0] -= taken
+            quantity -= taken
+            if not layer[0]:
+                self.layers.popleft()
+
+    def apply(self, transaction_type, quantity, unit_cost):
+        if transaction_type == "transfer":
+            # Moves units between locations; what is on hand, and its cost, is unchanged
+            return
+        if transaction_type == "remove":
+            quantity = -quantity
+        if quantity > 0:
+            self.receive(quantity, unit_cost)
+        elif quantity < 0:
+            self.issue(-quantity)
+
+    @property
+    def fifo_value(self):
+        return sum((quantity * cost for quantity, cost in self.layers), Decimal(0)).quantize(CENTS)
+
+    @property
+    def average_value(self):
+        return (max(self.quantity, 0) * self.average_cost).quantize(CENTS)
+
+    def checkpoint(self, variant_id, date):
+        return CostLayerCheckpoint(
+            product_variant_id=variant_id,
+            date=date,
+            quantity=self.quantity,
+            fifo_layers=[[quantity, str(cost)] for quantity, cost in self.layers],
+            average_cost=self.average_cost,
+        )
+
+
+def latest_checkpoints(variants, before):
+    """
+    The latest checkpoint of each of the given variants (a queryset) dated before
+    the given day, as {variant id: checkpoint}; variants without one are left out
+    """
+    checkpoints = CostLayerCheckpoint.objects.filter(product_variant=OuterRef("pk"), date__lt=before).order_by("-date")
+    latest = variants.order_by().annotate(checkpoint=Subquery(checkpoints.values("pk")[:1])).filter(
+        checkpoint__isnull=False
+    ).values("checkpoint")
+    return {checkpoint.product_variant_id: checkpoint for checkpoint in CostLayerCheckpoint.objects.filter(pk__in=latest)}
+
+
+def opening_states(variant_ids, batch_size=1000):
+    """
+    Cost state of each variant before its first transaction: its current stock
+    less its whole ledger, at its price
+    """
+    variant_ids = list(variant_ids)
+    states = {}
+    for start in range(0, len(variant_ids), batch_size):
+        for pk, opening, price in ProductVariantItem.objects.filter(
+            pk__in=variant_ids[start:start + batch_size]
+        ).annotate(opening=F("quantity") - ledger_total()).values_list("pk", "opening", "price"):
+            states[pk] = CostLayers.opening(opening, price)
+    return states
+
+
+def receipt_costs(variant_ids, batch_size=1000):
+    """
+    Price of each variant, the cost of receipts recorded before unit_cost was captured
+    """
+    variant_ids = list(variant_ids)
+    prices = {}
+    for start in range(0, len(variant_ids), batch_size):
+        prices.update(
+            ProductVariantItem.objects.filter(pk__in=variant_ids[start:start + batch_size]).values_list("pk", "price")
+        )
+    return prices
+
+
+def replay(states, rows, prices):
+    for variant_id, transaction_type, quantity, unit_cost in rows:
+        states[variant_id].apply(transaction_type, quantity, prices[variant_id] if unit_cost is None else unit_cost)
+
+
+def build_checkpoints(through=None, batch_size=1000):
+    """
+    Write checkpoints for every day after the latest one up to and including
+    through (default yesterday), one transaction per day, and return the number
+    of rows written. Only closed days should be built: a day's checkpoints are
+    never revisited once a later day exists.
+    """
+    through = through or timezone.localdate() - datetime.timedelta(days=1)
+    transactions = StockTransaction.objects.filter(timestamp__lt=day_start(through + datetime.timedelta(days=1)))
+    latest = CostLayerCheckpoint.objects.aggregate(latest=Max("date"))["latest"]
+    if latest is not None:
+        transactions = transactions.filter(timestamp__gte=day_start(latest + datetime.timedelta(days=1)))
+
+    rows = transactions.annotate(day=TruncDate("timestamp")).order_by("timestamp", "id").values_list(
+        "day", *LEDGER_FIELDS
+    )
+    states = {}
+    prices = {}
+    written = 0
+    for day, day_rows in groupby(rows.iterator(chunk_size=5000), key=itemgetter(0)):
+        day_rows = [row[1:] for row in day_rows]
+        moved = {row[0] for row in day_rows}
+        new = list(moved - set(states))
+        if new:
+            for start in range(0, len(new), batch_size):
+                batch = new[start:start + batch_size]
+                checkpoints = latest_checkpoints(ProductVariantItem.objects.filter(pk__in=batch), before=day)
+                states.update(
+                    (pk, CostLayers.from_checkpoint(checkpoint)) for pk, checkpoint in checkpoints.items()
+                )
+                states.update(opening_states(pk for pk in batch if pk not in checkpoints))
+            prices.update(receipt_costs(new))
+        # Variants deleted since have neither a state nor rows to write
+        day_rows = [row for row in day_rows if row[0] in states]
+        replay(states, day_rows, prices)
+
+        checkpoints = [states[pk].checkpoint(pk, day) for pk in moved if pk in states]
+        with transaction.atomic():
+            CostLayerCheckpoint.objects.bulk_create(
+                checkpoints,
+                batch_size=batch_size,
+                update_conflicts=True,
+                unique_fields=["product_variant", "date"],
+                update_fields=["quantity", "fifo_layers", "average_cost"],
+            )
+        written += len(checkpoints)
+    return written
+
+
+def value_inventory(variants=None, as_of=None, batch_size=1000):
+    """
+    Cost state of each variant (all of them unless a queryset is given) as it
+    stood at as_of (default now), before any transaction stamped at or after it,
+    as {variant id: CostLayers}
+    """
+    moment = as_of or timezone.now()
+    variants = ProductVariantItem.objects.all() if variants is None else variants
+    checkpoints = latest_checkpoints(variants, before=timezone.localdate(moment))
+    states = {pk: CostLayers.from_checkpoint(checkpoint) for pk, checkpoint in checkpoints.items()}
+    states.update(opening_states(set(variants.values_list("pk", flat=True)) - set(states)))
+    prices = receipt_costs(states)
+
+    # Replay each variant from the end of its checkpoint's day, or its whole ledger.
+    # Variants replay independently, so the ledger is read a batch of variants at a time
+    variant_ids = list(states)
+    for start in range(0, len(variant_ids), batch_size):
+        since = Q()
+        by_date = {}
+        for pk in variant_ids[start:start + batch_size]:
+            by_date.setdefault(checkpoints[pk].date if pk in checkpoints else None, []).append(pk)
+        for date, batch in by_date.items():
+            if date is None:
+                since |= Q(product_variant__in=batch)
+            else:
+                since |= Q(product_variant__in=batch, timestamp__gte=day_start(date + datetime.timedelta(days=1)))
+        rows = StockTransaction.objects.filter(since, timestamp__lt=moment).order_by("timestamp", "id").values_list(
+            *LEDGER_FIELDS
+        )
+        replay(states, rows.iterator(chunk_size=5000), prices)
+    return states
+
+
+def value_by_category(states, variants=None):
+    """
+    Sum the cost states of the given variants (a queryset, all of them by
+    default) per category, as rows ordered by category name
+    """
+    variants = ProductVariantItem.objects.all() if variants is None else variants
+    totals = {}
+    for variant_id, category_id in VariantListing.objects.filter(variant__in=variants).values_list("pk", "category_id"):
+        state = states.get(variant_id)
+        if state is None:
+            # Created after the states were computed
+            continue
+        total = totals.setdefault(category_id, [0, Decimal(0), Decimal(0)])
+        total[0] += state.quantity
+        total[1] += state.fifo_value
+        total[2] += state.average_value
+    names = dict(Category.objects.filter(pk__in=totals).values_list("pk", "name"))
+    return sorted(
+        (
+            {
+                "category": category_id,
+                "name": names[category_id],
+                "quantity": quantity,
+                "fifo_value": fifo_value,
+                "average_value": average_value,
+            }
+            for category_id, (quantity, fifo_value, average_value) in totals.items()
+        ),
+        key=itemgetter("name", "category"),
+    )
@@ -1,14 +1,143 @@
+import hashlib
+import uuid
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+from functools import partial
+from urllib.parse import urlencode
+
+from django.conf import settings
 from django.db import models
-from rest_framework import viewsets, status
+from rest_framework import serializers, status, viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import ParseError
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated,IsAuthenticated
 from .models import *
 from django.db import transaction
+from django.utils import timezone
 from django.db.models import Sum, F
 from .serializers import *
+from .pagination import (
+    CreatedAtCursorPagination, LocationStockCursorPagination, StandardResultsSetPagination, TimestampCursorPagination,
+)
+from .taxonomy import taxonomy_cache
+from .conditional import (
+    ConditionalGetMixin, collection_validators, conditional_response, table_validators, weak_etag,
+)
+from .alerts import low_stock_count
+from .exports import EXPORT_CONTENT_TYPES, filter_date_range, parse_date_bound, streaming_export
+from .idempotency import idempotent
+from .valuation import value_by_category, value_inventory
+
 
-class CategoryViewSet(viewsets.ModelViewSet):
+def parse_quantity(value):
+    """
+    Parse a quantity from request data, returning None when it is not an integer
+    """
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_unit_cost(value):
+    """
+    Parse an optional unit cost from request data, raising ValueError unless it
+    is absent or a non-negative amount with at most 4 decimal places
+    """
+    if value in (None, ''):
+        return None
+    try:
+        cost = Decimal(str(value))
+    except InvalidOperation:
+        raise ValueError("unit_cost must be a number")
+    if not cost.is_finite() or cost < 0 or cost != cost.quantize(Decimal('0.0001')) or cost >= 10 ** 8:
+        raise ValueError("unit_cost must be a non-negative amount with at most 4 decimal places")
+    return cost
+
+
+def parse_location(value, field='location_id'):
+    """
+    Parse an optional location id from request data, raising ValueError unless
+    it is absent or names an existing location
+    """
+    if value in (None, ''):
+        return None
+    try:
+        location_id = uuid.UUID(str(value))
+    except ValueError:
+        raise ValueError(f"{field} must be a location id")
+    if not Location.objects.filter(pk=location_id).exists():
+        raise ValueError(f"{field}: location not found")
+    return location_id
+
+
+def filter_location(transactions, value):
+    """
+    Limit transactions to those moving stock out of or into a location
+    """
+    location_id = uuid.UUID(value)
+    return transactions.filter(models.Q(source_location=location_id) | models.Q(destination_location=location_id))
+
+
+def export_response(request, queryset, columns, filename, date_field=None):
+    """
+    Stream queryset in the format named by ?output= (csv or ndjson), optionally
+    limited to the start_date/end_date range on date_field
+    """
+    output = request.query_params.get('output', 'csv')
+    if output not in EXPORT_CONTENT_TYPES:
+        return Response(
+            {"error": f"output must be one of: {', '.join(EXPORT_CONTENT_TYPES)}"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if date_field:
+        try:
+            queryset = filter_date_range(queryset, date_field, request.query_params)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    return streaming_export(queryset, columns, output, filename)
+
+class CachedTaxonomyMixin:
+    """
+    Serve list and retrieve from the taxonomy cache; writes invalidate it through signals.
+    Each cache entry carries an ETag minted when it was loaded, so conditional
+    requests are answered from the entry alone. List entries are keyed by the
+    filter params the viewset honours, listed in cached_params; any other
+    param reads the same entry.
+    """
+    cached_params = ()
+
+    def cache_entry(self, data):
+        return weak_etag(uuid.uuid4().hex), data
+
+    def render_rows(self, rows):
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(page)
+        return Response(rows)
+
+    def list(self, request, *args, **kwargs):
+        params = urlencode(sorted(
+            (key, value) for key, value in request.query_params.items() if key in self.cached_params
+        ))
+        etag, rows = taxonomy_cache.get_or_load(
+            f"{self.basename}:list:{hashlib.sha1(params.encode()).hexdigest()}",
+            lambda: self.cache_entry(
+                list(self.get_serializer(self.filter_queryset(self.get_queryset()), many=True).data)
+            )
+        )
+        return conditional_response(request, etag, None, partial(self.render_rows, rows))
+
+    def retrieve(self, request, *args, **kwargs):
+        etag, row = taxonomy_cache.get_or_load(
+            f"{self.basename}:detail:{kwargs[self.lookup_field]}",
+            lambda: self.cache_entry(self.get_serializer(self.get_object()).data)
+        )
+        return conditional_response(request, etag, None, partial(Response, row))
+
+
+class CategoryViewSet(CachedTaxonomyMixin, viewsets.ModelViewSet):
     """
     API for managing products (CRUD).
     """
@@ -16,104 +145,270 @@ class CategoryViewSet(viewsets.ModelViewSet):
     serializer_class = CategorySerializer
     permission_classes = [IsAuthenticated]
 
-class SubCategoryViewSet(viewsets.ModelViewSet):
+class SubCategoryViewSet(CachedTaxonomyMixin, viewsets.ModelViewSet):
     """
     API for managing products (CRUD).
     """
     serializer_class = SubCategorySerializer
     permission_classes = [IsAuthenticated]
+    cached_params = ('category',)
     def get_queryset(self):
-        queryset = SubCategory.objects.all()
+        queryset = SubCategory.objects.order_by('name', 'id')
         category_id = self.request.query_params.get("category")  # Get category ID from query params
         if category_id:
             queryset = queryset.filter(category_id=category_id)  # Filter by category ID
         return queryset
     
-class VariantViewSet(viewsets.ModelViewSet):
+class VariantViewSet(CachedTaxonomyMixin, viewsets.ModelViewSet):
     """
     API for managing variants (CRUD).
     """
     serializer_class = VariantSerializer
     permission_classes = [IsAuthenticated]
+    cached_params = ('subcategory',)
     def get_queryset(self):
-        queryset = Variant.objects.all()
+        queryset = Variant.objects.order_by('name', 'id')
         subcategory_id = self.request.query_params.get("subcategory")  # Get category ID from query params
         if subcategory_id:
             queryset = queryset.filter(subcategory_id=subcategory_id)  # Filter by category ID
         return queryset
 
-class VariantOptionViewSet(viewsets.ModelViewSet):
+class VariantOptionViewSet(CachedTaxonomyMixin, viewsets.ModelViewSet):
     """
     API for managing sub-variants (CRUD).
     """
     serializer_class = VariantOptionSerializer
     permission_classes = [IsAuthenticated]
+    cached_params = ('variant',)
     def get_queryset(self):
-        queryset = VariantOption.objects.all()
+        queryset = VariantOption.objects.order_by('option', 'id')
         variant_id = self.request.query_params.get("variant")  # Get category ID from query params
         if variant_id:
             queryset = queryset.filter(variant_id=variant_id)  # Filter by category ID
         return queryset
 
-class ProductViewSet(viewsets.ModelViewSet):
-    queryset = Product.objects.all().order_by("-created_at")
+class StockAsOfMixin:
+    """
+    Report stock as it stood at ?as_of= instead of now: a bare date gives that
+    day's closing stock, a datetime the stock just before that moment. Answered
+    from the nearest StockSnapshot plus the transactions after it.
+    """
+    stock_field = 'quantity'
+    as_of_actions = ('list', 'retrieve')
+
+    def stock_as_of(self, ids, moment):
+        """
+        Return {row id: stock at moment} for the rendered rows
+        """
+        return StockSnapshot.quantities_as_of(ids, moment)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.as_of = None
+        value = request.query_params.get('as_of')
+        if value and self.action in self.as_of_actions:
+            try:
+                self.as_of = parse_date_bound(value, end=True)
+            except ValueError as e:
+                raise ParseError({"error": str(e)})
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        if getattr(self, 'as_of', None) and response.status_code == status.HTTP_200_OK:
+            rows = response.data
+            if isinstance(rows, dict):
+                rows = rows['results'] if 'results' in rows else [rows]
+            stock = self.stock_as_of([uuid.UUID(str(row['id'])) for row in rows], self.as_of)
+            for row in rows:
+                row[self.stock_field] = stock.get(uuid.UUID(str(row['id'])), 0)
+        return super().finalize_response(request, response, *args, **kwargs)
+
+class ProductViewSet(ConditionalGetMixin, StockAsOfMixin, viewsets.ModelViewSet):
+    queryset = Product.objects.select_related("created_by").defer("search_document").order_by("-created_at")
     serializer_class = ProductSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = CreatedAtCursorPagination
+    stock_field = 'total_stock'
+
+    def get_validators(self):
+        # Stock movements shift total_stock without stamping the product; they
+        # stamp the variants' listings, and deleting a variant removes its listing
+        if self.action == 'list':
+            # The whole tables: counts come from the dashboard counters rather than a scan
+            return table_validators(
+                CategoryStockSummary.overall('products', 'variants'), Product.objects.all(), VariantListing.objects.all()
+            )
+        products = self.filter_queryset(self.get_queryset()).filter(pk=self.kwargs['pk'])
+        listings = VariantListing.objects.filter(product=self.kwargs['pk'])
+        return collection_validators(products, listings)
+
+    def stock_as_of(self, ids, moment):
+        variants = dict(ProductVariantItem.objects.filter(product__in=ids).values_list('pk', 'product_id'))
+        totals = dict.fromkeys(ids, 0)
+        for variant_id, quantity in StockSnapshot.quantities_as_of(variants, moment).items():
+            totals[variants[variant_id]] += quantity
+        return totals
 
     def perform_create(self, serializer):
         # product_id is auto-generated by signal
         serializer.save(created_by=self.request.user)
 
-class ProductVariantItemViewSet(viewsets.ModelViewSet):
-    queryset = ProductVariantItem.objects.all()
+    @action(detail=False, methods=['get'], url_path='export')
+    def export(self, request):
+        """
+        Stream all products, optionally created within start_date/end_date
+        """
+        return export_response(
+            request,
+            Product.objects.order_by('created_at', 'id'),
+            [
+                ('id', 'id'),
+                ('product_id', 'product_id'),
+                ('name', 'name'),
+                ('category', 'subcategory__category__name'),
+                ('subcategory', 'subcategory__name'),
+                ('hsn_code', 'hsn_code'),
+                ('total_stock', 'total_stock'),
+                ('is_active', 'is_active'),
+                ('is_favourite', 'is_favourite'),
+                ('created_by', 'created_by__username'),
+                ('created_at', 'created_at'),
+                ('updated_at', 'updated_at'),
+            ],
+            'products',
+            date_field='created_at'
+        )
+
+    @action(detail=False, methods=['get'], url_path='search')
+    def search(self, request):
+        """
+        Ranked search over product name, HSN code, variant product codes and option values
+        """
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({"error": "Query parameter 'q' is required"}, status=status.HTTP_400_BAD_REQUEST)
+
+        products = Product.objects.select_related("created_by").defer("search_document").search(query)
+        # Results are ordered by rank, which a created_at cursor cannot page through
+        paginator = StandardResultsSetPagination()
+        page = paginator.paginate_queryset(products, request, view=self)
+        serializer = self.get_serializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+class ProductVariantItemViewSet(ConditionalGetMixin, StockAsOfMixin, viewsets.ModelViewSet):
+    queryset = ProductVariantItem.objects.with_details().order_by('product_code')
     serializer_class = ProductVariantItemSerializer
     permission_classes = [IsAuthenticated]
-    
+    as_of_actions = ('list', 'retrieve', 'by_product')
+    conditional_actions = ('list', 'retrieve', 'by_product')
+
+    def get_validators(self):
+        # Every read action renders what the variant_listings rows hold
+        if self.action == 'list':
+            return table_validators(CategoryStockSummary.overall('variants'), VariantListing.objects.all())
+        listings = VariantListing.objects.all()
+        if self.action == 'retrieve':
+            listings = listings.filter(pk=self.kwargs['pk'])
+        elif self.action == 'by_product':
+            listings = listings.filter(product=self.kwargs['product_id'])
+        return collection_validators(listings)
+
     def get_serializer_class(self):
         if self.action in ['create', 'update', 'partial_update']:
             return ProductVariantItemCreateUpdateSerializer
         return ProductVariantItemSerializer
+
+    @action(detail=False, methods=['get'], url_path='export')
+    def export(self, request):
+        """
+        Stream every variant, or one product's variants, from the flat variant_listings read model
+        """
+        listings = VariantListing.objects.order_by('product_code')
+        product_id = request.query_params.get('product')
+        if product_id:
+            try:
+                listings = listings.filter(product_id=uuid.UUID(product_id))
+            except ValueError:
+                return Response({"error": "Invalid product"}, status=status.HTTP_400_BAD_REQUEST)
+
+        return export_response(
+            request,
+            listings,
+            [
+                ('id', 'variant_id'),
+                ('product', 'product_id'),
+                ('product_name', 'product_name'),
+                ('product_code', 'product_code'),
+                ('subcategory', 'subcategory'),
+                ('quantity', 'quantity'),
+                ('price', 'price'),
+                ('hsn_code', 'hsn_code'),
+                ('configurations', 'configurations'),
+            ],
+            'product_variants'
+        )
+
+    def list(self, request, *args, **kwargs):
+        """
+        List variants from the flat variant_listings read model
+        """
+        return self.conditional(self.list_listings)
+
+    def list_listings(self):
+        listings = VariantListing.objects.order_by('product_code')
+        page = self.paginate_queryset(listings)
+        serializer = VariantListingSerializer(page, many=True, context=self.get_serializer_context())
+        return self.get_paginated_response(serializer.data)
     
-    def perform_update(self, serializer):
+    @transaction.atomic
+    def perform_create(self, serializer):
         instance = serializer.save()
-        self._update_product_total_stock(instance.product)
-    
+        Product.apply_stock_delta(instance.product_id, instance.quantity)
+
+    # Quantity edits are recorded as ledger adjustments, which keep total_stock in step
+
+    @transaction.atomic
     def perform_destroy(self, instance):
-        product = instance.product
+        quantity = ProductVariantItem.objects.select_for_update().values_list(
+            'quantity', flat=True
+        ).get(pk=instance.pk)
         instance.delete()
-        self._update_product_total_stock(product)
-    
-    def _update_product_total_stock(self, product):
-        total_stock = ProductVariantItem.objects.filter(
-            product=product
-        ).aggregate(models.Sum('quantity'))['quantity__sum'] or 0
-        product.total_stock = total_stock
-        product.save()
+        Product.apply_stock_delta(instance.product_id, -quantity)
         
+    def _bulk_create_items(self, items_data, product=None):
+        """
+        Validate the whole payload up front, then write every item and its
+        configurations with bulk_create inside a single transaction.
+        """
+        serializer = ProductVariantItemBulkCreateSerializer(
+            data={'items': items_data},
+            context={'product': product}
+        )
+        if not serializer.is_valid():
+            return Response(
+                serializer.errors,
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        with transaction.atomic():
+            product_items = serializer.save()
+            # Update total stock once per affected product
+            stock_deltas = {}
+            for item in product_items:
+                stock_deltas[item.product_id] = stock_deltas.get(item.product_id, 0) + item.quantity
+            for product_id, delta in stock_deltas.items():
+                Product.apply_stock_delta(product_id, delta)
+
+        created_items = ProductVariantItem.objects.with_details().filter(
+            id__in=[item.id for item in product_items]
+        )
+        return Response(
+            ProductVariantItemSerializer(created_items, many=True).data,
+            status=status.HTTP_201_CREATED
+        )
+
     @action(detail=False, methods=['post'], url_path='bulk-create')
     def bulk_create(self, request):
-        items_data = request.data.get('items', [])
-        created_items = []
-        product_id = None
-        
-        for item_data in items_data:
-            serializer = ProductVariantItemCreateUpdateSerializer(data=item_data)
-            if serializer.is_valid():
-                item = serializer.save()
-                created_items.append(ProductVariantItemSerializer(item).data)
-                product_id = item.product.id
-            else:
-                return Response(
-                    serializer.errors,
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-        
-        # Update total stock for the product
-        if product_id:
-            product = Product.objects.get(id=product_id)
-            self._update_product_total_stock(product)
-            
-        return Response(created_items, status=status.HTTP_201_CREATED)
+        return self._bulk_create_items(request.data.get('items', []))
 
     @action(detail=False, methods=['post'], url_path='add-to-product/(?P<product_id>[^/.]+)')
     def add_to_product(self, request, product_id=None):
@@ -125,31 +420,14 @@ class ProductVariantItemViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_404_NOT_FOUND
             )
         
-        items_data = request.data.get('items', [])
-        created_items = []
-        
-        for item_data in items_data:
-            # Ensure the product ID is set correctly
-            item_data['product'] = product_id
-            
-            # If hsn_code is not provided, it will be auto-populated from product
-            serializer = ProductVariantItemCreateUpdateSerializer(data=item_data)
-            if serializer.is_valid():
-                item = serializer.save()
-                created_items.append(ProductVariantItemSerializer(item).data)
-            else:
-                return Response(
-                    serializer.errors,
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-        
-        # Update total stock for the product
-        self._update_product_total_stock(product)
-            
-        return Response(created_items, status=status.HTTP_201_CREATED)
+        # The product ID from the URL applies to every item; hsn_code falls back to the product's
+        return self._bulk_create_items(request.data.get('items', []), product=product)
     
     @action(detail=False, methods=['get'], url_path='by-product/(?P<product_id>[^/.]+)')
     def by_product(self, request, product_id=None):
+        return self.conditional(partial(self.product_listings, product_id))
+
+    def product_listings(self, product_id):
         try:
             product = Product.objects.get(id=product_id)
         except Product.DoesNotExist:
@@ -158,14 +436,32 @@ class ProductVariantItemViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_404_NOT_FOUND
             )
             
-        variants = ProductVariantItem.objects.filter(product=product)
-        serializer = ProductVariantItemSerializer(variants, many=True)
+        listings = VariantListing.objects.filter(product=product).order_by('product_code')
+        serializer = VariantListingSerializer(listings, many=True)
         return Response(serializer.data)
     
+    @action(detail=True, methods=['get'], url_path='locations')
+    def locations(self, request, pk=None):
+        """
+        Stock of this variant at each location that has held any
+        """
+        try:
+            ProductVariantItem.objects.only('id').get(pk=uuid.UUID(pk))
+        except (ValueError, ProductVariantItem.DoesNotExist):
+            return Response(
+                {"error": "Product variant not found"},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        rows = LocationStock.objects.filter(product_variant_id=pk).select_related(
+            'location', 'product_variant'
+        ).order_by('location__code')
+        serializer = LocationStockSerializer(rows, many=True)
+        return Response(serializer.data)
+
     @action(detail=True, methods=['put'], url_path='adjust-stock')
+    @idempotent
     def adjust_stock(self, request, pk=None):
         try:
-            variant_item = self.get_object()
             quantity_change = request.data.get('quantity_change')
 
             if quantity_change is None:
@@ -173,18 +469,43 @@ class ProductVariantItemViewSet(viewsets.ModelViewSet):
                     {"error": "quantity_change is required"},
                     status=status.HTTP_400_BAD_REQUEST
                 )
+
+            quantity_change = parse_quantity(quantity_change)
+            if not quantity_change:
+                return Response(
+                    {"error": "quantity_change must be a non-zero integer"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            try:
+                unit_cost = parse_unit_cost(request.data.get('unit_cost'))
+                location_id = parse_location(request.data.get('location_id'))
+            except ValueError as e:
+                return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            if unit_cost is not None and quantity_change < 0:
+                return Response(
+                    {"error": "Only receipts carry a unit cost"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
             
-            # Update the stock
-            variant_item.quantity += int(quantity_change)
-            variant_item.save()
-            
-            # Update total product stock
-            product = variant_item.product
-            total_stock = ProductVariantItem.objects.filter(product=product).aggregate(
-                models.Sum('quantity')
-            )['quantity__sum'] or 0
-            product.total_stock = total_stock
-            product.save()
+            with transaction.atomic():
+                variant_item = ProductVariantItem.objects.select_for_update().get(pk=pk)
+
+                # Record the adjustment; the ledger applies it with a conditional F() update
+                stock_transaction = StockTransaction.objects.create(
+                    product_variant=variant_item,
+                    quantity=quantity_change,
+                    transaction_type='adjustment',
+                    user=request.user,
+                    notes=request.data.get('notes', ''),
+                    reference_number=request.data.get('reference_number', ''),
+                    unit_cost=unit_cost,
+                    source_location_id=location_id if quantity_change < 0 else None,
+                    destination_location_id=location_id if quantity_change > 0 else None
+                )
+                self.stock_transactions = [stock_transaction]
+                
+                # Total product stock was shifted by the same delta
+                total_stock = Product.objects.values_list('total_stock', flat=True).get(pk=variant_item.product_id)
             
             return Response({
                 'id': variant_item.id,
@@ -197,6 +518,11 @@ class ProductVariantItemViewSet(viewsets.ModelViewSet):
                 {"error": "Product variant not found"},
                 status=status.HTTP_404_NOT_FOUND
             )
+        except InsufficientStock:
+            return Response(
+                {"error": "Insufficient stock"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         except Exception as e:
             return Response(
                 {"error": str(e)},
@@ -204,7 +530,7 @@ class ProductVariantItemViewSet(viewsets.ModelViewSet):
             )
 
 class ProductConfigurationViewSet(viewsets.ModelViewSet):
-    queryset = ProductConfiguration.objects.all()
+    queryset = ProductConfiguration.objects.select_related('variant_option__variant').order_by('id')
     serializer_class = ProductConfigurationSerializer
     permission_classes = [IsAuthenticated]
     
@@ -218,7 +544,7 @@ class ProductConfigurationViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_404_NOT_FOUND
             )
             
-        configurations = ProductConfiguration.objects.filter(product_item=item)
+        configurations = self.get_queryset().filter(product_item=item)
         serializer = ProductConfigurationSerializer(configurations, many=True)
         return Response(serializer.data)
     
@@ -227,11 +553,23 @@ class StockManagementViewSet(viewsets.ModelViewSet):
     """
     Comprehensive Stock Management ViewSet
     """
-    queryset = StockTransaction.objects.all()
+    queryset = StockTransaction.objects.with_details()
     serializer_class = StockTransactionSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = TimestampCursorPagination
+
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
+
+    def perform_create(self, serializer):
+        try:
+            self.stock_transactions = [serializer.save()]
+        except InsufficientStock as e:
+            raise serializers.ValidationError({'quantity': [str(e)]})
 
     @action(detail=False, methods=['POST'], url_path='add-stock')
+    @idempotent
     def add_stock(self, request):
         """
         Add stock for a specific product variant
@@ -248,35 +586,34 @@ class StockManagementViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
+            quantity = parse_quantity(quantity)
+            if quantity is None or quantity <= 0:
+                return Response(
+                    {"error": "Quantity must be a positive integer"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            try:
+                unit_cost = parse_unit_cost(request.data.get('unit_cost'))
+                location_id = parse_location(request.data.get('location_id'))
+            except ValueError as e:
+                return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
             with transaction.atomic():
-                product_variant = ProductVariantItem.objects.get(id=product_variant_id)
+                product_variant = ProductVariantItem.objects.select_for_update().get(id=product_variant_id)
                 
-                # Create stock transaction
+                # Create stock transaction; unit_cost defaults to the variant's price
                 stock_transaction = StockTransaction.objects.create(
                     product_variant=product_variant,
                     quantity=quantity,
                     transaction_type='add',
                     user=request.user,
                     notes=notes,
-                    reference_number=reference_number
+                    reference_number=reference_number,
+                    unit_cost=unit_cost,
+                    destination_location_id=location_id
                 )
-
-                # Update product total stock
-                product = product_variant.product
-                product.total_stock = ProductVariantItem.objects.filter(
-                    product=product
-                ).aggregate(total=Sum('quantity'))['total'] or 0
-                product.save()
-
-                # Check low stock alert
-                try:
-                    low_stock_alert = LowStockAlert.objects.get(product_variant=product_variant)
-                    if low_stock_alert.is_active and low_stock_alert.check_stock_level():
-                        # Implement notification logic here (e.g., email, SMS)
-                        low_stock_alert.last_notified = timezone.now()
-                        low_stock_alert.save()
-                except LowStockAlert.DoesNotExist:
-                    pass
+                self.stock_transactions = [stock_transaction]
+                # Low-stock alerts are evaluated after commit by process_low_stock_alerts
 
                 serializer = self.get_serializer(stock_transaction)
                 return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -293,6 +630,7 @@ class StockManagementViewSet(viewsets.ModelViewSet):
             )
 
     @action(detail=False, methods=['POST'], url_path='remove-stock')
+    @idempotent
     def remove_stock(self, request):
         """
         Remove stock for a specific product variant
@@ -309,32 +647,100 @@ class StockManagementViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
+            quantity = parse_quantity(quantity)
+            if quantity is None or quantity <= 0:
+                return Response(
+                    {"error": "Quantity must be a positive integer"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            try:
+                location_id = parse_location(request.data.get('location_id'))
+            except ValueError as e:
+                return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
             with transaction.atomic():
-                product_variant = ProductVariantItem.objects.get(id=product_variant_id)
-                
-                # Check if sufficient stock is available
-                if product_variant.quantity < quantity:
-                    return Response(
-                        {"error": "Insufficient stock"},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-
-                # Create stock transaction
+                product_variant = ProductVariantItem.objects.select_for_update().get(id=product_variant_id)
+
+                # The stock check and the decrement happen in one conditional UPDATE;
+                # InsufficientStock rolls the transaction back
                 stock_transaction = StockTransaction.objects.create(
                     product_variant=product_variant,
                     quantity=quantity,
                     transaction_type='remove',
                     user=request.user,
                     notes=notes,
-                    reference_number=reference_number
+                    reference_number=reference_number,
+                    source_location_id=location_id
+                )
+                self.stock_transactions = [stock_transaction]
+
+                serializer = self.get_serializer(stock_transaction)
+                return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+        except ProductVariantItem.DoesNotExist:
+            return Response(
+                {"error": "Product variant not found"},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        except InsufficientStock:
+            return Response(
+                {"error": "Insufficient stock"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        except Exception as e:
+            return Response(
+                {"error": str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+    @action(detail=False, methods=['POST'], url_path='transfer-stock')
+    @idempotent
+    def transfer_stock(self, request):
+        """
+        Move stock of a specific product variant from one location to another
+        """
+        try:
+            product_variant_id = request.data.get('product_variant_id')
+            quantity = request.data.get('quantity')
+
+            if not product_variant_id or not quantity:
+                return Response(
+                    {"error": "Product variant ID and quantity are required"},
+                    status=status.HTTP_400_BAD_REQUEST
                 )
 
-                # Update product total stock
-                product = product_variant.product
-                product.total_stock = ProductVariantItem.objects.filter(
-                    product=product
-                ).aggregate(total=Sum('quantity'))['total'] or 0
-                product.save()
+            quantity = parse_quantity(quantity)
+            if quantity is None or quantity <= 0:
+                return Response(
+                    {"error": "Quantity must be a positive integer"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            try:
+                source = parse_location(request.data.get('source_location_id'), 'source_location_id')
+                destination = parse_location(request.data.get('destination_location_id'), 'destination_location_id')
+            except ValueError as e:
+                return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            if source is None or destination is None or source == destination:
+                return Response(
+                    {"error": "Transfers need distinct source and destination locations"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            with transaction.atomic():
+                product_variant = ProductVariantItem.objects.select_for_update().get(id=product_variant_id)
+
+                # The variant's total is unchanged; only its stock at the two locations moves
+                stock_transaction = StockTransaction.objects.create(
+                    product_variant=product_variant,
+                    quantity=quantity,
+                    transaction_type='transfer',
+                    user=request.user,
+                    notes=request.data.get('notes', ''),
+                    reference_number=request.data.get('reference_number', ''),
+                    source_location_id=source,
+                    destination_location_id=destination
+                )
+                self.stock_transactions = [stock_transaction]
 
                 serializer = self.get_serializer(stock_transaction)
                 return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -344,12 +750,167 @@ class StockManagementViewSet(viewsets.ModelViewSet):
                 {"error": "Product variant not found"},
                 status=status.HTTP_404_NOT_FOUND
             )
+        except InsufficientStock:
+            return Response(
+                {"error": "Insufficient stock at the source location"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         except Exception as e:
             return Response(
                 {"error": str(e)},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+    @action(detail=False, methods=['POST'], url_path='bulk-movements')
+    @idempotent
+    def bulk_movements(self, request):
+        """
+        Apply a batch of stock movements in one request and report a result per line
+        """
+        serializer = StockMovementBatchSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        batch = serializer.validated_data
+        stock_transactions = [
+            StockTransaction(
+                product_variant_id=line['product_variant_id'],
+                quantity=line['quantity'],
+                transaction_type=line['transaction_type'],
+                user=request.user,
+                notes=line.get('notes', ''),
+                reference_number=line.get('reference_number') or batch.get('reference_number', ''),
+                unit_cost=line.get('unit_cost'),
+                source_location_id=line.get('source_location_id'),
+                destination_location_id=line.get('destination_location_id')
+            )
+            for line in batch['lines']
+        ]
+
+        with transaction.atomic():
+            errors = StockTransaction.bulk_apply(stock_transactions, all_or_nothing=batch['all_or_nothing'])
+
+        applied = None in errors and not (batch['all_or_nothing'] and any(errors))
+        if applied:
+            self.stock_transactions = [
+                stock_transaction for stock_transaction, error in zip(stock_transactions, errors) if error is None
+            ]
+        results = []
+        for line_number, (stock_transaction, error) in enumerate(zip(stock_transactions, errors)):
+            if error is not None:
+                results.append({'line': line_number, 'status': 'rejected', 'error': error})
+            elif not applied:
+                results.append({'line': line_number, 'status': 'not_applied'})
+            else:
+                results.append({
+                    'line': line_number,
+                    'status': 'applied',
+                    'transaction_id': stock_transaction.id,
+                    'product_variant_id': stock_transaction.product_variant_id,
+                    'new_quantity': stock_transaction.quantity_after,
+                })
+
+        return Response(
+            {'results': results},
+            status=status.HTTP_201_CREATED if applied else status.HTTP_400_BAD_REQUEST
+        )
+
+    @action(detail=False, methods=['GET'], url_path='export')
+    def export(self, request):
+        """
+        Stream the stock ledger oldest first, optionally limited to start_date/end_date,
+        a transaction_type, a product_variant or a location
+        """
+        transactions = StockTransaction.objects.order_by('timestamp', 'id')
+        transaction_type = request.query_params.get('transaction_type')
+        if transaction_type:
+            transactions = transactions.filter(transaction_type=transaction_type)
+        product_variant_id = request.query_params.get('product_variant')
+        if product_variant_id:
+            try:
+                transactions = transactions.filter(product_variant_id=uuid.UUID(product_variant_id))
+            except ValueError:
+                return Response({"error": "Invalid product_variant"}, status=status.HTTP_400_BAD_REQUEST)
+        location_id = request.query_params.get('location')
+        if location_id:
+            try:
+                transactions = filter_location(transactions, location_id)
+            except ValueError:
+                return Response({"error": "Invalid location"}, status=status.HTTP_400_BAD_REQUEST)
+
+        return export_response(
+            request,
+            transactions,
+            [
+                ('id', 'id'),
+                ('timestamp', 'timestamp'),
+                ('transaction_type', 'transaction_type'),
+                ('quantity', 'quantity'),
+                ('product_variant_id', 'product_variant_id'),
+                ('product_code', 'product_variant__product_code'),
+                ('product_name', 'product_variant__product__name'),
+                ('user', 'user__username'),
+                ('reference_number', 'reference_number'),
+                ('notes', 'notes'),
+                ('unit_cost', 'unit_cost'),
+                ('source_location', 'source_location__code'),
+                ('destination_location', 'destination_location__code'),
+            ],
+            'stock_ledger',
+            date_field='timestamp'
+        )
+
+    @action(detail=False, methods=['GET'], url_path='valuation')
+    def valuation(self, request):
+        """
+        Stock value by FIFO and by weighted-average cost as it stood at ?as_of= (default
+        now), per category or, with group_by=variant, per variant; optionally limited
+        to one category
+        """
+        as_of = timezone.now()
+        if request.query_params.get('as_of'):
+            try:
+                as_of = parse_date_bound(request.query_params['as_of'], end=True)
+            except ValueError as e:
+                return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        group_by = request.query_params.get('group_by', 'category')
+        if group_by not in ('category', 'variant'):
+            return Response({"error": "group_by must be category or variant"}, status=status.HTTP_400_BAD_REQUEST)
+        variants = ProductVariantItem.objects.all()
+        if request.query_params.get('category'):
+            try:
+                variants = variants.filter(product__subcategory__category=uuid.UUID(request.query_params['category']))
+            except ValueError:
+                return Response({"error": "Invalid category"}, status=status.HTTP_400_BAD_REQUEST)
+
+        states = value_inventory(variants, as_of=as_of)
+        if group_by == 'category':
+            results = CategoryValuationSerializer(value_by_category(states, variants), many=True).data
+        else:
+            codes = VariantListing.objects.filter(variant__in=variants).order_by('product_code').values_list(
+                'pk', 'product_code'
+            )
+            results = VariantValuationSerializer([
+                {
+                    'product_variant': pk,
+                    'product_code': code,
+                    'quantity': states[pk].quantity,
+                    'average_cost': states[pk].average_cost,
+                    'fifo_value': states[pk].fifo_value,
+                    'average_value': states[pk].average_value,
+                }
+                for pk, code in codes if pk in states
+            ], many=True).data
+
+        data = StockValuationSerializer({
+            'as_of': as_of,
+            'quantity': sum(state.quantity for state in states.values()),
+            'fifo_value': sum(state.fifo_value for state in states.values()),
+            'average_value': sum(state.average_value for state in states.values()),
+        }).data
+        data['results'] = results
+        return Response(data)
+
     @action(detail=False, methods=['GET'], url_path='stock-history/(?P<product_variant_id>[^/.]+)')
     def stock_history(self, request, product_variant_id=None):
         """
@@ -359,7 +920,7 @@ class StockManagementViewSet(viewsets.ModelViewSet):
             product_variant = ProductVariantItem.objects.get(id=product_variant_id)
             
             # Get stock transactions with optional filtering
-            transactions = StockTransaction.objects.filter(product_variant=product_variant)
+            transactions = self.get_queryset().filter(product_variant=product_variant)
             
             # Optional date range filtering
             start_date = request.query_params.get('start_date')
@@ -374,6 +935,14 @@ class StockManagementViewSet(viewsets.ModelViewSet):
             transaction_type = request.query_params.get('transaction_type')
             if transaction_type:
                 transactions = transactions.filter(transaction_type=transaction_type)
+
+            # Optional location filtering, out of or into it
+            location_id = request.query_params.get('location')
+            if location_id:
+                try:
+                    transactions = filter_location(transactions, location_id)
+                except ValueError:
+                    return Response({"error": "Invalid location"}, status=status.HTTP_400_BAD_REQUEST)
             
             # Pagination
             page = self.paginate_queryset(transactions)
@@ -395,25 +964,214 @@ class StockManagementViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
-class LowStockAlertViewSet(viewsets.ModelViewSet):
+class StockReservationViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Holds on stock for orders being picked: reserve lines, then commit (remove
+    the held units from stock) or release them. Holds not closed by expires_at
+    are released by the expire_stock_reservations command.
+    """
+    queryset = StockReservation.objects.with_details()
+    serializer_class = StockReservationSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = CreatedAtCursorPagination
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action != 'list':
+            return queryset
+        for param in ('status', 'reference_number', 'product_variant'):
+            value = self.request.query_params.get(param)
+            if value:
+                queryset = queryset.filter(**{param: value})
+        return queryset
+
+    @action(detail=False, methods=['POST'], url_path='reserve')
+    @idempotent
+    def reserve(self, request):
+        """
+        Hold stock for a batch of lines and report a result per line
+        """
+        serializer = ReservationBatchSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        batch = serializer.validated_data
+        ttl = batch.get('ttl_seconds', getattr(settings, 'STOCK_RESERVATION_TTL', 15 * 60))
+        with transaction.atomic():
+            reservations, errors = StockReservation.reserve(
+                [(line['product_variant_id'], line['quantity']) for line in batch['lines']],
+                expires_at=timezone.now() + timedelta(seconds=ttl),
+                user=request.user,
+                reference_number=batch.get('reference_number', ''),
+                all_or_nothing=batch['all_or_nothing'],
+            )
+
+        reserved = any(reservations)
+        results = []
+        for line_number, (reservation, error) in enumerate(zip(reservations, errors)):
+            if error is not None:
+                results.append({'line': line_number, 'status': 'rejected', 'error': error})
+            elif reservation is None:
+                results.append({'line': line_number, 'status': 'not_reserved'})
+            else:
+                results.append({
+                    'line': line_number,
+                    'status': 'reserved',
+                    'reservation_id': reservation.id,
+                    'product_variant_id': reservation.product_variant_id,
+                    'available': reservation.available,
+                    'expires_at': reservation.expires_at,
+                })
+
+        return Response(
+            {'results': results},
+            status=status.HTTP_201_CREATED if reserved else status.HTTP_400_BAD_REQUEST
+        )
+
+    def close_reservations(self, request, closed_status):
+        serializer = ReservationCloseSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        reservation_ids = serializer.validated_data['reservation_ids']
+        with transaction.atomic():
+            location = serializer.validated_data.get('location')
+            reservations, errors = StockReservation.close(
+                reservation_ids, closed_status, user=request.user,
+                reference_number=serializer.validated_data.get('reference_number', ''),
+                location_id=location.pk if location else None,
+            )
+
+        if errors:
+            not_closed = f"not_{closed_status}"
+            return Response({'results': [
+                {'reservation_id': pk, 'status': 'rejected', 'error': errors[pk]} if pk in errors
+                else {'reservation_id': pk, 'status': not_closed}
+                for pk in dict.fromkeys(reservation_ids)
+            ]}, status=status.HTTP_400_BAD_REQUEST)
+
+        self.stock_transactions = [
+            reservation.stock_transaction for reservation in reservations if reservation.transaction_id
+        ]
+        return Response({'results': [
+            {
+                'reservation_id': reservation.id,
+                'status': closed_status,
+                'product_variant_id': reservation.product_variant_id,
+                'transaction_id': reservation.transaction_id,
+            }
+            for reservation in reservations
+        ]}, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['POST'], url_path='commit')
+    @idempotent
+    def commit(self, request):
+        """
+        Remove the units held by a set of reservations from stock
+        """
+        return self.close_reservations(request, 'committed')
+
+    @action(detail=False, methods=['POST'], url_path='release')
+    @idempotent
+    def release(self, request):
+        """
+        Return the units held by a set of reservations to available stock
+        """
+        return self.close_reservations(request, 'released')
+
+
+class LocationViewSet(viewsets.ModelViewSet):
+    """
+    Warehouses and other places stock is held, and the stock held at each
+    """
+    queryset = Location.objects.order_by('code')
+    serializer_class = LocationSerializer
+    permission_classes = [IsAuthenticated]
+
+    def destroy(self, request, *args, **kwargs):
+        location = self.get_object()
+        if location.is_default:
+            return Response(
+                {"error": "The default location cannot be deleted"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            location.delete()
+        except models.ProtectedError:
+            return Response(
+                {"error": "Location holds stock or has stock history; deactivate it instead"},
+                status=status.HTTP_409_CONFLICT
+            )
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @action(detail=True, methods=['GET'], url_path='stock')
+    def stock(self, request, pk=None):
+        """
+        Stock held at this location, by variant; in_stock=true leaves out empty rows
+        """
+        location = self.get_object()
+        rows = LocationStock.objects.filter(location=location).select_related('location', 'product_variant')
+        if request.query_params.get('in_stock') == 'true':
+            rows = rows.filter(quantity__gt=0)
+        paginator = LocationStockCursorPagination()
+        page = paginator.paginate_queryset(rows, request, view=self)
+        serializer = LocationStockSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+
+class LowStockAlertViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing low stock alerts
     """
-    queryset = LowStockAlert.objects.all()
+    queryset = LowStockAlert.objects.with_details().order_by('id')
     serializer_class = LowStockAlertSerializer
     permission_classes = [IsAuthenticated]
+    # Alerts render their variant's details and stock, as held by its listing
+    validator_fields = ('updated_at', 'product_variant__listing__updated_at')
 
     @action(detail=False, methods=['GET'], url_path='current-alerts')
     def current_low_stock_alerts(self, request):
         """
-        Retrieve current low stock alerts
+        Every variant at or below its effective threshold (its own alert's, else its
+        subcategory's or category's default), most depleted first
         """
-        low_stock_alerts = LowStockAlert.objects.filter(
-            is_active=True, 
-            product_variant__quantity__lte=F('threshold')
-        )
-        print('====',low_stock_alerts)
-        serializer = self.get_serializer(low_stock_alerts, many=True)
-        return Response(serializer.data)
+        variants = ProductVariantItem.objects.low_stock().with_details().select_related(
+            'lowstockalert'
+        ).order_by('quantity', 'id')
+        page = self.paginate_queryset(variants)
+        serializer = LowStockVariantSerializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
 
+class DashboardViewSet(viewsets.ViewSet):
+    """
+    Dashboard figures, read from the counters kept up to date by stock_summary
+    rather than aggregated over products, variants and the ledger per request.
+    low_stock is the exception: a cached live count, as of low_stock_as_of
+    """
+    permission_classes = [IsAuthenticated]
 
+    @action(detail=False, methods=['GET'], url_path='summary')
+    def summary(self, request):
+        categories = Category.objects.select_related('stock_summary').order_by('name', 'id')
+        by_category = [
+            getattr(category, 'stock_summary', None) or CategoryStockSummary(category=category)
+            for category in categories
+        ]
+        today = timezone.localdate()
+        movements = DailyStockMovement.objects.filter(date=today).first() or DailyStockMovement(date=today)
+        low_stock, low_stock_as_of = low_stock_count()
+        serializer = DashboardSummarySerializer({
+            'products': sum(summary.products for summary in by_category),
+            'variants': sum(summary.variants for summary in by_category),
+            'categories': len(by_category),
+            'units': sum(summary.units for summary in by_category),
+            'stock_value': sum(summary.stock_value for summary in by_category),
+            'low_stock': low_stock,
+            'low_stock_as_of': low_stock_as_of,
+            'movements_today': movements.movements,
+            'units_in_today': movements.units_in,
+            'units_out_today': movements.units_out,
+            'by_category': by_category,
+        })
+        return Response(serializer.data)
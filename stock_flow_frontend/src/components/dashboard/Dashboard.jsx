@@ -30,6 +30,8 @@ import {
     Package, 
     ArrowDownCircle, 
     ArrowUpCircle,
+    AlertTriangle,
+    Activity,
   } from "lucide-react";
 import Header from "../partials/Header";
 import api from "@/config/axios";
@@ -41,58 +43,68 @@ import StockManagementTab from "./stock/StockManagementTab";
 
 // Main Dashboard Component
 const Dashboard = () => {
-  const [products, setProducts] = useState([]);
-  const [categories, setCategories] = useState([]);
-  const [variants, setVariants] = useState([]);
-  const [loading, setLoading] = useState(true);
+  const [summary, setSummary] = useState(null);
+  // Bumped after every write so the open tab reloads its list
+  const [version, setVersion] = useState(0);
   
   useEffect(() => {
-    fetchDashboardData();
+    fetchSummary();
   }, []);
 
-  const fetchDashboardData = async () => {
-    setLoading(true);
+  // The header figures are one small response from the server-side counters;
+  // each tab loads the lists it shows when it is opened
+  const fetchSummary = async () => {
     try {
-      const [productsRes, categoriesRes, variantsRes] = await Promise.all([
-        api.get('/product-variants/'),
-        api.get('/categories/'),
-        api.get('/variants/'),
-      ]);
-      
-      setProducts(productsRes.data);
-      setCategories(categoriesRes.data);
-      setVariants(variantsRes.data);
+      const response = await api.get('/dashboard/summary/');
+      setSummary(response.data);
     } catch (error) {
-      console.error("Error fetching dashboard data:", error);
-    } finally {
-      setLoading(false);
+      console.error("Error fetching dashboard summary:", error);
     }
   };
 
+  const refreshData = () => {
+    setVersion(version => version + 1);
+    fetchSummary();
+  };
+
 
   return (
     <div className="flex flex-col min-h-screen">
         <Header/>
       <main className="flex-1 p-4 md:p-6">
-        <div className="grid gap-4 md:grid-cols-3 mb-6">
+        <div className="grid gap-4 md:grid-cols-3 lg:grid-cols-5 mb-6">
           <SummaryCard
             title="Total Products"
-            value={products.length}
-            description="Products in inventory"
+            value={summary ? summary.products : "-"}
+            description={summary ? `${summary.variants} variants in inventory` : "Products in inventory"}
             icon={<Package className="h-4 w-4 text-muted-foreground" />}
           />
           <SummaryCard 
             title="Categories" 
-            value={categories.length}
+            value={summary ? summary.categories : "-"}
             description="Product categories"
             icon={<Package className="h-4 w-4 text-muted-foreground" />}
           />
           <SummaryCard 
             title="Stock Value" 
-            value={`${calculateTotalStockValue(products).toFixed(2)}`}
-            description="Total inventory value"
+            value={summary ? Number(summary.stock_value).toFixed(2) : "-"}
+            description={summary ? `${summary.units} units in stock` : "Total inventory value"}
             icon={<Package className="h-4 w-4 text-muted-foreground" />}
           />
+          <SummaryCard 
+            title="Low Stock" 
+            value={summary ? summary.low_stock : "-"}
+            description={summary
+              ? `Variants at or below their threshold, as of ${new Date(summary.low_stock_as_of).toLocaleTimeString()}`
+              : "Variants at or below their threshold"}
+            icon={<AlertTriangle className="h-4 w-4 text-muted-foreground" />}
+          />
+          <SummaryCard 
+            title="Movements Today" 
+            value={summary ? summary.movements_today : "-"}
+            description={summary ? `${summary.units_in_today} in, ${summary.units_out_today} out` : "Stock movements"}
+            icon={<Activity className="h-4 w-4 text-muted-foreground" />}
+          />
         </div>
 
         {/* Main Tabs */}
@@ -106,24 +118,21 @@ const Dashboard = () => {
           
           <TabsContent value="products" className="space-y-4">
             <ProductsTab
-              products={products}
-              categories={categories}
-              variants={variants}
-              refreshData={fetchDashboardData}
+              version={version}
+              refreshData={refreshData}
             />
           </TabsContent>
           
           <TabsContent value="categories" className="space-y-4">
             <CategoriesTab 
-              categories={categories}
-              refreshData={fetchDashboardData}
+              version={version}
+              refreshData={refreshData}
             />
           </TabsContent>
           
           <TabsContent value="stock" className="space-y-4">
             <StockManagementTab 
-              products={products}
-              refreshData={fetchDashboardData}
+              refreshData={refreshData}
             />
           </TabsContent>
         </Tabs>
@@ -132,13 +141,6 @@ const Dashboard = () => {
   );
 };
 
-// Helper function to calculate total stock value
-const calculateTotalStockValue = (products) => {
-  return products.reduce((total, product) => {
-    const productValue = product.quantity * (product.price || 0);
-    return total + productValue;
-  }, 0);
-};
 
 
 
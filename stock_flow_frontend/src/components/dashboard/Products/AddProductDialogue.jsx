@@ -1,4 +1,4 @@
-import api from '@/config/axios';
+import api, { fetchAll } from '@/config/axios';
 import React, { useState, useEffect, useRef } from 'react';
 import { useForm, useFieldArray } from 'react-hook-form';
 import { zodResolver } from '@hookform/resolvers/zod';
@@ -153,8 +153,7 @@ const AddProductDialog = ({ open, onOpenChange, refreshData }) => {
   const fetchCategories = async () => {
     setIsCategoryLoading(true);
     try {
-      const response = await api.get('/categories/');
-      setCategories(response.data);
+      setCategories(await fetchAll('/categories/'));
     } catch (error) {
       console.error("Error fetching categories:", error);
       toast.error("Failed to load categories");
@@ -167,8 +166,7 @@ const AddProductDialog = ({ open, onOpenChange, refreshData }) => {
   const fetchSubCategories = async (categoryId) => {
     setIsSubCategoryLoading(true);
     try {
-      const response = await api.get(`/sub-categories/?category=${categoryId}`);
-      setSubCategories(response.data);
+      setSubCategories(await fetchAll(`/sub-categories/?category=${categoryId}`));
     } catch (error) {
       console.error("Error fetching subcategories:", error);
       toast.error("Failed to load subcategories");
@@ -181,14 +179,13 @@ const AddProductDialog = ({ open, onOpenChange, refreshData }) => {
   const fetchVariants = async (subcategoryId) => {
     setIsVariantLoading(true);
     try {
-      const response = await api.get(`/variants/?subcategory=${subcategoryId}`);
+      const variants = await fetchAll(`/variants/?subcategory=${subcategoryId}`);
       const variantsWithOptions = await Promise.all(
-        response.data.map(async (variant) => {
+        variants.map(async (variant) => {
           try {
-            const optionsResponse = await api.get(`/variant-options/?variant=${variant.id}`);
             return {
               ...variant,
-              options: optionsResponse.data
+              options: await fetchAll(`/variant-options/?variant=${variant.id}`)
             };
           } catch (error) {
             console.error(`Error fetching options for variant ${variant.id}:`, error);
@@ -1,12 +1,34 @@
-import React, { useState } from 'react'
+import React, { useState, useEffect } from 'react'
 import ProductsTable from './ProductsTable';
 import AddProductDialog from './AddProductDialogue';
 import { Button } from '@/components/ui/button';
 import { PlusCircle } from 'lucide-react';
+import { fetchPage } from '@/config/axios';
 
 // Products Tab Component
-const ProductsTab = ({ products, refreshData }) => {
+const ProductsTab = ({ version, refreshData }) => {
   const [showAddProduct, setShowAddProduct] = useState(false);
+  const [products, setProducts] = useState([]);
+  const [next, setNext] = useState(null);
+  const [loading, setLoading] = useState(false);
+
+  // Start from the first page when the tab opens and after every write
+  useEffect(() => {
+    fetchProducts('/product-variants/', false);
+  }, [version]);
+
+  const fetchProducts = async (url, append) => {
+    setLoading(true);
+    try {
+      const page = await fetchPage(url);
+      setProducts(products => append ? [...products, ...page.results] : page.results);
+      setNext(page.next);
+    } catch (error) {
+      console.error("Error fetching products:", error);
+    } finally {
+      setLoading(false);
+    }
+  };
   
   return (
     <div>
@@ -18,6 +40,14 @@ const ProductsTab = ({ products, refreshData }) => {
       </div>
       
       <ProductsTable products={products} refreshData={refreshData} />
+
+      {next && (
+        <div className="flex justify-center mt-4">
+          <Button variant="outline" onClick={() => fetchProducts(next, true)} disabled={loading}>
+            {loading ? 'Loading...' : 'Load more'}
+          </Button>
+        </div>
+      )}
       
       <AddProductDialog 
         open={showAddProduct}
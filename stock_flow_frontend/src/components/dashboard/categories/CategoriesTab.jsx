@@ -1,7 +1,7 @@
 import { Button } from '@/components/ui/button';
 import { Edit, PlusCircle, Trash2, ChevronRight, Plus } from 'lucide-react';
-import React, { useState } from 'react';
-import api from "@/config/axios";
+import React, { useState, useEffect } from 'react';
+import api, { fetchAll } from "@/config/axios";
 
 import {
   Table,
@@ -24,7 +24,8 @@ import VariantDialog from '../variants/VariantDialog';
 import VariantOptionDialog from '../variants/VariantOptionsDialog';
 
 // Main Categories Tab Component
-const CategoriesTab = ({ categories, refreshData }) => {
+const CategoriesTab = ({ version, refreshData }) => {
+  const [categories, setCategories] = useState([]);
   const [showDialog, setShowDialog] = useState(false);
   const [dialogType, setDialogType] = useState('category');
   const [selectedCategory, setSelectedCategory] = useState(null);
@@ -37,12 +38,25 @@ const CategoriesTab = ({ categories, refreshData }) => {
   const [expandedSubcategory, setExpandedSubcategory] = useState(null);
   const [expandedVariant, setExpandedVariant] = useState(null);
   
+  // Loaded when the tab opens, and again after every write
+  useEffect(() => {
+    fetchCategories();
+  }, [version]);
+
+  const fetchCategories = async () => {
+    try {
+      setCategories(await fetchAll('/categories/'));
+    } catch (error) {
+      console.error("Error fetching categories:", error);
+      setCategories([]);
+    }
+  };
+
   const fetchSubcategories = async (categoryId) => {
     if (!categoryId) return;
     
     try {
-      const response = await api.get(`/sub-categories/?category=${categoryId}`);
-      setSubcategories(response.data);
+      setSubcategories(await fetchAll(`/sub-categories/?category=${categoryId}`));
     } catch (error) {
       console.error("Error fetching subcategories:", error);
       setSubcategories([]);
@@ -53,8 +67,7 @@ const CategoriesTab = ({ categories, refreshData }) => {
     if (!subcategoryId) return;
     
     try {
-      const response = await api.get(`/variants/?subcategory=${subcategoryId}`);
-      setVariants(response.data);
+      setVariants(await fetchAll(`/variants/?subcategory=${subcategoryId}`));
     } catch (error) {
       console.error("Error fetching variants:", error);
       setVariants([]);
@@ -65,8 +78,7 @@ const CategoriesTab = ({ categories, refreshData }) => {
     if (!variantId) return;
     
     try {
-      const response = await api.get(`/variant-options/?variant=${variantId}`);
-      setVariantOptions(response.data);
+      setVariantOptions(await fetchAll(`/variant-options/?variant=${variantId}`));
     } catch (error) {
       console.error("Error fetching variant options:", error);
       setVariantOptions([]);
@@ -30,9 +30,9 @@ import {
   ToastDescription,
   ToastClose 
 } from "@/components/ui/toast";
-import api from "@/config/axios";
+import api, { fetchAll, fetchPage } from "@/config/axios";
 
-const StockManagementTab = () => {
+const StockManagementTab = ({ refreshData }) => {
   const [products1, setProducts1] = useState([]);
   const [selectedProduct, setSelectedProduct] = useState('');
   const [selectedVariant, setSelectedVariant] = useState(null);
@@ -40,7 +40,9 @@ const StockManagementTab = () => {
   const [quantity, setQuantity] = useState(1);
   const [operation, setOperation] = useState('add');
   const [stockHistory, setStockHistory] = useState([]);
+  const [stockHistoryNext, setStockHistoryNext] = useState(null);
   const [lowStockAlerts, setLowStockAlerts] = useState([]);
+  const [lowStockAlertsNext, setLowStockAlertsNext] = useState(null);
   const [notes, setNotes] = useState('');
   const [toast, setToast] = useState({
     open: false,
@@ -79,8 +81,7 @@ const StockManagementTab = () => {
 
   const fetchProducts1 = async () => {
     try {
-      const response = await api.get(`/products/`);
-      setProducts1(response.data);
+      setProducts1(await fetchAll(`/products/`));
     } catch (error) {
       console.error("Error fetching products:", error);
       setProducts1([]);
@@ -100,10 +101,12 @@ const StockManagementTab = () => {
   };
 
 
-  const fetchStockHistory = async (variantId) => {
+  // Both lists are paginated: the first page replaces the list, `next` links append to it
+  const fetchStockHistory = async (variantId, url = null) => {
     try {
-      const response = await api.get(`/stock/stock-history/${variantId}/`);
-      setStockHistory(response.data);
+      const page = await fetchPage(url || `/stock/stock-history/${variantId}/`);
+      setStockHistory(history => url ? [...history, ...page.results] : page.results);
+      setStockHistoryNext(page.next);
     } catch (error) {
       console.error("Error fetching stock history:", error);
       showToast('Error', 'Failed to fetch stock history', 'destructive');
@@ -111,10 +114,11 @@ const StockManagementTab = () => {
   };
 
 
-  const fetchLowStockAlerts = async () => {
+  const fetchLowStockAlerts = async (url = null) => {
     try {
-      const response = await api.get('/low-stock-alerts/current-alerts/');
-      setLowStockAlerts(response.data);
+      const page = await fetchPage(url || '/low-stock-alerts/current-alerts/');
+      setLowStockAlerts(alerts => url ? [...alerts, ...page.results] : page.results);
+      setLowStockAlertsNext(page.next);
     } catch (error) {
       console.error("Error fetching low stock alerts:", error);
       showToast('Error', 'Failed to fetch low stock alerts', 'destructive');
@@ -142,6 +146,7 @@ const StockManagementTab = () => {
       fetchProductVariants(selectedProduct);
       fetchStockHistory(selectedVariant);
       fetchLowStockAlerts();
+      refreshData && refreshData();
 
       // Reset form
       setQuantity(1);
@@ -167,7 +172,7 @@ const StockManagementTab = () => {
           </CardHeader>
           <CardContent>
             {lowStockAlerts.map(alert => (
-              <div key={alert.id} className="flex justify-between items-center p-2 border-b">
+              <div key={alert.product_variant} className="flex justify-between items-center p-2 border-b">
                 <div>
                   <p className="font-medium">
                     {alert.product_variant_details.product_name}
@@ -179,6 +184,11 @@ const StockManagementTab = () => {
                 </div>
               </div>
             ))}
+            {lowStockAlertsNext && (
+              <Button variant="outline" className="w-full mt-2" onClick={() => fetchLowStockAlerts(lowStockAlertsNext)}>
+                Load more alerts
+              </Button>
+            )}
           </CardContent>
         </Card>
       )}
@@ -341,6 +351,15 @@ const StockManagementTab = () => {
                 )}
               </TableBody>
             </Table>
+            {stockHistoryNext && (
+              <Button
+                variant="outline"
+                className="w-full mt-2"
+                onClick={() => fetchStockHistory(selectedVariant, stockHistoryNext)}
+              >
+                Load more
+              </Button>
+            )}
           </CardContent>
         </Card>
       )}
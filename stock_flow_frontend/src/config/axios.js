@@ -43,5 +43,30 @@ api.interceptors.request.use(config => {
     
 }, error => Promise.reject(error));
 
+// List endpoints are paginated ({ results, next }); follow the `next` links to load a whole list
+const fetchAll = async (url) => {
+    const items = [];
+    let next = url;
+    while (next) {
+        const response = await api.get(next);
+        if (Array.isArray(response.data)) {
+            return response.data;
+        }
+        items.push(...response.data.results);
+        next = response.data.next;
+    }
+    return items;
+};
+
+// Load a single page of a paginated list; pass the returned `next` link back in for the page after it
+const fetchPage = async (url) => {
+    const response = await api.get(url);
+    if (Array.isArray(response.data)) {
+        return { results: response.data, next: null, previous: null };
+    }
+    const { results, next = null, previous = null } = response.data;
+    return { results, next, previous };
+};
+
 export default api;
-export { BASE_URL };
\ No newline at end of file
+export { BASE_URL, fetchAll, fetchPage };
\ No newline at end of file